@@ -0,0 +1,128 @@
+"""
+Benchmark of CastFleet commands against a loop over the casts.
+
+The casts are stubs behind a simulated network which answers each message
+after a fixed round trip time. The loop waits for each device to answer
+before commanding the next one, as a script using blocking calls would.
+"""
+import argparse
+import heapq
+import threading
+import time
+from uuid import uuid4
+
+from pychromecast.fleet import CastFleet
+
+parser = argparse.ArgumentParser(description="Benchmark CastFleet commands.")
+parser.add_argument("--devices", help="Number of devices", type=int, default=300)
+parser.add_argument("--rtt", help="Round trip time in ms", type=float, default=20)
+parser.add_argument("--parallel", help="Commands in flight", type=int, default=300)
+args = parser.parse_args()
+
+
+class StubNetwork:
+    """ Calls the answer of each message after the round trip time. """
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self._answers = []
+        self._condition = threading.Condition()
+        self._count = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, answer):
+        """ Call answer after one round trip. """
+        with self._condition:
+            self._count += 1
+            heapq.heappush(
+                self._answers, (time.monotonic() + self.rtt, self._count, answer)
+            )
+            self._condition.notify()
+
+    def _run(self):
+        """ Deliver the answers. """
+        while True:
+            with self._condition:
+                while not self._answers:
+                    self._condition.wait()
+                deadline, _, answer = self._answers[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                heapq.heappop(self._answers)
+            answer()
+
+
+class StubReceiverController:
+    """ The parts of ReceiverController used by the benchmark. """
+
+    def __init__(self, network):
+        self.network = network
+        self.volume = None
+
+    def set_volume(self, volume, callback_function=None):
+        """ Set the volume once the device answers. """
+
+        def answer():
+            self.volume = volume
+            callback_function({"type": "RECEIVER_STATUS"})
+
+        self.network.send(answer)
+        return volume
+
+
+class StubSocketClient:
+    """ Holds the receiver controller. """
+
+    def __init__(self, network):
+        self.receiver_controller = StubReceiverController(network)
+
+
+class StubCast:
+    """ The parts of Chromecast used by CastFleet. """
+
+    def __init__(self, network, index):
+        self.uuid = uuid4()
+        self.name = "Speaker {}".format(index)
+        self.model_name = "Google Home Mini"
+        self.socket_client = StubSocketClient(network)
+
+
+def loop(casts, volume):
+    """ Set the volume of each cast, waiting for each answer. """
+    for cast in casts:
+        answered = threading.Event()
+        cast.socket_client.receiver_controller.set_volume(
+            volume, callback_function=lambda response, event=answered: event.set()
+        )
+        answered.wait()
+
+
+stub_network = StubNetwork(args.rtt / 1000)
+stub_casts = [StubCast(stub_network, index) for index in range(args.devices)]
+fleet = CastFleet(stub_casts, max_parallel=args.parallel)
+
+print(
+    "{} devices, {:.0f} ms round trip, {} commands in flight".format(
+        args.devices, args.rtt, args.parallel
+    )
+)
+
+start = time.monotonic()
+loop(stub_casts, 0.2)
+loop_time = time.monotonic() - start
+
+start = time.monotonic()
+result = fleet.set_volume(0.4)
+fleet_time = time.monotonic() - start
+
+print("Loop:      {:>8.1f} ms".format(loop_time * 1000))
+print(
+    "CastFleet: {:>8.1f} ms, {} succeeded, {} failed, {} timed out".format(
+        fleet_time * 1000,
+        len(result.succeeded),
+        len(result.failed),
+        len(result.timed_out),
+    )
+)
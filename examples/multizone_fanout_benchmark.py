@@ -0,0 +1,139 @@
+"""
+Benchmark of the audio group status fan-out of MultizoneManager.
+
+Builds growing numbers of audio groups over 120 speakers, each speaker with
+its own listener plus one dashboard listener registered for every speaker.
+Then each group sends one media status. It compares the fan-out of
+MultizoneManager with the per member walk Listener.new_media_status used to
+do.
+"""
+# pylint: disable=protected-access
+import argparse
+import random
+import timeit
+from uuid import uuid4
+
+from pychromecast.controllers.multizone import MultizoneManager
+
+parser = argparse.ArgumentParser(description="Benchmark the multizone fan-out.")
+parser.add_argument("--speakers", help="Number of speakers", type=int, default=120)
+parser.add_argument("--members", help="Speakers per group", type=int, default=8)
+parser.add_argument("--bursts", help="Status bursts per run", type=int, default=20)
+args = parser.parse_args()
+
+
+class StubMediaController:
+    """ Media controller of a stub group. """
+
+    def register_status_listener(self, listener):
+        """ Not needed by the benchmark. """
+
+
+class StubGroup:
+    """ The parts of a group Chromecast used by MultizoneManager. """
+
+    def __init__(self):
+        self.uuid = uuid4()
+        self.media_controller = StubMediaController()
+        self.controller = None
+
+    def register_status_listener(self, listener):
+        """ Not needed by the benchmark. """
+
+    def register_connection_listener(self, listener):
+        """ Not needed by the benchmark. """
+
+    def register_handler(self, controller):
+        """ Keep the MultizoneController to feed it member updates. """
+        self.controller = controller
+
+
+class CountingListener:
+    """ Counts the calls it receives. """
+
+    def __init__(self):
+        self.calls = 0
+
+    def multizone_new_media_status(self, group_uuid, media_status):
+        """ Count a group status. """
+        self.calls += 1
+
+    def added_to_multizone(self, group_uuid):
+        """ Not needed by the benchmark. """
+
+    def removed_from_multizone(self, group_uuid):
+        """ Not needed by the benchmark. """
+
+
+def legacy_fanout(casts, group_uuid, members, media_status):
+    """ The walk Listener.new_media_status used to do for each status. """
+    for member_uuid in members:
+        if member_uuid not in casts:
+            continue
+        for listener in list(casts[member_uuid]["listeners"]):
+            listener.multizone_new_media_status(group_uuid, media_status)
+
+
+def run(group_count):
+    """ Build group_count groups and time status bursts. """
+    random.seed(group_count)
+    speakers = [str(uuid4()) for _ in range(args.speakers)]
+    dashboard = CountingListener()
+    listeners = {speaker: CountingListener() for speaker in speakers}
+
+    manager = MultizoneManager()
+    legacy = {}
+    for speaker in speakers:
+        manager.register_listener(speaker, listeners[speaker])
+        manager.register_listener(speaker, dashboard)
+        legacy[speaker] = {"listeners": [listeners[speaker], dashboard]}
+
+    groups = []
+    for _ in range(group_count):
+        group = StubGroup()
+        manager.add_multizone(group)
+        members = random.sample(speakers, args.members)
+        for member in members:
+            group.controller._add_member(member, member)
+        groups.append((group, members))
+
+    fanouts = [
+        manager._groups[str(group.uuid)]["listener"]
+        for group, _ in groups
+    ]
+
+    def burst_manager():
+        for fanout in fanouts:
+            fanout.new_media_status(None)
+
+    def burst_legacy():
+        for group, members in groups:
+            legacy_fanout(legacy, str(group.uuid), members, None)
+
+    dashboard.calls = 0
+    legacy_time = timeit.timeit(burst_legacy, number=args.bursts) / args.bursts
+    legacy_calls = dashboard.calls // args.bursts
+    dashboard.calls = 0
+    manager_time = timeit.timeit(burst_manager, number=args.bursts) / args.bursts
+    manager_calls = dashboard.calls // args.bursts
+
+    print(
+        "  {:>4} groups: {:>8.1f} us -> {:>8.1f} us per burst,"
+        " dashboard calls {:>5} -> {:>4}".format(
+            group_count,
+            legacy_time * 1e6,
+            manager_time * 1e6,
+            legacy_calls,
+            manager_calls,
+        )
+    )
+
+
+print(
+    "{} speakers, {} per group, one status per group per burst".format(
+        args.speakers, args.members
+    )
+)
+print("Fan-out per burst, legacy walk -> MultizoneManager:")
+for count in (10, 20, 40, 80, 160):
+    run(count)
@@ -0,0 +1,142 @@
+"""
+Benchmark of the discovery service registry on a busy campus network.
+
+Registers 2,000 cast services spread over 16 subnets, then compares the
+indexed ServiceRegistry with the linear scans over a dict of tuples which
+CastListener used before.
+"""
+import argparse
+import random
+import timeit
+from uuid import uuid4
+
+from pychromecast.service_registry import ServiceRegistry
+
+parser = argparse.ArgumentParser(description="Benchmark the discovery registry.")
+parser.add_argument("--services", help="Number of services", type=int, default=2000)
+parser.add_argument("--repeat", help="Number of lookups", type=int, default=1000)
+args = parser.parse_args()
+
+MODELS = ["Chromecast", "Chromecast Ultra", "Google Home", "Google Nest Mini"]
+
+random.seed(0)
+records = []
+for index in range(args.services):
+    uuid = uuid4()
+    records.append(
+        (
+            "Chromecast-{}._googlecast._tcp.local.".format(uuid.hex),
+            uuid,
+            random.choice(MODELS),
+            "Room {}".format(index),
+            "10.{}.{}.{}".format(index % 16, index // 250, index % 250 + 1),
+            8009,
+        )
+    )
+
+
+def legacy_add(services, name, uuid, model_name, friendly_name, host, port):
+    """ The tuple based bookkeeping CastListener used to do. """
+    services_for_uuid = services.setdefault(
+        uuid, ({name}, uuid, model_name, friendly_name)
+    )
+    services_for_uuid[0].add(name)
+    services[uuid] = (services_for_uuid[0], uuid, model_name, friendly_name, host, port)
+
+
+def legacy_remove(services, name):
+    """ The linear scan CastListener.remove_service used to do. """
+    for uuid, services_for_uuid in services.items():
+        if name in services_for_uuid[0]:
+            services_for_uuid[0].remove(name)
+            if not services_for_uuid[0]:
+                services.pop(uuid)
+            break
+
+
+legacy = {}
+registry = ServiceRegistry()
+
+
+def add_all_legacy():
+    """ Register all services in a dict of tuples. """
+    for record in records:
+        legacy_add(legacy, *record)
+
+
+def add_all_registry():
+    """ Register all services in the registry. """
+    for record in records:
+        registry.add(*record)
+
+
+def report(label, seconds, count):
+    """ Print the time per operation. """
+    print("  {:<28} {:>10.2f} us/op".format(label, seconds / count * 1e6))
+
+
+print(
+    "{} services, {} lookups per query".format(len(records), args.repeat),
+)
+
+print("Register all services:")
+report("dict of tuples", timeit.timeit(add_all_legacy, number=1), len(records))
+report("ServiceRegistry", timeit.timeit(add_all_registry, number=1), len(records))
+
+names = [random.choice(records)[3] for _ in range(args.repeat)]
+print("Find by friendly name:")
+report(
+    "dict of tuples",
+    timeit.timeit(
+        lambda: [
+            [service for service in legacy.values() if service[3] == name]
+            for name in names
+        ],
+        number=1,
+    ),
+    args.repeat,
+)
+report(
+    "ServiceRegistry.by_name",
+    timeit.timeit(lambda: [registry.by_name(name) for name in names], number=1),
+    args.repeat,
+)
+
+print("Find by model:")
+report(
+    "dict of tuples",
+    timeit.timeit(
+        lambda: [
+            [service for service in legacy.values() if service[2] == model]
+            for model in MODELS
+        ],
+        number=1,
+    ),
+    len(MODELS),
+)
+report(
+    "ServiceRegistry.by_model",
+    timeit.timeit(lambda: [registry.by_model(model) for model in MODELS], number=1),
+    len(MODELS),
+)
+
+print("Find in subnet 10.3.0.0/16:")
+report(
+    "ServiceRegistry.in_subnet",
+    timeit.timeit(lambda: registry.in_subnet("10.3.0.0/16"), number=10),
+    10,
+)
+
+removed = random.sample(records, len(records) // 2)
+print("Remove half of the services:")
+report(
+    "dict of tuples",
+    timeit.timeit(lambda: [legacy_remove(legacy, item[0]) for item in removed], number=1),
+    len(removed),
+)
+report(
+    "ServiceRegistry",
+    timeit.timeit(lambda: [registry.remove(item[0]) for item in removed], number=1),
+    len(removed),
+)
+assert len(legacy) == len(registry)
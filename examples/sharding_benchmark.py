@@ -0,0 +1,169 @@
+"""
+Benchmark of the status throughput of ShardedFleet against its number of
+workers.
+
+The devices are stubs created in the workers. A thread in each worker feeds
+every stub a stream of MEDIA_STATUS messages, which are decoded and applied
+to a MediaStatus as the socket client and media controller would. The
+benchmark counts the status changes received by the coordinator. The
+throughput only grows with the workers on a host with as many CPUs.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from uuid import UUID
+
+from pychromecast.controllers.media import MediaStatus
+from pychromecast.sharding import ShardedFleet
+
+# A media status as sent by a device playing music
+MESSAGE = {
+    "type": "MEDIA_STATUS",
+    "requestId": 0,
+    "status": [
+        {
+            "mediaSessionId": 1,
+            "playbackRate": 1,
+            "playerState": "PLAYING",
+            "currentTime": 0,
+            "supportedMediaCommands": 274447,
+            "volume": {"level": 1, "muted": False},
+            "activeTrackIds": [],
+            "media": {
+                "contentId": "https://example.com/stream.mp3",
+                "streamType": "BUFFERED",
+                "contentType": "audio/mpeg",
+                "metadata": {
+                    "metadataType": 3,
+                    "title": "A song",
+                    "artist": "An artist",
+                    "albumName": "An album",
+                    "images": [{"url": "https://example.com/cover.jpg"}],
+                },
+                "duration": 215.5,
+                "tracks": [],
+            },
+            "repeatMode": "REPEAT_OFF",
+        }
+    ],
+}
+
+
+class StubMediaController:
+    """ Media controller of a stub device. """
+
+    def __init__(self):
+        self.status = MediaStatus()
+        self.listeners = []
+
+    def register_status_listener(self, listener):
+        """ Register a media status listener. """
+        self.listeners.append(listener)
+
+
+class StubCast:
+    """ The parts of Chromecast used by the workers of ShardedFleet. """
+
+    # Stub devices of the worker process, fed by one thread
+    devices = []
+
+    def __init__(self, service):
+        self.uuid = service[1]
+        self.status = None
+        self.media_controller = StubMediaController()
+        self.position = 0
+
+    def register_status_listener(self, listener):
+        """ Not needed by the benchmark. """
+
+    def register_connection_listener(self, listener):
+        """ Not needed by the benchmark. """
+
+    def receive(self):
+        """ Decode and apply a media status message. """
+        self.position += 1
+        MESSAGE["status"][0]["currentTime"] = self.position
+        data = json.loads(json.dumps(MESSAGE))
+        controller = self.media_controller
+        controller.status.update(data)
+        for listener in controller.listeners:
+            listener.new_media_status(controller.status)
+
+    def disconnect(self, timeout=None):
+        """ Stop feeding the device. """
+        if self in StubCast.devices:
+            StubCast.devices.remove(self)
+
+    def join(self, timeout=None):
+        """ Nothing to wait for. """
+
+
+def feed():
+    """ Feed the stub devices of the worker process. """
+    while True:
+        devices = list(StubCast.devices)
+        if not devices:
+            time.sleep(0.01)
+        for device in devices:
+            device.receive()
+
+
+def create_stub(service):
+    """ Cast factory of the workers. """
+    if not StubCast.devices:
+        threading.Thread(target=feed, daemon=True).start()
+    cast = StubCast(service)
+    StubCast.devices.append(cast)
+    return cast
+
+
+class Counter:
+    """ Counts the media status changes received by the coordinator. """
+
+    def __init__(self):
+        self.count = 0
+
+    def new_media_status(self, status):
+        """ Count a change. """
+        self.count += 1
+
+
+def run(workers, devices, duration):
+    """ Returns the status changes per second received with workers. """
+    fleet = ShardedFleet(workers, cast_factory=create_stub)
+    fleet.start()
+    counter = Counter()
+    for index in range(devices):
+        uuid = UUID(int=index + 1)
+        service = (set(), uuid, "Google Home", "Speaker {}".format(index), None, None)
+        fleet.add_device(service).media_controller.register_status_listener(counter)
+
+    # Let the workers start feeding
+    time.sleep(1)
+    start_count = counter.count
+    time.sleep(duration)
+    rate = (counter.count - start_count) / duration
+    fleet.stop()
+    return rate
+
+
+def main():
+    """ Run the benchmark for growing numbers of workers. """
+    parser = argparse.ArgumentParser(description="Benchmark ShardedFleet.")
+    parser.add_argument("--devices", help="Number of devices", type=int, default=1000)
+    parser.add_argument("--duration", help="Seconds per run", type=float, default=3)
+    parser.add_argument(
+        "--workers", help="Worker counts", type=int, nargs="+", default=[1, 2, 4]
+    )
+    args = parser.parse_args()
+
+    print("{} devices, {} CPUs".format(args.devices, os.cpu_count()))
+    for workers in args.workers:
+        rate = run(workers, args.devices, args.duration)
+        print("  {:>2} workers: {:>9.0f} status changes/s".format(workers, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Runs a fleet of simulated Chromecasts on a SimulatedClock, and checks that
+advancing the clock drives the heartbeats and reconnects of the socket
+clients without sleeping.
+
+Each step advances the virtual time and waits for the fleet to settle, so
+the run is deterministic: the same virtual time passes through the same
+heartbeats, heartbeat timeouts and reconnects on every run.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from pychromecast import Chromecast
+from pychromecast.clock import SimulatedClock
+from pychromecast.simulation import SimulatedDevice, SimulatedNetwork
+from pychromecast.socket_client import (
+    HB_PING_TIME,
+    HB_PONG_TIME,
+    POLL_TIME_BLOCKING,
+)
+
+# Virtual seconds between connection attempts
+RETRY_WAIT = 5
+
+
+class Fleet:
+    """ Simulated devices and the Chromecasts connected to them. """
+
+    def __init__(self, devices):
+        self.clock = SimulatedClock()
+        self.network = SimulatedNetwork()
+        self.network.start()
+        self.devices = [
+            self.network.add_device(
+                SimulatedDevice(
+                    "10.{}.{}.{}".format(
+                        index // 65536, index // 256 % 256, index % 256
+                    )
+                )
+            )
+            for index in range(devices)
+        ]
+        self.casts = [
+            Chromecast(
+                device.host,
+                device.port,
+                device=device.device_status(),
+                retry_wait=RETRY_WAIT,
+                clock=self.clock,
+                socket_factory=self.network.socket_factory,
+            )
+            for device in self.devices
+        ]
+
+    def start(self):
+        """ Connect to all devices. """
+        for cast in self.casts:
+            cast.start()
+        self.settle()
+
+    def stop(self):
+        """ Disconnect from all devices. """
+        for cast in self.casts:
+            cast.disconnect(timeout=5)
+        self.network.stop()
+
+    def settle(self):
+        """ Wait until all worker threads are blocked on the clock. """
+        if not self.network.settle(self.clock, len(self.casts)):
+            raise RuntimeError("The fleet did not settle")
+
+    def advance(self, seconds, step=1):
+        """ Advance the virtual time in steps, letting the fleet settle. """
+        for _ in range(int(seconds / step)):
+            self.clock.advance(step)
+            self.settle()
+
+
+def check(name, ok):
+    """ Print the outcome of a check. Returns ok. """
+    print("  {:<52} {}".format(name, "ok" if ok else "FAILED"))
+    return ok
+
+
+def main():
+    """ Run the scenario. """
+    parser = argparse.ArgumentParser(description="Simulate a fleet of Chromecasts.")
+    parser.add_argument("--devices", help="Number of devices", type=int, default=1000)
+    parser.add_argument("--debug", help="Enable debug logging", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+
+    start = time.monotonic()
+    fleet = Fleet(args.devices)
+    fleet.start()
+    results = [
+        check(
+            "all devices connected",
+            all(cast.socket_client.is_connected for cast in fleet.casts),
+        ),
+        check(
+            "all devices reported a status",
+            all(cast.status is not None for cast in fleet.casts),
+        ),
+    ]
+
+    # Heartbeats are sent every HB_PING_TIME, checked every POLL_TIME_BLOCKING
+    pings = [device.pings for device in fleet.devices]
+    fleet.advance(60)
+    results.append(
+        check(
+            "heartbeats sent during 60 virtual seconds",
+            all(
+                device.pings - before >= 60 // (HB_PING_TIME + POLL_TIME_BLOCKING)
+                for device, before in zip(fleet.devices, pings)
+            ),
+        )
+    )
+    results.append(
+        check(
+            "no reconnects while the devices answer",
+            all(device.connections == 1 for device in fleet.devices),
+        )
+    )
+
+    # A tenth of the devices stop answering, their heartbeats time out
+    tenth = max(len(fleet.devices) // 10, 1)
+    silent = fleet.devices[:tenth]
+    for device in silent:
+        device.responsive = False
+    fleet.advance(HB_PING_TIME + HB_PONG_TIME + 2 * POLL_TIME_BLOCKING)
+    for device in silent:
+        device.responsive = True
+    results.append(
+        check(
+            "silent devices reconnected after a heartbeat timeout",
+            all(device.connections >= 2 for device in silent),
+        )
+    )
+    results.append(
+        check(
+            "other devices kept their connection",
+            all(device.connections == 1 for device in fleet.devices[tenth:]),
+        )
+    )
+
+    # Another tenth drops off the network, then comes back
+    offline = fleet.devices[tenth : 2 * tenth]
+    for device in offline:
+        device.reachable = False
+        fleet.network.disconnect(device)
+    fleet.advance(3 * RETRY_WAIT)
+    results.append(
+        check(
+            "unreachable devices are disconnected",
+            not any(
+                cast.socket_client.is_connected
+                for cast in fleet.casts[tenth : 2 * tenth]
+            ),
+        )
+    )
+    for device in offline:
+        device.reachable = True
+    fleet.advance(2 * RETRY_WAIT)
+    results.append(
+        check(
+            "all devices connected after the outage",
+            all(cast.socket_client.is_connected for cast in fleet.casts),
+        )
+    )
+
+    fleet.stop()
+    elapsed = time.monotonic() - start
+    print(
+        "{} devices, {:.0f} virtual seconds in {:.1f} seconds".format(
+            len(fleet.devices), fleet.clock.time(), elapsed
+        )
+    )
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
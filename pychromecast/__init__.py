@@ -3,26 +3,37 @@ PyChromecast: remote control your Chromecast
 """
 import logging
 import fnmatch
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from threading import Event
+from uuid import UUID
+import weakref
 
 # pylint: disable=wildcard-import
 import threading
 
-import zeroconf
 
 from .config import *  # noqa
 from .error import *  # noqa
 from . import socket_client
 from .discovery import (  # noqa
     DISCOVER_TIMEOUT,
+    RESOLVE_WORKERS,
     CastListener,
     discover_chromecasts,
+    name_prefix_filter,
     start_discovery,
     stop_discovery,
+    stream_chromecasts,
+    uuid_filter,
 )
 from .dial import get_device_status, DeviceStatus
 from .const import CAST_MANUFACTURERS, CAST_TYPES, CAST_TYPE_CHROMECAST
 from .controllers.media import STREAM_TYPE_BUFFERED  # noqa
+from .clock import SYSTEM_CLOCK
+from .resources import REGISTRY
+from .zeroconf_manager import ZEROCONF
+from .scheduler import PRIORITY_NORMAL
 
 __all__ = ("__version__", "__version_info__", "get_chromecasts", "Chromecast")
 __version_info__ = ("0", "7", "6")
@@ -30,11 +41,19 @@ __version__ = ".".join(__version_info__)
 
 IDLE_APP_ID = "E8C28D3C"
 IGNORE_CEC = []
+# Number of devices whose identity is checked in parallel
+RECONCILE_WORKERS = 8
+
+# A device whose DIAL identity differs from the one it was created with
+IdentityChange = namedtuple("IdentityChange", ["cast", "expected", "actual"])
 
 _LOGGER = logging.getLogger(__name__)
 
 
-def get_chromecast_from_host(host, tries=None, retry_wait=None, timeout=None):
+# pylint: disable=too-many-arguments
+def get_chromecast_from_host(
+    host, tries=None, retry_wait=None, timeout=None, scheduler=None, clock=None
+):
     """Creates a Chromecast object from a zeroconf host."""
     # Build device status from the mDNS info, this information is
     # the primary source and the remaining will be fetched
@@ -57,6 +76,8 @@ def get_chromecast_from_host(host, tries=None, retry_wait=None, timeout=None):
         tries=tries,
         timeout=timeout,
         retry_wait=retry_wait,
+        scheduler=scheduler,
+        clock=clock,
     )
 
 
@@ -64,14 +85,27 @@ def get_chromecast_from_host(host, tries=None, retry_wait=None, timeout=None):
 _get_chromecast_from_host = get_chromecast_from_host  # pylint: disable=invalid-name
 
 
+# pylint: disable=too-many-locals
 def get_chromecast_from_service(
-    services, zconf, tries=None, retry_wait=None, timeout=None
+    services,
+    zconf,
+    tries=None,
+    retry_wait=None,
+    timeout=None,
+    scheduler=None,
+    clock=None,
+    listener=None,
 ):
-    """Creates a Chromecast object from a zeroconf service."""
+    """
+    Creates a Chromecast object from a zeroconf service.
+
+    If the CastListener the service was found by is passed as listener, it
+    pushes address changes of the device to the Chromecast's socket client.
+    """
     # Build device status from the mDNS service name info, this
     # information is the primary source and the remaining will be
     # fetched later on.
-    services, uuid, model_name, friendly_name, _, _ = services
+    services, uuid, model_name, friendly_name, host, port = services
     _LOGGER.debug("_get_chromecast_from_service %s", services)
     cast_type = CAST_TYPES.get(model_name.lower(), CAST_TYPE_CHROMECAST)
     manufacturer = CAST_MANUFACTURERS.get(model_name.lower(), "Google Inc.")
@@ -82,15 +116,23 @@ def get_chromecast_from_service(
         uuid=uuid,
         cast_type=cast_type,
     )
-    return Chromecast(
-        host=None,
+    # The host is used as is if the device was found without mDNS, for example
+    # through SSDP, otherwise it is resolved from the services on connect
+    cast = Chromecast(
+        host=None if services else host,
+        port=None if services else port,
         device=device,
         tries=tries,
         timeout=timeout,
         retry_wait=retry_wait,
         services=services,
         zconf=zconf,
+        scheduler=scheduler,
+        clock=clock,
     )
+    if listener is not None:
+        listener.register_client(uuid, cast.socket_client)
+    return cast
 
 
 # Alias for backwards compatibility
@@ -99,6 +141,103 @@ _get_chromecast_from_service = (  # pylint: disable=invalid-name
 )
 
 
+def get_chromecasts_from_hosts(
+    hosts,
+    tries=None,
+    retry_wait=None,
+    timeout=None,
+    scheduler=None,
+    clock=None,
+    start_connections=True,
+    reconcile=True,
+):
+    """
+    Creates a Chromecast object for each known host of a statically configured
+    fleet, without discovery and without querying DIAL first. The
+    connections are made in parallel by the worker threads of the
+    Chromecasts.
+
+    Returns a tuple of:
+      A list of Chromecast objects.
+      A concurrent.futures.Future, or None if reconcile is False. It resolves
+      to a list of IdentityChange tuples (cast, expected, actual) for the
+      devices whose UUID or friendly name reported by DIAL differs from the
+      manifest. Friendly names are updated on the Chromecast objects, devices
+      with another UUID are only reported.
+
+    :param hosts: An iterable of (ip_address, port, uuid, model_name,
+                  friendly_name) tuples, as accepted by
+                  get_chromecast_from_host.
+    :param start_connections: If True, the worker thread of each Chromecast is
+                              started right away.
+    :param reconcile: If True, check the identity of the devices with DIAL in
+                      the background.
+
+    See get_chromecasts for the other parameters.
+    """
+    cc_list = []
+    for host, port, uuid, model_name, friendly_name in hosts:
+        cast = get_chromecast_from_host(
+            (host, port, UUID(str(uuid)), model_name, friendly_name),
+            tries=tries,
+            retry_wait=retry_wait,
+            timeout=timeout,
+            scheduler=scheduler,
+            clock=clock,
+        )
+        if start_connections:
+            cast.start()
+        cc_list.append(cast)
+
+    if not reconcile:
+        return (cc_list, None)
+    return (cc_list, _reconcile_identities(cc_list))
+
+
+def _check_identity(cast):
+    """
+    Compare the identity of cast with the one reported by DIAL. Returns an
+    IdentityChange, or None if the identity is unchanged or the device could
+    not be reached.
+    """
+    status = get_device_status(cast.host)
+    if status is None:
+        return None
+    uuid_changed = status.uuid is not None and status.uuid != cast.uuid
+    if not uuid_changed and status.friendly_name == cast.name:
+        return None
+
+    change = IdentityChange(cast, cast.device, status)
+    if not uuid_changed:
+        cast.device = cast.device._replace(friendly_name=status.friendly_name)
+    _LOGGER.info("Identity of %s changed to %s", change.expected, status)
+    return change
+
+
+def _reconcile_identities(casts):
+    """
+    Check the identity of casts with DIAL in the background. Returns a Future
+    resolving to a list of IdentityChange tuples.
+    """
+    future = Future()
+
+    def reconcile():
+        """ Check all casts and resolve future. """
+        try:
+            with ThreadPoolExecutor(
+                RECONCILE_WORKERS, thread_name_prefix="ReconcileIdentities"
+            ) as executor:
+                changes = list(executor.map(_check_identity, casts))
+        except Exception as err:  # pylint: disable=broad-except
+            future.set_exception(err)
+            return
+        future.set_result([change for change in changes if change is not None])
+
+    threading.Thread(target=reconcile, name="ReconcileIdentities", daemon=True).start()
+    return future
+
+
+# pylint: disable=too-many-locals
 def get_listed_chromecasts(
     friendly_names=None,
     uuids=None,
@@ -106,6 +245,8 @@ def get_listed_chromecasts(
     retry_wait=None,
     timeout=None,
     discovery_timeout=DISCOVER_TIMEOUT,
+    scheduler=None,
+    clock=None,
 ):
     """
     Searches the network for chromecast devices matching a list of friendly
@@ -128,9 +269,20 @@ def get_listed_chromecasts(
     :param timeout: passed to get_chromecasts
     :param discovery_timeout: A floating point number specifying the time to wait
                                devices matching the criteria have been found.
+    :param scheduler: A ConnectionScheduler shared by the returned Chromecasts.
+    :param clock: The clock used to wait for discovery_timeout and by the
+                  returned Chromecasts. None means to use the clock of the
+                  scheduler, or the system clock.
     """
+    if clock is None:
+        clock = getattr(scheduler, "clock", SYSTEM_CLOCK)
 
     cc_list = {}
+    # The devices not found yet, the caller's lists are left untouched
+    wanted_uuids = set(uuids or ())
+    wanted_names = set(friendly_names or ())
+    # Resource limit errors are raised in the calling thread
+    limit_errors = []
 
     def callback(uuid, name):  # pylint: disable=unused-argument
         _LOGGER.debug("Found chromecast %s", uuid)
@@ -142,38 +294,66 @@ def get_listed_chromecasts(
                 tries=tries,
                 retry_wait=retry_wait,
                 timeout=timeout,
+                scheduler=scheduler,
+                clock=clock,
+                listener=listener,
             )
 
-        service = listener.services[uuid]
-        friendly_name = service[3]
+        cast = listener.registry.get(uuid)
+        if cast is None:
+            return
         try:
-            if uuids and uuid in uuids:
+            if uuid in wanted_uuids:
                 if uuid not in cc_list:
                     cc_list[uuid] = get_chromecast_from_uuid(uuid)
-                uuids.remove(uuid)
-            if friendly_names and friendly_name in friendly_names:
+                wanted_uuids.discard(uuid)
+            if cast.friendly_name in wanted_names:
                 if uuid not in cc_list:
                     cc_list[uuid] = get_chromecast_from_uuid(uuid)
-                friendly_names.remove(friendly_name)
-            if not friendly_names and not uuids:
+                wanted_names.discard(cast.friendly_name)
+            if not wanted_names and not wanted_uuids:
                 discover_complete.set()
         except ChromecastConnectionError:  # noqa
             pass
+        except ResourceLimitError as err:  # noqa
+            limit_errors.append(err)
+            discover_complete.set()
 
     discover_complete = Event()
 
-    listener = CastListener(callback)
-    zconf = zeroconf.Zeroconf()
-    browser = start_discovery(listener, zconf)
+    service_filter = None
+    if wanted_uuids and not wanted_names:
+        # Only resolve the services of the wanted devices
+        service_filter = uuid_filter(wanted_uuids)
+    listener = CastListener(
+        callback, service_filter=service_filter, resolve_workers=RESOLVE_WORKERS
+    )
+    REGISTRY.check_browser_limit()
+    zconf = ZEROCONF.acquire()
+    try:
+        browser = start_discovery(listener, zconf)
+    except ResourceLimitError:  # noqa
+        ZEROCONF.release(zconf)
+        raise
 
     # Wait for the timeout or found all wanted devices
-    discover_complete.wait(discovery_timeout)
+    clock.wait(discover_complete, discovery_timeout)
+    if limit_errors:
+        stop_discovery(browser)
+        raise limit_errors[0]
     return (cc_list.values(), browser)
 
 
 # pylint: disable=too-many-locals
 def get_chromecasts(
-    tries=None, retry_wait=None, timeout=None, blocking=True, callback=None
+    tries=None,
+    retry_wait=None,
+    timeout=None,
+    blocking=True,
+    callback=None,
+    scheduler=None,
+    clock=None,
+    start_connections=False,
 ):
     """
     Searches the network for chromecast devices and creates a Chromecast object
@@ -204,24 +384,46 @@ def get_chromecasts(
                      and returns a function which can be executed to stop discovery.
     :param callback: Callback which is triggerd for each discovered chromecast when
                      blocking = False.
+    :param scheduler: A ConnectionScheduler shared by the created Chromecasts, to
+                      spread out their connection attempts and status polling.
+    :param clock: The clock used to wait for discovery and by the created
+                  Chromecasts. None means to use the clock of the scheduler, or
+                  the system clock.
+    :param start_connections: If True and blocking, the worker thread of each
+                              Chromecast is started as soon as the device is
+                              discovered, so connecting overlaps discovery.
+                              Leave False to start the Chromecasts yourself, or
+                              to run them from your own main loop.
     """
+    if clock is None:
+        clock = getattr(scheduler, "clock", SYSTEM_CLOCK)
+
     if blocking:
-        # Thread blocking chromecast discovery
-        services, browser = discover_chromecasts()
+        # Thread blocking chromecast discovery, the Chromecast objects are
+        # created, and optionally started, as soon as each device is discovered
+        stream = stream_chromecasts(clock=clock)
+        browser = stream.browser
         cc_list = []
-        for service in services:
+        for service in stream:
             try:
-                cc_list.append(
-                    get_chromecast_from_service(
-                        service,
-                        browser.zc,
-                        tries=tries,
-                        retry_wait=retry_wait,
-                        timeout=timeout,
-                    )
+                cast = get_chromecast_from_service(
+                    service,
+                    browser.zc,
+                    tries=tries,
+                    retry_wait=retry_wait,
+                    timeout=timeout,
+                    scheduler=scheduler,
+                    clock=clock,
+                    listener=stream.listener,
                 )
+                if start_connections:
+                    cast.start()
+                cc_list.append(cast)
             except ChromecastConnectionError:  # noqa
                 pass
+            except ResourceLimitError:  # noqa
+                stop_discovery(browser)
+                raise
         return (cc_list, browser)
 
     # Callback based chromecast discovery
@@ -238,17 +440,134 @@ def get_chromecasts(
                     tries=tries,
                     retry_wait=retry_wait,
                     timeout=timeout,
+                    scheduler=scheduler,
+                    clock=clock,
+                    listener=listener,
                 )
             )
         except ChromecastConnectionError:  # noqa
             pass
-
-    listener = CastListener(internal_callback)
-    zconf = zeroconf.Zeroconf()
-    browser = start_discovery(listener, zconf)
+        except ResourceLimitError:  # noqa
+            _LOGGER.error("Not connecting to discovered chromecast %s", uuid)
+
+    listener = CastListener(internal_callback, resolve_workers=RESOLVE_WORKERS)
+    REGISTRY.check_browser_limit()
+    zconf = ZEROCONF.acquire()
+    try:
+        browser = start_discovery(listener, zconf)
+    except ResourceLimitError:  # noqa
+        ZEROCONF.release(zconf)
+        raise
     return browser
 
 
+# pylint: disable=too-many-locals
+def get_cached_chromecasts(
+    cache,
+    tries=None,
+    retry_wait=None,
+    timeout=None,
+    callback=None,
+    scheduler=None,
+    clock=None,
+    start_connections=True,
+):
+    """
+    Creates a Chromecast object for each device in a DeviceCache, connecting
+    straight to the cached addresses without waiting for discovery, and starts
+    discovery in the background to revalidate the cache.
+
+    Discovered devices refresh their cache entry, which is written to disk
+    shortly after. Devices which are not in the cache are passed to callback,
+    if given, and are connected to on the next start.
+
+    Returns a tuple of:
+      A list of Chromecast objects for the cached devices.
+      A service browser to keep the cache updated. When updates are (no
+      longer) needed, pass the browser object to
+      pychromecast.discovery.stop_discovery().
+
+    :param cache: The pychromecast.device_cache.DeviceCache to use.
+    :param callback: Callback which is triggered with a Chromecast object for
+                     each discovered device which is not in the cache.
+    :param start_connections: If True, the worker thread of each cached
+                              Chromecast is started right away.
+
+    See get_chromecasts for the other parameters.
+    """
+    if clock is None:
+        clock = getattr(scheduler, "clock", SYSTEM_CLOCK)
+
+    cc_list = []
+    cached = cache.entries()
+    for uuid, entry in cached.items():
+        try:
+            cast = Chromecast(
+                host=entry["host"],
+                port=entry["port"],
+                device=cache.device_status(uuid, entry),
+                tries=tries,
+                timeout=timeout,
+                retry_wait=retry_wait,
+                scheduler=scheduler,
+                clock=clock,
+            )
+        except ResourceLimitError:  # noqa
+            _LOGGER.error("Not connecting to cached chromecast %s", uuid)
+            continue
+        if start_connections:
+            cast.start()
+        cc_list.append(cast)
+
+    announced = set(cached)
+    announced_lock = threading.Lock()
+
+    def revalidate(uuid, name):  # pylint: disable=unused-argument
+        """Called when zeroconf has discovered or updated a chromecast."""
+        service = listener.services.get(uuid)
+        if service is None:
+            return
+        cache.update_from_service(service)
+        cache.save_soon()
+        if not callable(callback):
+            return
+        with announced_lock:
+            if uuid in announced:
+                return
+            announced.add(uuid)
+        try:
+            callback(
+                get_chromecast_from_service(
+                    service,
+                    zconf=zconf,
+                    tries=tries,
+                    retry_wait=retry_wait,
+                    timeout=timeout,
+                    scheduler=scheduler,
+                    clock=clock,
+                    listener=listener,
+                )
+            )
+        except ChromecastConnectionError:  # noqa
+            pass
+        except ResourceLimitError:  # noqa
+            _LOGGER.error("Not connecting to discovered chromecast %s", uuid)
+
+    listener = CastListener(
+        revalidate, update_callback=revalidate, resolve_workers=RESOLVE_WORKERS
+    )
+    for cast in cc_list:
+        listener.register_client(cast.uuid, cast.socket_client)
+    zconf = ZEROCONF.acquire()
+    try:
+        browser = start_discovery(listener, zconf)
+    except ResourceLimitError:  # noqa
+        ZEROCONF.release(zconf)
+        _LOGGER.error("Not revalidating the device cache")
+        browser = None
+    return (cc_list, browser)
+
+
 # pylint: disable=too-many-instance-attributes, too-many-public-methods
 class Chromecast:
     """
@@ -276,6 +595,22 @@ class Chromecast:
     :param zconf: A zeroconf instance, needed if a list of services is passed.
                   The zeroconf instance may be obtained from the browser returned by
                   pychromecast.start_discovery().
+    :param scheduler: A ConnectionScheduler shared by a fleet of casts, which
+                      admits connection attempts and spreads status polling.
+    :param priority: The priority of the connection attempts. None means to use
+                     the priority the scheduler has configured for the device.
+    :param command_rate: Maximum number of volume, mute, seek and subtitle
+                         commands sent per second, bursts are coalesced so only
+                         the latest value is sent. None means to use the
+                         command_rate of the scheduler, if any.
+    :param optimistic: If True, status and media_controller.status reflect the
+                       expected effect of a command as soon as it is sent, and
+                       are reconciled when the Chromecast answers.
+    :param clock: The clock used for all time dependent behaviour, see
+                  pychromecast.clock. None means to use the system clock.
+    :param socket_factory: Function called with (host, port, timeout) which
+                           returns a connected socket to the device, see
+                           SocketClient. None means to connect with TLS.
     """
 
     def __init__(self, host, port=None, device=None, **kwargs):
@@ -284,6 +619,12 @@ class Chromecast:
         retry_wait = kwargs.pop("retry_wait", None)
         services = kwargs.pop("services", None)
         zconf = kwargs.pop("zconf", None)
+        scheduler = kwargs.pop("scheduler", None)
+        priority = kwargs.pop("priority", None)
+        command_rate = kwargs.pop("command_rate", None)
+        optimistic = kwargs.pop("optimistic", False)
+        clock = kwargs.pop("clock", None)
+        socket_factory = kwargs.pop("socket_factory", None)
 
         self.logger = logging.getLogger(__name__)
 
@@ -292,9 +633,13 @@ class Chromecast:
         self.host = host
         self.port = port or 8009
 
-        self.logger.info("Querying device status")
         self.device = device
-        if device:
+        if device and all(device):
+            # DIAL has nothing to add to a complete device status, such as
+            # one from discovery or from a DeviceCache
+            pass
+        elif device:
+            self.logger.info("Querying device status")
             dev_status = get_device_status(self.host, services, zconf)
             if dev_status:
                 # Values from `device` have priority over `dev_status`
@@ -311,6 +656,7 @@ class Chromecast:
             else:
                 self.device = device
         else:
+            self.logger.info("Querying device status")
             self.device = get_device_status(self.host, services, zconf)
 
         if not self.device:
@@ -321,6 +667,9 @@ class Chromecast:
         self.status = None
         self.status_event = threading.Event()
 
+        if priority is None and scheduler is not None:
+            priority = scheduler.priority_for(self.device.uuid)
+
         self.socket_client = socket_client.SocketClient(
             host,
             port=port,
@@ -330,10 +679,19 @@ class Chromecast:
             retry_wait=retry_wait,
             services=services,
             zconf=zconf,
+            scheduler=scheduler,
+            priority=priority or PRIORITY_NORMAL,
+            command_rate=command_rate,
+            optimistic=optimistic,
+            clock=clock,
+            socket_factory=socket_factory,
         )
 
+        # Stop the socket client once this object is no longer referenced.
+        # The receiver controller only holds a proxy, to not keep us alive.
+        REGISTRY.track_owner(self, self.socket_client)
         receiver_controller = self.socket_client.receiver_controller
-        receiver_controller.register_status_listener(self)
+        receiver_controller.register_status_listener(weakref.proxy(self))
 
         # Forward these methods
         self.set_volume = receiver_controller.set_volume
@@ -347,6 +705,9 @@ class Chromecast:
         self.register_connection_listener = (
             self.socket_client.register_connection_listener
         )
+        self.unregister_connection_listener = (
+            self.socket_client.unregister_connection_listener
+        )
 
     @property
     def ignore_cec(self):
@@ -449,7 +810,9 @@ class Chromecast:
             raise ValueError(
                 "volume delta must be greater than zero, not {}".format(delta)
             )
-        return self.set_volume(self.status.volume_level + delta)
+        return self.set_volume(
+            self.socket_client.receiver_controller.volume_level + delta
+        )
 
     def volume_down(self, delta=0.1):
         """ Decrement the volume by 0.1 (or delta) unless it is already 0.
@@ -459,7 +822,9 @@ class Chromecast:
             raise ValueError(
                 "volume delta must be greater than zero, not {}".format(delta)
             )
-        return self.set_volume(self.status.volume_level - delta)
+        return self.set_volume(
+            self.socket_client.receiver_controller.volume_level - delta
+        )
 
     def wait(self, timeout=None):
         """
@@ -475,9 +840,9 @@ class Chromecast:
                         operation in seconds (or fractions thereof). Or None
                         to block forever.
         """
-        if not self.socket_client.isAlive():
+        if not self.socket_client.is_alive():
             self.socket_client.start()
-        self.status_event.wait(timeout=timeout)
+        self.socket_client.clock.wait(self.status_event, timeout)
 
     def connect(self):
         """ Connect to the chromecast.
@@ -517,12 +882,6 @@ class Chromecast:
         """
         self.socket_client.start()
 
-    def __del__(self):
-        try:
-            self.socket_client.stop.set()
-        except AttributeError:
-            pass
-
     def __repr__(self):
         txt = "Chromecast({!r}, port={!r}, device={!r})".format(
             self.host, self.port, self.device
@@ -0,0 +1,204 @@
+"""
+Clocks used for the time dependent behaviour of PyChromecast.
+
+All heartbeats, retries, polls and timeouts read the time and sleep through a
+clock, which makes it possible to replace the system clock by a
+SimulatedClock and run hours of virtual time in tests in a few milliseconds.
+"""
+from datetime import datetime, timedelta
+import select
+import socket
+import threading
+import time
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class Clock:
+    """ Clock backed by the system time. """
+
+    # pylint: disable=no-self-use
+    def time(self):
+        """ Returns the current time in seconds since the epoch. """
+        return time.time()
+
+    def utcnow(self):
+        """ Returns the current UTC time as a naive datetime. """
+        return datetime.utcnow()
+
+    def sleep(self, seconds):
+        """ Blocks the calling thread for seconds. """
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        """
+        Blocks the calling thread until event is set or timeout seconds have
+        passed. Returns True if the event is set.
+        """
+        return event.wait(timeout)
+
+    def select(self, rlist, timeout=None, waker=None):
+        """
+        Blocks the calling thread until one of the sockets in rlist is readable
+        or timeout seconds have passed. Returns the readable sockets.
+
+        :param waker: A socket whose other end is in rlist. Clocks which do not
+                      follow the system time write to it to wake the caller.
+        """
+        # pylint: disable=unused-argument
+        return _select(rlist, timeout)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class SimulatedClock(Clock):
+    """
+    Clock which only moves forward when advance() is called.
+
+    Threads sleeping, waiting or selecting on the clock are woken by advance()
+    when the virtual time passes their deadline, they don't poll.
+
+    :param start: The initial virtual time in seconds since the epoch.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._waiting = 0
+        self._condition = threading.Condition()
+        # list of (deadline, function waking the waiter) tuples
+        self._timers = []
+
+    def time(self):
+        """ Returns the current virtual time in seconds since the epoch. """
+        return self._now
+
+    def utcnow(self):
+        """ Returns the current virtual UTC time as a naive datetime. """
+        return _EPOCH + timedelta(seconds=self._now)
+
+    @property
+    def waiting(self):
+        """ Number of threads currently blocked on the clock. """
+        return self._waiting
+
+    def sleep(self, seconds):
+        """ Blocks the calling thread until the virtual time has advanced seconds. """
+        with self._condition:
+            deadline = self._now + seconds
+            self._waiting += 1
+            try:
+                while self._now < deadline:
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+
+    def wait(self, event, timeout=None):
+        """
+        Blocks the calling thread until event is set or the virtual time has
+        advanced timeout seconds. Returns True if the event is set.
+        """
+        if timeout is None:
+            return event.wait()
+
+        # The event's condition is notified when the event is set, advance()
+        # notifies it as well once the deadline has passed.
+        cond = event._cond  # pylint: disable=protected-access
+        timer = self._add_timer(timeout, lambda: _notify(cond))
+        try:
+            with cond:
+                while not event.is_set() and self._now < timer[0]:
+                    cond.wait()
+        finally:
+            self._remove_timer(timer)
+        return event.is_set()
+
+    def select(self, rlist, timeout=None, waker=None):
+        """
+        Blocks the calling thread until one of the sockets in rlist is readable
+        or the virtual time has advanced timeout seconds. Returns the readable
+        sockets.
+
+        :param waker: A socket whose other end is in rlist, advance() writes to
+                      it to wake the caller. If None, a socket pair is created
+                      for the call.
+        """
+        if timeout is None:
+            return _select(rlist, None)
+
+        pair = None
+        if waker is None:
+            pair = socket.socketpair()
+            rlist = list(rlist) + [pair[0]]
+            waker = pair[1]
+
+        timer = self._add_timer(timeout, lambda: _wake(waker))
+        try:
+            if self._now >= timer[0]:
+                readable = _select(rlist, 0)
+            else:
+                readable = _select(rlist, None)
+        finally:
+            self._remove_timer(timer)
+            if pair is not None:
+                pair[0].close()
+                pair[1].close()
+
+        if pair is not None:
+            readable = [sock for sock in readable if sock is not pair[0]]
+        return readable
+
+    def _add_timer(self, timeout, wake):
+        """ Register a waiter which advance() wakes after timeout seconds. """
+        with self._condition:
+            timer = (self._now + timeout, wake)
+            self._timers.append(timer)
+            self._waiting += 1
+        return timer
+
+    def _remove_timer(self, timer):
+        """ Unregister a waiter. """
+        with self._condition:
+            self._timers.remove(timer)
+            self._waiting -= 1
+
+    def advance(self, seconds):
+        """ Move the virtual time forward and wake up threads which are due. """
+        with self._condition:
+            self._now += seconds
+            self._condition.notify_all()
+            due = [timer for timer in self._timers if timer[0] <= self._now]
+        for _, wake in due:
+            wake()
+
+
+def _select(rlist, timeout):
+    """
+    Returns the sockets in rlist which are readable within timeout seconds.
+    Uses poll where available, select can't watch file descriptors above
+    FD_SETSIZE (1024), which a process with many casts easily exceeds.
+    """
+    if not hasattr(select, "poll"):
+        return select.select(rlist, [], [], timeout)[0]
+
+    poller = select.poll()
+    sockets = {}
+    for sock in rlist:
+        sockets[sock.fileno()] = sock
+        poller.register(sock, select.POLLIN)
+    events = poller.poll(None if timeout is None else timeout * 1000)
+    return [sockets[fd] for fd, _ in events]
+
+
+def _notify(cond):
+    """ Wake the threads waiting on cond without setting their event. """
+    with cond:
+        cond.notify_all()
+
+
+def _wake(waker):
+    """ Wake a thread blocked in select by writing to a socket it selects on. """
+    try:
+        waker.send(b"x")
+    except OSError:
+        pass
@@ -0,0 +1,324 @@
+"""
+Runs timed commands, such as volume fades and app launches, for many
+Chromecasts from a single timer thread.
+"""
+import logging
+import math
+import threading
+
+from .clock import SYSTEM_CLOCK
+from .error import PyChromecastError
+
+# Seconds per slot of the timer wheel
+RESOLUTION = 0.05
+# Number of slots of the timer wheel
+WHEEL_SIZE = 1024
+# Seconds between the volume changes of a ramp, slow enough for devices
+RAMP_INTERVAL = 0.25
+# Smallest volume change sent by a ramp, except for its last step
+RAMP_MIN_STEP = 0.01
+# Difference between the reported and the requested volume taken as a change
+# made by someone else
+VOLUME_TOLERANCE = 0.02
+# Fraction of a slot ignored when converting times to slots, for rounding errors
+_EPSILON = 1e-6
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ScheduledCommand:  # pylint: disable=too-few-public-methods
+    """
+    A command waiting in a CommandScheduler.
+
+    :param function: The function to call.
+    :param args: The arguments of function.
+    :param interval: Seconds between calls of a recurring command, None for a
+                     command which runs once.
+    :param inline: If True the command runs on the timer thread, even if the
+                   scheduler has an executor.
+    """
+
+    def __init__(self, function, args, interval=None, inline=False):
+        self.function = function
+        self.args = args
+        self.interval = interval
+        self.inline = inline
+        # Time the command is due, as returned by the clock
+        self.when = None
+        self.cancelled = False
+        # Slot tick of the timer wheel the command is in
+        self._tick = None
+
+    def cancel(self):
+        """ Don't run the command anymore. """
+        self.cancelled = True
+
+
+class VolumeRamp:
+    """
+    Moves the volume of a cast to target over duration seconds, in steps of
+    at most one per interval seconds, through ReceiverController.set_volume.
+
+    The steps use the same coalesced volume command as set_volume, so a
+    volume change made while a step is waiting in the command throttle
+    replaces it. The ramp stops if the volume reported by the device moves
+    away from the levels it requested, so a change made by someone else wins
+    over the ramp.
+
+    :param cast: The Chromecast.
+    :param target: The final volume, between 0 and 1.
+    :param duration: Seconds to reach target.
+    :param start: The initial volume, None to start from the current volume.
+    """
+
+    def __init__(self, cast, target, duration, start=None):
+        self.cast = cast
+        self.target = min(max(0, target), 1)
+        self.duration = duration
+        self.start = start
+        self.start_time = None
+        # Set once the ramp reached target, was overridden or cancelled
+        self.finished = threading.Event()
+        self.overridden = False
+        self._sent = []
+        self.command = None
+
+    def cancel(self):
+        """ Stop the ramp. """
+        if self.command is not None:
+            self.command.cancel()
+        self.finished.set()
+
+    def step(self, now):
+        """ Send the volume for time now. Returns True when done. """
+        receiver = self.cast.socket_client.receiver_controller
+        status = receiver.status
+        if self.start_time is None:
+            if self.start is None:
+                if status is None:
+                    # Wait for the current volume
+                    return False
+                self.start = status.volume_level
+            self.start_time = now
+            self._sent.append(self.start)
+        elif status is not None and all(
+            abs(status.volume_level - level) > VOLUME_TOLERANCE for level in self._sent
+        ):
+            _LOGGER.debug("Volume of %s changed, stopping the ramp", self.cast)
+            self.overridden = True
+            return True
+
+        if self.duration <= 0 or now >= self.start_time + self.duration:
+            level = self.target
+            done = True
+        else:
+            progress = (now - self.start_time) / self.duration
+            level = self.start + (self.target - self.start) * progress
+            done = False
+        if not done and abs(level - self._sent[-1]) < RAMP_MIN_STEP:
+            return False
+        try:
+            self._sent.append(receiver.set_volume(level))
+        except PyChromecastError as err:
+            _LOGGER.debug("Failed to ramp the volume of %s: %s", self.cast, err)
+            return False
+        return done
+
+
+class CommandScheduler:
+    """
+    Runs one-shot and recurring commands, and volume ramps, from a single
+    timer thread using a hashed timer wheel. Adding and cancelling commands
+    costs the same regardless of the number of commands waiting.
+
+    Commands run on the timer thread and should not block, which is the case
+    for the commands of Chromecast and its controllers such as set_volume or
+    start_app. Blocking commands, such as the commands of CastFleet, should be
+    run with an executor.
+
+    :param resolution: Seconds per slot of the timer wheel, commands run up to
+                       resolution seconds late.
+    :param wheel_size: Number of slots of the timer wheel.
+    :param executor: A concurrent.futures.Executor to run the commands on,
+                     None to run them on the timer thread. Volume ramps always
+                     run on the timer thread.
+    :param clock: The clock used for the timers.
+    """
+
+    def __init__(
+        self,
+        resolution=RESOLUTION,
+        wheel_size=WHEEL_SIZE,
+        executor=None,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.resolution = resolution
+        self.executor = executor
+        self.clock = clock
+        self._wheel = [[] for _ in range(wheel_size)]
+        self._count = 0
+        # Next slot tick to run
+        self._tick = self._current_tick(clock.time())
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # dict mapping cast uuid on its running VolumeRamp
+        self._ramps = {}
+
+    def start(self):
+        """ Start the timer thread. """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="CommandScheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the timer thread, commands waiting are kept. """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def call_at(self, when, function, *args):
+        """
+        Call function with args at time when, as returned by clock.time().
+        Returns a ScheduledCommand.
+        """
+        command = ScheduledCommand(function, args)
+        self._add(command, when)
+        return command
+
+    def call_later(self, delay, function, *args):
+        """ Call function with args in delay seconds. Returns a ScheduledCommand. """
+        return self.call_at(self.clock.time() + delay, function, *args)
+
+    def call_every(self, interval, function, *args, first=None):
+        """
+        Call function with args every interval seconds, the first time at
+        time first, or in interval seconds if first is None. Returns a
+        ScheduledCommand.
+        """
+        if interval <= 0:
+            raise ValueError(
+                "interval must be greater than zero, not {}".format(interval)
+            )
+        command = ScheduledCommand(function, args, interval)
+        self._add(command, self.clock.time() + interval if first is None else first)
+        return command
+
+    def ramp_volume(
+        self, cast, target, duration, start=None, interval=RAMP_INTERVAL, when=None
+    ):
+        """
+        Move the volume of cast to target over duration seconds, starting at
+        time when, or now if when is None. A ramp of cast which is still running
+        is cancelled. Returns a VolumeRamp.
+
+        :param start: The initial volume, None to start from the volume of cast
+                      when the ramp starts.
+        :param interval: Seconds between volume changes.
+        """
+        ramp = VolumeRamp(cast, target, duration, start)
+
+        def step():
+            """ Run a step of the ramp. """
+            if ramp.step(self.clock.time()):
+                ramp.cancel()
+                with self._lock:
+                    if self._ramps.get(cast.uuid) is ramp:
+                        del self._ramps[cast.uuid]
+
+        ramp.command = ScheduledCommand(step, (), interval, inline=True)
+        with self._lock:
+            previous = self._ramps.get(cast.uuid)
+            self._ramps[cast.uuid] = ramp
+        if previous is not None:
+            previous.cancel()
+        self._add(ramp.command, self.clock.time() if when is None else when)
+        return ramp
+
+    def pending(self):
+        """ Returns the number of commands waiting, including cancelled ones. """
+        with self._lock:
+            return self._count
+
+    def _add(self, command, when):
+        """ Put command in the slot of time when. """
+        with self._lock:
+            command.when = when
+            # pylint: disable=protected-access
+            command._tick = max(self._ticks(when), self._tick)
+            self._wheel[command._tick % len(self._wheel)].append(command)
+            self._count += 1
+        self._wakeup.set()
+
+    def _ticks(self, when):
+        """ Returns the first slot tick at or after time when. """
+        return math.ceil(when / self.resolution - _EPSILON)
+
+    def _current_tick(self, now):
+        """ Returns the last slot tick at or before time now. """
+        return int(now / self.resolution + _EPSILON)
+
+    def _due(self, now):
+        """ Take the commands which are due from the wheel. """
+        due = []
+        with self._lock:
+            current = self._current_tick(now)
+            first = self._tick
+            self._tick = max(first, current + 1)
+            if current - first + 1 >= len(self._wheel):
+                slots = self._wheel
+            else:
+                slots = [
+                    self._wheel[tick % len(self._wheel)]
+                    for tick in range(first, current + 1)
+                ]
+            for slot in slots:
+                # pylint: disable=protected-access
+                ready = [command for command in slot if command._tick <= current]
+                if ready:
+                    slot[:] = [command for command in slot if command._tick > current]
+                    due.extend(ready)
+            self._count -= len(due)
+        due.sort(key=lambda command: command.when)
+        return due
+
+    def _run(self):
+        """ Run commands until stopped. """
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            for command in self._due(self.clock.time()):
+                self._execute(command)
+            if self.pending():
+                timeout = self._tick * self.resolution - self.clock.time()
+                self.clock.wait(self._wakeup, max(timeout, 0))
+            else:
+                self.clock.wait(self._wakeup)
+
+    def _execute(self, command):
+        """ Run a command which is due and schedule its next run. """
+        if command.cancelled:
+            return
+        if command.interval is not None:
+            when = command.when + command.interval
+            now = self.clock.time()
+            if when <= now:
+                # Skip the runs which were missed
+                when += ((now - when) // command.interval + 1) * command.interval
+            self._add(command, when)
+        if self.executor is not None and not command.inline:
+            self.executor.submit(self._call, command)
+        else:
+            self._call(command)
+
+    @staticmethod
+    def _call(command):
+        """ Call the function of command. """
+        try:
+            command.function(*command.args)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Exception thrown when running a scheduled command")
@@ -3,8 +3,12 @@ Provides controllers to handle specific namespaces in Chromecast communication.
 """
 import logging
 
+from ..clock import SYSTEM_CLOCK
 from ..error import UnsupportedNamespace, ControllerNotRegistered
 
+# Seconds after which an unanswered optimistic update is discarded
+OPTIMISTIC_TIMEOUT = 10
+
 
 class BaseController:
     """ ABC for namespace controllers. """
@@ -28,6 +32,11 @@ class BaseController:
 
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def clock(self):
+        """ The clock of the socket client this controller is registered with. """
+        return getattr(self._socket_client, "clock", SYSTEM_CLOCK)
+
     @property
     def is_active(self):
         """ True if the controller is connected to a socket client and the
@@ -65,7 +74,8 @@ class BaseController:
         """
         Send a message on this namespace to the Chromecast. Ensures app is loaded.
 
-        Will raise a NotConnected exception if not connected.
+        Will raise a NotConnected exception if not connected. Returns False if
+        writing the message to the socket failed.
         """
         self._check_registered()
 
@@ -79,7 +89,7 @@ class BaseController:
                         data, inc_session_id, callback_function
                     )
                 )
-                return
+                return None
 
             raise UnsupportedNamespace(
                 ("Namespace {} is not supported by running" "application.").format(
@@ -87,11 +97,13 @@ class BaseController:
                 )
             )
 
-        self.send_message_nocheck(data, inc_session_id, callback_function)
+        return self.send_message_nocheck(data, inc_session_id, callback_function)
 
     def send_message_nocheck(self, data, inc_session_id=False, callback_function=None):
         """Send a message."""
-        self._message_func(self.namespace, data, inc_session_id, callback_function)
+        return self._message_func(
+            self.namespace, data, inc_session_id, callback_function
+        )
 
     # pylint: disable=unused-argument,no-self-use
     def receive_message(self, message, data):
@@ -115,3 +127,86 @@ class BaseController:
                     "with a Cast object."
                 )
             )
+
+
+class OptimisticOverlay:
+    """
+    Expected values of status fields changed by commands which have not yet
+    been answered by the Chromecast.
+
+    Each field holds the value of the latest command changing it, tagged with
+    the request id of that command once it has been sent.
+    """
+
+    def __init__(self, timeout=OPTIMISTIC_TIMEOUT):
+        self.timeout = timeout
+        # dict mapping field name on entry dict
+        self._entries = {}
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def add(self, fields, now):
+        """
+        Add expected values at time now. Returns the new entries, to be tagged
+        once the command is sent.
+        """
+        entries = []
+        for field, value in fields.items():
+            entry = {
+                "field": field,
+                "value": value,
+                "request_id": None,
+                "created": now,
+            }
+            self._entries[field] = entry
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def tag(entries, request_id):
+        """ Tag entries with the request id of the command setting them. """
+        for entry in entries:
+            entry["request_id"] = request_id
+
+    def discard(self, entries):
+        """ Remove entries, if they have not been replaced already. """
+        for entry in entries:
+            if self._entries.get(entry["field"]) is entry:
+                del self._entries[entry["field"]]
+
+    def settle(self, request_id, now):
+        """
+        Remove the entries answered by a status with request id request_id, as
+        well as entries expired at time now. Request ids increase, so a status
+        answers all commands sent before it.
+        """
+        expire = now - self.timeout
+        for field, entry in list(self._entries.items()):
+            if entry["created"] < expire or (
+                entry["request_id"] is not None
+                and request_id
+                and entry["request_id"] <= request_id
+            ):
+                del self._entries[field]
+
+    def reject(self, request_id):
+        """
+        Remove and return the entries set by the command with request id
+        request_id, which the Chromecast answered with an error.
+        """
+        rejected = [
+            entry
+            for entry in self._entries.values()
+            if request_id and entry["request_id"] == request_id
+        ]
+        self.discard(rejected)
+        return rejected
+
+    def values(self):
+        """ Returns a dict mapping field name on the expected value. """
+        return {field: entry["value"] for field, entry in self._entries.items()}
+
+    def clear(self):
+        """ Remove all entries. """
+        self._entries.clear()
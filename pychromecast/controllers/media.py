@@ -2,14 +2,16 @@
 Provides a controller for controlling the default media players
 on the Chromecast.
 """
-from datetime import datetime
+import copy
 import logging
 
 from collections import namedtuple
 import threading
 
+from ..clock import SYSTEM_CLOCK
 from ..config import APP_MEDIA_RECEIVER
-from . import BaseController
+from ..error import PyChromecastError
+from . import BaseController, OptimisticOverlay
 
 STREAM_TYPE_UNKNOWN = "UNKNOWN"
 STREAM_TYPE_BUFFERED = "BUFFERED"
@@ -22,6 +24,7 @@ MEDIA_PLAYER_STATE_IDLE = "IDLE"
 MEDIA_PLAYER_STATE_UNKNOWN = "UNKNOWN"
 
 MESSAGE_TYPE = "type"
+REQUEST_ID = "requestId"
 
 TYPE_EDIT_TRACKS_INFO = "EDIT_TRACKS_INFO"
 TYPE_GET_STATUS = "GET_STATUS"
@@ -76,7 +79,8 @@ class MediaStatus:
     """ Class to hold the media status. """
 
     # pylint: disable=too-many-instance-attributes,too-many-public-methods
-    def __init__(self):
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self._clock = clock
         self.current_time = 0
         self.content_id = None
         self.content_type = None
@@ -102,7 +106,7 @@ class MediaStatus:
             # Add time since last update
             return (
                 self.current_time
-                + (datetime.utcnow() - self.last_updated).total_seconds()
+                + (self._clock.utcnow() - self.last_updated).total_seconds()
             )
         # Not playing, return last reported seek time
         return self.current_time
@@ -282,7 +286,7 @@ class MediaStatus:
         self.current_subtitle_tracks = status_data.get(
             "activeTrackIds", self.current_subtitle_tracks
         )
-        self.last_updated = datetime.utcnow()
+        self.last_updated = self._clock.utcnow()
 
     def __repr__(self):
         info = {
@@ -304,7 +308,9 @@ class MediaStatus:
             "supports_skip_forward": self.supports_skip_forward,
             "supports_skip_backward": self.supports_skip_backward,
         }
-        info.update(self.__dict__)
+        info.update(
+            {key: value for key, value in self.__dict__.items() if key != "_clock"}
+        )
         return "<MediaStatus {}>".format(info)
 
 
@@ -316,10 +322,23 @@ class MediaController(BaseController):
         super(MediaController, self).__init__("urn:x-cast:com.google.cast.media")
 
         self.media_session_id = 0
-        self.status = MediaStatus()
+        # Status as reported by the device, without optimistic updates
+        self._device_status = MediaStatus()
+        self.status = self._device_status
         self.session_active_event = threading.Event()
         self.app_id = APP_MEDIA_RECEIVER
         self._status_listeners = []
+        # If True, commands update status with their expected effect right away
+        self.optimistic = False
+        self._overlay = OptimisticOverlay()
+
+    def registered(self, socket_client):
+        """ Called when a controller is registered. """
+        super(MediaController, self).registered(socket_client)
+
+        # Track the media position with the clock of the socket client
+        self._device_status = MediaStatus(self.clock)
+        self.status = self._device_status
 
     def channel_connected(self):
         """ Called when media channel is connected. Will update status. """
@@ -327,7 +346,9 @@ class MediaController(BaseController):
 
     def channel_disconnected(self):
         """ Called when a media channel is disconnected. Will erase status. """
-        self.status = MediaStatus()
+        self._device_status = MediaStatus(self.clock)
+        self._overlay.clear()
+        self.status = self._device_status
         self._fire_status_changed()
 
     def receive_message(self, message, data):
@@ -337,6 +358,11 @@ class MediaController(BaseController):
 
             return True
 
+        if self._overlay.reject(data.get(REQUEST_ID)):
+            # The device refused a command, roll back its optimistic update
+            self.status = self._apply_overlay()
+            self._fire_status_changed()
+
         return False
 
     def register_status_listener(self, listener):
@@ -344,23 +370,106 @@ class MediaController(BaseController):
             call listener.new_media_status(status) """
         self._status_listeners.append(listener)
 
+    def unregister_status_listener(self, listener):
+        """ Unregister a listener registered with register_status_listener. """
+        self._status_listeners.remove(listener)
+
     def update_status(self, callback_function_param=False):
         """ Send message to update the status. """
         self.send_message(
             {MESSAGE_TYPE: TYPE_GET_STATUS}, callback_function=callback_function_param
         )
 
-    def _send_command(self, command):
-        """ Send a command to the Chromecast on media channel. """
+    # pylint: disable=too-many-arguments
+    def _send_command(
+        self,
+        command,
+        coalesce_key=None,
+        expected=None,
+        callback_function=None,
+        failure_function=None,
+    ):
+        """
+        Send a command to the Chromecast on media channel. Commands with a
+        coalesce_key are idempotent and may be coalesced by the socket client.
+        If optimistic, the MediaStatus fields in expected are updated right away.
+
+        callback_function is called with the response of the Chromecast,
+        failure_function if the command was not sent.
+        """
+        entries = []
+        if (
+            expected
+            and self.optimistic
+            and self.status is not None
+            and self.status.media_session_id is not None
+        ):
+            entries = self._overlay.add(expected, self.clock.time())
+            self.status = self._apply_overlay()
+            self._fire_status_changed()
+
+        if coalesce_key is not None:
+            self._check_registered()
+            self._socket_client.send_coalesced(
+                (self.namespace, coalesce_key),
+                lambda: self._send_command_now(
+                    command, entries, callback_function, failure_function
+                ),
+                failure_function,
+            )
+            return
+
+        self._send_command_now(command, entries, callback_function, failure_function)
+
+    def _send_command_now(
+        self, command, entries, callback_function=None, failure_function=None
+    ):
+        """ Send a command and tag its optimistic update with the request id. """
         if self.status is None or self.status.media_session_id is None:
             self.logger.warning(
                 "%s command requested but no session is active.", command[MESSAGE_TYPE]
             )
+            if failure_function:
+                failure_function()
             return
 
         command["mediaSessionId"] = self.status.media_session_id
 
-        self.send_message(command, inc_session_id=True)
+        try:
+            sent = self.send_message(
+                command, inc_session_id=True, callback_function=callback_function
+            )
+        except PyChromecastError:
+            self._roll_back(entries)
+            if failure_function:
+                failure_function()
+            raise
+        if sent is False:
+            self._roll_back(entries)
+            if failure_function:
+                failure_function()
+            return
+        self._overlay.tag(entries, command.get(REQUEST_ID))
+
+    def _roll_back(self, entries):
+        """ Remove the optimistic update of a command which was not sent. """
+        if not entries:
+            return
+        self._overlay.discard(entries)
+        self.status = self._apply_overlay()
+        self._fire_status_changed()
+
+    def _apply_overlay(self):
+        """
+        Returns the status reported by the device, updated with the expected
+        effect of the commands it has not answered yet.
+        """
+        if not self._overlay:
+            return self._device_status
+        status = copy.copy(self._device_status)
+        for field, value in self._overlay.values().items():
+            setattr(status, field, value)
+        return status
 
     @property
     def is_playing(self):
@@ -397,17 +506,35 @@ class MediaController(BaseController):
 
         return images[0].url if images else None
 
-    def play(self):
-        """ Send the PLAY command. """
-        self._send_command({MESSAGE_TYPE: TYPE_PLAY})
+    def play(self, callback_function=None, failure_function=None):
+        """
+        Send the PLAY command. callback_function is called with the response
+        of the Chromecast, failure_function if the command was not sent.
+        """
+        self._send_command(
+            {MESSAGE_TYPE: TYPE_PLAY},
+            expected={"player_state": MEDIA_PLAYER_STATE_PLAYING},
+            callback_function=callback_function,
+            failure_function=failure_function,
+        )
 
-    def pause(self):
-        """ Send the PAUSE command. """
-        self._send_command({MESSAGE_TYPE: TYPE_PAUSE})
+    def pause(self, callback_function=None, failure_function=None):
+        """ Send the PAUSE command, see play for the parameters. """
+        self._send_command(
+            {MESSAGE_TYPE: TYPE_PAUSE},
+            expected={"player_state": MEDIA_PLAYER_STATE_PAUSED},
+            callback_function=callback_function,
+            failure_function=failure_function,
+        )
 
-    def stop(self):
-        """ Send the STOP command. """
-        self._send_command({MESSAGE_TYPE: TYPE_STOP})
+    def stop(self, callback_function=None, failure_function=None):
+        """ Send the STOP command, see play for the parameters. """
+        self._send_command(
+            {MESSAGE_TYPE: TYPE_STOP},
+            expected={"player_state": MEDIA_PLAYER_STATE_IDLE},
+            callback_function=callback_function,
+            failure_function=failure_function,
+        )
 
     def rewind(self):
         """ Starts playing the media from the beginning. """
@@ -424,7 +551,9 @@ class MediaController(BaseController):
                 MESSAGE_TYPE: TYPE_SEEK,
                 "currentTime": position,
                 "resumeState": "PLAYBACK_START",
-            }
+            },
+            coalesce_key="seek",
+            expected={"current_time": position, "last_updated": self.clock.utcnow()},
         )
 
     def queue_next(self):
@@ -438,12 +567,18 @@ class MediaController(BaseController):
     def enable_subtitle(self, track_id):
         """ Enable specific text track. """
         self._send_command(
-            {MESSAGE_TYPE: TYPE_EDIT_TRACKS_INFO, "activeTrackIds": [track_id]}
+            {MESSAGE_TYPE: TYPE_EDIT_TRACKS_INFO, "activeTrackIds": [track_id]},
+            coalesce_key="tracks",
+            expected={"current_subtitle_tracks": [track_id]},
         )
 
     def disable_subtitle(self):
         """ Disable subtitle. """
-        self._send_command({MESSAGE_TYPE: TYPE_EDIT_TRACKS_INFO, "activeTrackIds": []})
+        self._send_command(
+            {MESSAGE_TYPE: TYPE_EDIT_TRACKS_INFO, "activeTrackIds": []},
+            coalesce_key="tracks",
+            expected={"current_subtitle_tracks": []},
+        )
 
     def block_until_active(self, timeout=None):
         """
@@ -457,11 +592,14 @@ class MediaController(BaseController):
                         operation in seconds (or fractions thereof). Or None
                         to block forever.
         """
-        self.session_active_event.wait(timeout=timeout)
+        self.clock.wait(self.session_active_event, timeout)
 
     def _process_media_status(self, data):
         """ Processes a STATUS message. """
-        self.status.update(data)
+        self._device_status.update(data)
+        if self._overlay:
+            self._overlay.settle(data.get(REQUEST_ID), self.clock.time())
+        self.status = self._apply_overlay()
 
         self.logger.debug("Media:Received status %s", data)
 
@@ -498,6 +636,7 @@ class MediaController(BaseController):
         subtitles_lang="en-US",
         subtitles_mime="text/vtt",
         subtitle_id=1,
+        callback_function=None,
     ):
         """
         Plays media on the Chromecast. Start default media receiver if not
@@ -520,6 +659,8 @@ class MediaController(BaseController):
         metadata: dict - media metadata object, one of the following:
             GenericMediaMetadata, MovieMediaMetadata, TvShowMediaMetadata,
             MusicTrackMediaMetadata, PhotoMediaMetadata.
+        callback_function: function - called with the response of the
+            Chromecast to the LOAD request.
 
         Docs:
         https://developers.google.com/cast/docs/reference/messages#MediaData
@@ -540,6 +681,7 @@ class MediaController(BaseController):
                 subtitles_lang,
                 subtitles_mime,
                 subtitle_id,
+                callback_function,
             )
 
         receiver_ctrl = self._socket_client.receiver_controller
@@ -559,6 +701,7 @@ class MediaController(BaseController):
         subtitles_lang="en-US",
         subtitles_mime="text/vtt",
         subtitle_id=1,
+        callback_function=None,
     ):
         # pylint: disable=too-many-locals
         msg = {
@@ -603,7 +746,7 @@ class MediaController(BaseController):
                 "edgeColor": "#000000FF",
             }
             msg["activeTrackIds"] = [subtitle_id]
-        self.send_message(msg, inc_session_id=True)
+        self.send_message(msg, inc_session_id=True, callback_function=callback_function)
 
     def tear_down(self):
         """ Called when controller is destroyed. """
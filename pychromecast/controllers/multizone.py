@@ -2,6 +2,7 @@
 Controller to monitor audio group members.
 """
 import logging
+import threading
 
 from . import BaseController
 from ..socket_client import (
@@ -27,9 +28,9 @@ TYPE_SESSION_UPDATED = "PLAYBACK_SESSION_UPDATED"
 class Listener:
     """ Callback handler. """
 
-    def __init__(self, group_cast, casts):
+    def __init__(self, group_cast, manager):
         """Initialize the listener."""
-        self._casts = casts
+        self._manager = manager
         group_cast.register_status_listener(self)
         group_cast.media_controller.register_status_listener(self)
         group_cast.register_connection_listener(self)
@@ -40,23 +41,13 @@ class Listener:
 
     def new_cast_status(self, cast_status):
         """Handle reception of a new CastStatus."""
-        casts = self._casts
-        group_members = self._mz.members
-        for member_uuid in group_members:
-            if member_uuid not in casts:
-                continue
-            for listener in list(casts[member_uuid]["listeners"]):
-                listener.multizone_new_cast_status(self._group_uuid, cast_status)
+        for listener in self._manager.get_group_listeners(self._group_uuid):
+            listener.multizone_new_cast_status(self._group_uuid, cast_status)
 
     def new_media_status(self, media_status):
         """Handle reception of a new MediaStatus."""
-        casts = self._casts
-        group_members = self._mz.members
-        for member_uuid in group_members:
-            if member_uuid not in casts:
-                continue
-            for listener in list(casts[member_uuid]["listeners"]):
-                listener.multizone_new_media_status(self._group_uuid, media_status)
+        for listener in self._manager.get_group_listeners(self._group_uuid):
+            listener.multizone_new_media_status(self._group_uuid, media_status)
 
     def new_connection_status(self, conn_status):
         """Handle reception of a new ConnectionStatus."""
@@ -70,52 +61,81 @@ class Listener:
 
     def multizone_member_added(self, member_uuid):
         """Handle added audio group member."""
-        casts = self._casts
-        if member_uuid not in casts:
-            casts[member_uuid] = {"listeners": [], "groups": set()}
-        casts[member_uuid]["groups"].add(self._group_uuid)
-        for listener in list(casts[member_uuid]["listeners"]):
-            listener.added_to_multizone(self._group_uuid)
+        self._manager.member_added(self._group_uuid, member_uuid)
 
     def multizone_member_removed(self, member_uuid):
         """Handle removed audio group member."""
-        casts = self._casts
-        if member_uuid not in casts:
-            casts[member_uuid] = {"listeners": [], "groups": set()}
-        casts[member_uuid]["groups"].discard(self._group_uuid)
-        for listener in list(casts[member_uuid]["listeners"]):
-            listener.removed_from_multizone(self._group_uuid)
+        self._manager.member_removed(self._group_uuid, member_uuid)
 
     def multizone_status_received(self):
         """Handle reception of audio group status."""
 
 
+def _unique(listeners):
+    """ Returns a tuple of listeners without duplicates, in order. """
+    seen = set()
+    unique = []
+    for listener in listeners:
+        if id(listener) not in seen:
+            seen.add(id(listener))
+            unique.append(listener)
+    return tuple(unique)
+
+
 class MultizoneManager:
-    """ Manage audio groups. """
+    """
+    Manage audio groups.
+
+    The registry is indexed from members to groups and from groups to
+    members. It is updated from the socket threads of all groups, writes are
+    serialized by a lock and replace the indexes with updated copies, so the
+    status fan-out reads a consistent snapshot without locking.
+
+    For each group, the listeners of all its members are combined into a
+    single tuple, so a group status is delivered to each listener once, even
+    if it is registered for several members of the group.
+    """
 
     def __init__(self):
-        # Protect self._casts because it will be accessed from callbacks from
-        # the casts' socket_client thread
-        self._casts = {}
+        self._lock = threading.Lock()
         self._groups = {}
+        # dict mapping member uuid on tuple of listeners
+        self._listeners = {}
+        # dict mapping member uuid on frozenset of group uuids
+        self._memberships = {}
+        # dict mapping group uuid on frozenset of member uuids
+        self._group_members = {}
+        # dict mapping group uuid on tuple of the listeners of its members
+        self._group_listeners = {}
 
     def add_multizone(self, group_cast):
         """ Start managing a group """
-        self._groups[str(group_cast.uuid)] = {
+        group = {
             "chromecast": group_cast,
-            "listener": Listener(group_cast, self._casts),
+            "listener": Listener(group_cast, self),
             "members": set(),
         }
+        with self._lock:
+            groups = dict(self._groups)
+            groups[str(group_cast.uuid)] = group
+            self._groups = groups
 
     def remove_multizone(self, group_uuid):
         """ Stop managing a group """
         group_uuid = str(group_uuid)
-        group = self._groups.pop(group_uuid, None)
+        with self._lock:
+            groups = dict(self._groups)
+            group = groups.pop(group_uuid, None)
+            self._groups = groups
         # Inform all group members that they are no longer members
         if group is not None:
             group["listener"]._mz.reset_members()  # pylint: disable=protected-access
-        for member in self._casts.values():
-            member["groups"].discard(group_uuid)
+        with self._lock:
+            memberships = dict(self._memberships)
+            for member_uuid in self._group_members.get(group_uuid, ()):
+                memberships[member_uuid] = memberships[member_uuid] - {group_uuid}
+            self._memberships = memberships
+            self._set_group_members(group_uuid, frozenset())
 
     def register_listener(self, member_uuid, listener):
         """ Register a listener for audio group changes of cast uuid.
@@ -130,29 +150,121 @@ class MultizoneManager:
                 The group uuid, of which the cast is a member, has new status
         """
         member_uuid = str(member_uuid)
-        if member_uuid not in self._casts:
-            self._casts[member_uuid] = {"listeners": [], "groups": set()}
-        self._casts[member_uuid]["listeners"].append(listener)
+        with self._lock:
+            self._set_member_listeners(
+                member_uuid, self._listeners.get(member_uuid, ()) + (listener,)
+            )
 
     def deregister_listener(self, member_uuid, listener):
         """ Deregister listener for audio group changes of cast uuid."""
-        self._casts[str(member_uuid)]["listeners"].remove(listener)
+        member_uuid = str(member_uuid)
+        with self._lock:
+            listeners = list(self._listeners.get(member_uuid, ()))
+            listeners.remove(listener)
+            self._set_member_listeners(member_uuid, tuple(listeners))
 
     def get_multizone_memberships(self, member_uuid):
         """ Return a list of audio groups in which cast member_uuid is a member
         """
-        return list(self._casts[str(member_uuid)]["groups"])
+        return list(self._memberships.get(str(member_uuid), ()))
+
+    def get_multizone_members(self, group_uuid):
+        """ Return a list of the members of audio group group_uuid. """
+        return list(self._group_members.get(str(group_uuid), ()))
+
+    def get_group_listeners(self, group_uuid):
+        """
+        Return a tuple of the listeners of all members of group group_uuid,
+        each listener once.
+        """
+        return self._group_listeners.get(str(group_uuid), ())
 
     def get_multizone_mediacontroller(self, group_uuid):
         """ Get mediacontroller of a group """
         return self._groups[str(group_uuid)]["chromecast"].media_controller
 
+    def member_added(self, group_uuid, member_uuid):
+        """ Called by the Listener of a group when a member is added. """
+        with self._lock:
+            memberships = dict(self._memberships)
+            memberships[member_uuid] = memberships.get(
+                member_uuid, frozenset()
+            ) | {group_uuid}
+            self._memberships = memberships
+            self._set_group_members(
+                group_uuid,
+                self._group_members.get(group_uuid, frozenset()) | {member_uuid},
+            )
+            listeners = self._listeners.get(member_uuid, ())
+        for listener in listeners:
+            listener.added_to_multizone(group_uuid)
+
+    def member_removed(self, group_uuid, member_uuid):
+        """ Called by the Listener of a group when a member is removed. """
+        with self._lock:
+            memberships = dict(self._memberships)
+            memberships[member_uuid] = memberships.get(
+                member_uuid, frozenset()
+            ) - {group_uuid}
+            self._memberships = memberships
+            self._set_group_members(
+                group_uuid,
+                self._group_members.get(group_uuid, frozenset()) - {member_uuid},
+            )
+            listeners = self._listeners.get(member_uuid, ())
+        for listener in listeners:
+            listener.removed_from_multizone(group_uuid)
+
+    def _set_member_listeners(self, member_uuid, listeners):
+        """
+        Replace the listeners of a member and the fan-out of its groups. Must
+        be called with the lock held.
+        """
+        all_listeners = dict(self._listeners)
+        all_listeners[member_uuid] = listeners
+        self._listeners = all_listeners
+        self._rebuild_group_listeners(self._memberships.get(member_uuid, ()))
+
+    def _set_group_members(self, group_uuid, members):
+        """
+        Replace the members of a group and its fan-out. Must be called with
+        the lock held.
+        """
+        group_members = dict(self._group_members)
+        if members:
+            group_members[group_uuid] = members
+        else:
+            group_members.pop(group_uuid, None)
+        self._group_members = group_members
+        self._rebuild_group_listeners((group_uuid,))
+
+    def _rebuild_group_listeners(self, group_uuids):
+        """
+        Recompute the fan-out of groups group_uuids. Must be called with the
+        lock held.
+        """
+        group_listeners = dict(self._group_listeners)
+        for group_uuid in group_uuids:
+            members = self._group_members.get(group_uuid)
+            if not members:
+                group_listeners.pop(group_uuid, None)
+                continue
+            group_listeners[group_uuid] = _unique(
+                listener
+                for member_uuid in members
+                for listener in self._listeners.get(member_uuid, ())
+            )
+        self._group_listeners = group_listeners
+
 
 class MultizoneController(BaseController):
     """ Controller to monitor audio group members. """
 
     def __init__(self, uuid):
         self._members = {}
+        # dict mapping uuid on name of the groups this device is a member of,
+        # from the last answer to GET_CASTING_GROUPS
+        self._casting_groups = {}
         self._status_listeners = []
         self._uuid = str(uuid)
         super(MultizoneController, self).__init__(
@@ -189,6 +301,9 @@ class MultizoneController(BaseController):
             listener.multizone_member_added(uuid)
             listener.multizone_member_removed(uuid)
             listener.multizone_status_received()
+            listener.multizone_casting_groups(groups), if implemented
+                The answer to GET_CASTING_GROUPS, a dict mapping the uuid on
+                the name of the groups the device is a member of
         """
         self._status_listeners.append(listener)
 
@@ -197,6 +312,14 @@ class MultizoneController(BaseController):
         """ Return a list of audio group members. """
         return list(self._members.keys())
 
+    @property
+    def casting_groups(self):
+        """
+        Return a dict mapping uuid on name of the audio groups the device is a
+        member of, as last reported in answer to GET_CASTING_GROUPS.
+        """
+        return dict(self._casting_groups)
+
     def reset_members(self):
         """ Reset audio group members. """
         for uuid in list(self._members):
@@ -259,6 +382,18 @@ class MultizoneController(BaseController):
 
         if data[MESSAGE_TYPE] == TYPE_CASTING_GROUPS:
             # Answer to GET_CASTING_GROUPS
+            self._casting_groups = {
+                group["deviceId"]: group.get("name")
+                for group in data.get("groups", [])
+                if "deviceId" in group
+            }
+            _LOGGER.debug(
+                "(%s) Member of casting groups %s", self._uuid, self._casting_groups
+            )
+            for listener in list(self._status_listeners):
+                handler = getattr(listener, "multizone_casting_groups", None)
+                if handler is not None:
+                    handler(self.casting_groups)
             return True
 
         return False
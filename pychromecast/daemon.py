@@ -0,0 +1,457 @@
+"""
+Keeps discovery and the connections to all Chromecasts running in a long
+lived process, and serves commands and status snapshots to other processes
+on the same host through a Unix socket.
+
+Short lived tools such as scripts and cron jobs use a DaemonClient instead
+of discovering and connecting to the devices on every run, so a command
+completes in about one round trip to the device.
+
+The protocol is newline delimited JSON. Each request is an object with an
+id, a command and params, it is answered by an object with the same id and
+either a result or an error.
+
+Run the daemon with python -m pychromecast.daemon serve, and send commands
+with python -m pychromecast.daemon COMMAND [key=value ...].
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+from uuid import UUID
+
+from . import get_cached_chromecasts, get_chromecasts
+from .device_cache import DeviceCache
+from .discovery import stop_discovery
+from .error import ChromecastConnectionError, DaemonError, PyChromecastError
+from .fleet import CastFleet
+from .shared_discovery import bind_unix_socket
+
+# Seconds the client waits for an answer of the daemon
+CLIENT_TIMEOUT = 30
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def default_socket_path():
+    """
+    Returns the default path of the daemon socket, in $XDG_RUNTIME_DIR if set,
+    otherwise in the temporary directory.
+    """
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, "pychromecast-{}.sock".format(os.getuid()))
+
+
+def _encode_message(message):
+    """ Returns message as a line of JSON. """
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def _encode_result(result):
+    """ Returns a FleetResult as a JSON compatible dict keyed by uuid. """
+    return {
+        "succeeded": sorted(str(cast.uuid) for cast in result.succeeded),
+        "failed": {str(cast.uuid): str(error) for cast, error in result.failed.items()},
+        "timed_out": sorted(str(cast.uuid) for cast in result.timed_out),
+    }
+
+
+def describe(cast):
+    """ Returns a JSON compatible snapshot of the status of cast. """
+    status = cast.status
+    media = cast.media_controller.status
+    return {
+        "uuid": str(cast.uuid),
+        "name": cast.name,
+        "model_name": cast.model_name,
+        "cast_type": cast.cast_type,
+        "host": cast.socket_client.host,
+        "connected": cast.socket_client.is_connected,
+        "volume_level": status.volume_level if status else None,
+        "volume_muted": status.volume_muted if status else None,
+        "app_id": status.app_id if status else None,
+        "display_name": status.display_name if status else None,
+        "player_state": media.player_state if media else None,
+        "title": media.title if media else None,
+        "content_id": media.content_id if media else None,
+    }
+
+
+class CastDaemon:
+    """
+    Discovers and connects to all Chromecasts, and serves commands for them
+    on a Unix socket.
+
+    Commands take selectors in their params, names, uuids, models and groups,
+    see CastFleet.select, and a timeout. Commands sent to devices return
+    the uuids which succeeded, failed and timed out.
+
+    :param path: The path of the Unix socket, None for default_socket_path().
+    :param cache_path: Path of a DeviceCache file. If given, the devices in
+                       the cache are connected to right away on start, before
+                       discovery found them.
+    :param fleet: The CastFleet to add the discovered devices to.
+    """
+
+    def __init__(self, path=None, cache_path=None, fleet=None):
+        self.path = path or default_socket_path()
+        self.cache_path = cache_path
+        self.fleet = fleet or CastFleet()
+        self.browser = None
+        self._server = None
+        self._thread = None
+        # Serializes adding discovered casts to the fleet
+        self._lock = threading.Lock()
+        self._commands = {
+            "status": self._status,
+            "set_volume": self._set_volume,
+            "set_volume_muted": self._set_volume_muted,
+            "quit_app": self._quit_app,
+            "start_app": self._start_app,
+            "play_media": self._play_media,
+            "play": self._media_command,
+            "pause": self._media_command,
+            "stop": self._media_command,
+        }
+
+    def start(self):
+        """
+        Start discovery and listen on the Unix socket. Raises OSError with
+        errno EADDRINUSE if another daemon is running on the socket.
+        """
+        # Only the user running the daemon may connect
+        self._server = bind_unix_socket(self.path, 0o600)
+        self._thread = threading.Thread(
+            target=self._accept_loop, name="CastDaemon", daemon=True
+        )
+        self._thread.start()
+
+        if self.cache_path is None:
+            self.browser = get_chromecasts(blocking=False, callback=self._add_cast)
+        else:
+            casts, self.browser = get_cached_chromecasts(
+                DeviceCache(self.cache_path), callback=self._add_cast
+            )
+            for cast in casts:
+                self.fleet.add(cast)
+
+    def stop(self):
+        """ Stop discovery, the Unix socket and all connections. """
+        if self.browser is not None:
+            stop_discovery(self.browser)
+            self.browser = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        for cast in self.fleet.casts:
+            cast.disconnect(timeout=0)
+
+    def _add_cast(self, cast):
+        """ Called with each discovered Chromecast, from several threads. """
+        with self._lock:
+            known = bool(self.fleet.select(uuids=[cast.uuid]))
+            if not known:
+                self.fleet.add(cast)
+        if known:
+            # Release the sockets of the duplicate, it was never started
+            cast.socket_client.close()
+            return
+        _LOGGER.debug("Adding %s", cast)
+        cast.start()
+
+    def _accept_loop(self):
+        """ Accept clients, each client is served by its own thread. """
+        server = self._server
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                # The server socket was closed
+                return
+            threading.Thread(
+                target=self._serve, args=(client,), name="CastDaemonClient", daemon=True
+            ).start()
+
+    def _serve(self, client):
+        """ Answer the requests of a client until it disconnects. """
+        with client, client.makefile("rb") as lines:
+            for line in lines:
+                try:
+                    client.sendall(_encode_message(self.handle(line)))
+                except OSError:
+                    return
+
+    def handle(self, line):
+        """ Returns the answer to a request, given as a line of JSON. """
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            command = request["command"]
+            params = dict(request.get("params") or {})
+        except (ValueError, TypeError, KeyError, AttributeError) as err:
+            return {"id": None, "error": "Invalid request: {}".format(err)}
+
+        handler = self._commands.get(command)
+        if handler is None:
+            return {"id": request_id, "error": "Unknown command {}".format(command)}
+        try:
+            targets = self.fleet.select(
+                names=params.pop("names", None),
+                uuids=params.pop("uuids", None),
+                models=params.pop("models", None),
+                groups=params.pop("groups", None),
+            )
+            if command in ("play", "pause", "stop"):
+                params["command"] = command
+            return {"id": request_id, "result": handler(targets, **params)}
+        except (PyChromecastError, TypeError, ValueError) as err:
+            return {"id": request_id, "error": str(err)}
+
+    def _status(self, targets):
+        """ Returns a snapshot of targets. """
+        return {"devices": [describe(cast) for cast in targets]}
+
+    def _set_volume(self, targets, volume, timeout=None):
+        """ Set the volume of targets. """
+        return _encode_result(self.fleet.set_volume(volume, targets, timeout))
+
+    def _set_volume_muted(self, targets, muted, timeout=None):
+        """ Mute or unmute targets. """
+
+        def send(cast, done, failed):
+            cast.set_volume_muted(
+                muted,
+                callback_function=done,
+                failure_function=lambda: failed(
+                    ChromecastConnectionError("Failed to send the command")
+                ),
+            )
+
+        return _encode_result(self.fleet.run(send, targets, timeout))
+
+    def _quit_app(self, targets, timeout=None):
+        """ Quit the app of targets. """
+        return _encode_result(self.fleet.quit_app(targets, timeout))
+
+    def _start_app(self, targets, app_id, force_launch=False, timeout=None):
+        """ Start an app on targets. """
+        return _encode_result(
+            self.fleet.start_app(app_id, force_launch, targets, timeout)
+        )
+
+    # pylint: disable=too-many-arguments
+    def _play_media(self, targets, url, content_type, timeout=None, **kwargs):
+        """ Play media on targets. """
+        return _encode_result(
+            self.fleet.play_media(url, content_type, targets, timeout, **kwargs)
+        )
+
+    def _media_command(self, targets, command, timeout=None):
+        """ Send PLAY, PAUSE or STOP to targets. """
+
+        def send(cast, done, failed):
+            getattr(cast.media_controller, command)(
+                callback_function=done,
+                failure_function=lambda: failed(
+                    ChromecastConnectionError("Failed to send the command")
+                ),
+            )
+
+        return _encode_result(self.fleet.run(send, targets, timeout))
+
+
+class DaemonClient:
+    """
+    Sends commands to a CastDaemon. The connection is opened on the first
+    request and kept until close.
+
+    Selector keyword arguments, names, uuids, models and groups, pick the
+    devices a command applies to, all devices if none is given. Commands sent
+    to devices return a dict with the uuids which succeeded, failed and
+    timed out.
+
+    :param path: The path of the Unix socket, None for default_socket_path().
+    :param timeout: Seconds to wait for an answer of the daemon.
+    """
+
+    def __init__(self, path=None, timeout=CLIENT_TIMEOUT):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._socket = None
+        self._lines = None
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Close the connection to the daemon. """
+        with self._lock:
+            if self._socket is not None:
+                self._lines.close()
+                self._socket.close()
+                self._socket = None
+                self._lines = None
+
+    def request(self, command, **params):
+        """
+        Send a command with params and return its result. Raises DaemonError
+        if the daemon can't be reached or answers with an error.
+        """
+        with self._lock:
+            self._request_id += 1
+            message = {"id": self._request_id, "command": command, "params": params}
+            try:
+                if self._socket is None:
+                    self._connect()
+                self._socket.sendall(_encode_message(message))
+                line = self._lines.readline()
+            except OSError as err:
+                self._reset()
+                raise DaemonError(
+                    "Failed to reach the daemon at {}: {}".format(self.path, err)
+                ) from err
+            if not line:
+                self._reset()
+                raise DaemonError("The daemon closed the connection")
+        answer = json.loads(line)
+        if "error" in answer:
+            raise DaemonError(answer["error"])
+        return answer["result"]
+
+    def _connect(self):
+        """ Connect to the daemon. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._socket = sock
+        self._lines = sock.makefile("rb")
+
+    def _reset(self):
+        """ Drop a broken connection, the next request reconnects. """
+        if self._socket is not None:
+            self._lines.close()
+            self._socket.close()
+        self._socket = None
+        self._lines = None
+
+    def status(self, **selectors):
+        """ Returns a list of dicts with the status of the devices. """
+        return self.request("status", **selectors)["devices"]
+
+    def set_volume(self, volume, **selectors):
+        """ Set the volume, between 0 and 1. """
+        return self.request("set_volume", volume=volume, **selectors)
+
+    def set_volume_muted(self, muted, **selectors):
+        """ Mute or unmute. """
+        return self.request("set_volume_muted", muted=muted, **selectors)
+
+    def quit_app(self, **selectors):
+        """ Quit the running app. """
+        return self.request("quit_app", **selectors)
+
+    def start_app(self, app_id, force_launch=False, **selectors):
+        """ Start an app. """
+        return self.request(
+            "start_app", app_id=app_id, force_launch=force_launch, **selectors
+        )
+
+    def play_media(self, url, content_type, **params):
+        """ Play media, other params are passed to MediaController.play_media. """
+        return self.request("play_media", url=url, content_type=content_type, **params)
+
+    def play(self, **selectors):
+        """ Send PLAY. """
+        return self.request("play", **selectors)
+
+    def pause(self, **selectors):
+        """ Send PAUSE. """
+        return self.request("pause", **selectors)
+
+    def stop(self, **selectors):
+        """ Send STOP. """
+        return self.request("stop", **selectors)
+
+
+def _parse_value(value):
+    """ Returns a command line value decoded as JSON, or as is. """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    """ Run the daemon, or send it a command. """
+    parser = argparse.ArgumentParser(
+        prog="python -m pychromecast.daemon",
+        description="Run the PyChromecast daemon, or send it a command.",
+    )
+    parser.add_argument("command", help="serve, or a command such as status")
+    parser.add_argument("params", nargs="*", help="Command parameters as key=value")
+    parser.add_argument("--socket", help="Path of the daemon socket")
+    parser.add_argument("--cache", help="Path of the device cache of the daemon")
+    parser.add_argument("--name", action="append", help="Select devices by name")
+    parser.add_argument("--uuid", action="append", help="Select devices by uuid")
+    parser.add_argument("--model", action="append", help="Select devices by model")
+    parser.add_argument("--group", action="append", help="Select an audio group")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.command == "serve":
+        daemon = CastDaemon(args.socket, args.cache)
+        daemon.start()
+        _LOGGER.info("Serving on %s", daemon.path)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stop()
+        return 0
+
+    params = {}
+    for param in args.params:
+        key, sep, value = param.partition("=")
+        if not sep:
+            parser.error("Parameters must be key=value, not {}".format(param))
+        params[key] = _parse_value(value)
+    for key, values in (
+        ("names", args.name),
+        ("uuids", args.uuid and [str(UUID(uuid)) for uuid in args.uuid]),
+        ("models", args.model),
+        ("groups", args.group),
+    ):
+        if values:
+            params[key] = values
+
+    with DaemonClient(args.socket) as client:
+        try:
+            result = client.request(args.command, **params)
+        except DaemonError as err:
+            print(err)
+            return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+"""
+Persistent cache of discovered devices, used to connect to known devices
+right away when a process starts instead of waiting for discovery.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from uuid import UUID
+
+from .clock import SYSTEM_CLOCK
+from .const import CAST_MANUFACTURERS, CAST_TYPES, CAST_TYPE_CHROMECAST
+from .dial import DeviceStatus
+
+CACHE_VERSION = 1
+# Seconds after which a device which has not been seen is dropped
+CACHE_TTL = 7 * 24 * 3600
+# Seconds to wait for more changes before writing the cache file
+SAVE_DELAY = 2
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DeviceCache:
+    """
+    Devices keyed by UUID, stored in a JSON file.
+
+    Each entry holds the host, port, mDNS service names, model name, friendly
+    name, manufacturer and cast type of a device, and the time it was last
+    seen. Entries which have not been seen for ttl seconds are stale: they are
+    not returned, and are dropped when the file is written.
+
+    The file is written atomically, a crash never leaves a partially written
+    cache behind. A missing or corrupt file results in an empty cache.
+
+    :param path: Path of the JSON file.
+    :param ttl: Seconds after which an entry which has not been seen is stale.
+    :param clock: The clock used to timestamp entries.
+    """
+
+    def __init__(self, path, ttl=CACHE_TTL, clock=SYSTEM_CLOCK):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        # dict mapping uuid string on entry dict
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._save_timer = None
+        self.load()
+
+    def __len__(self):
+        return len(self.entries())
+
+    def load(self):
+        """ (Re)load the cache file. """
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as err:
+            _LOGGER.warning("Ignoring unreadable device cache %s: %s", self.path, err)
+            data = {}
+
+        if not isinstance(data, dict) or not isinstance(data.get("devices", {}), dict):
+            _LOGGER.warning("Ignoring malformed device cache %s", self.path)
+            data = {}
+        elif data and data.get("version") != CACHE_VERSION:
+            _LOGGER.warning(
+                "Ignoring device cache %s with version %s",
+                self.path,
+                data.get("version"),
+            )
+            data = {}
+
+        with self._lock:
+            self._entries = data.get("devices", {})
+
+    def save(self):
+        """ Atomically write the fresh entries to the cache file. """
+        with self._lock:
+            self._save_timer = None
+            now = self.clock.time()
+            self._entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if not self._is_stale(entry, now)
+            }
+            data = json.dumps(
+                {"version": CACHE_VERSION, "devices": self._entries},
+                indent=2,
+                sort_keys=True,
+            )
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(
+            prefix=".device_cache", suffix=".tmp", dir=directory
+        )
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def save_soon(self, delay=SAVE_DELAY):
+        """
+        Write the cache file after delay seconds, to batch the writes for a
+        burst of changes.
+        """
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(delay, self._save_in_background)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_in_background(self):
+        """ Write the cache file from a timer thread. """
+        try:
+            self.save()
+        except OSError:
+            _LOGGER.exception("Failed to write device cache %s", self.path)
+
+    def _is_stale(self, entry, now):
+        """ Returns True if entry has not been seen for ttl seconds. """
+        return self.ttl is not None and now - entry.get("updated", 0) > self.ttl
+
+    # pylint: disable=too-many-arguments
+    def update(
+        self,
+        uuid,
+        host,
+        port,
+        services=None,
+        model_name=None,
+        friendly_name=None,
+        manufacturer=None,
+        cast_type=None,
+    ):
+        """
+        Add or refresh the entry of the device with UUID uuid. Manufacturer
+        and cast type are derived from the model name if not given.
+        """
+        model_key = (model_name or "").lower()
+        entry = {
+            "host": host,
+            "port": port,
+            "services": sorted(services or ()),
+            "model_name": model_name,
+            "friendly_name": friendly_name,
+            "manufacturer": manufacturer
+            or CAST_MANUFACTURERS.get(model_key, "Google Inc."),
+            "cast_type": cast_type or CAST_TYPES.get(model_key, CAST_TYPE_CHROMECAST),
+            "updated": self.clock.time(),
+        }
+        with self._lock:
+            self._entries[str(uuid)] = entry
+
+    def update_from_service(self, service):
+        """
+        Add or refresh a device from a CastListener.services tuple.
+        """
+        services, uuid, model_name, friendly_name, host, port = service
+        self.update(
+            uuid,
+            host,
+            port,
+            services=services,
+            model_name=model_name,
+            friendly_name=friendly_name,
+        )
+
+    def remove(self, uuid):
+        """ Remove the entry of the device with UUID uuid. """
+        with self._lock:
+            self._entries.pop(str(uuid), None)
+
+    def get(self, uuid):
+        """ Returns the fresh entry of the device with UUID uuid, or None. """
+        with self._lock:
+            entry = self._entries.get(str(uuid))
+            if entry is None or self._is_stale(entry, self.clock.time()):
+                return None
+            return dict(entry)
+
+    def entries(self):
+        """ Returns a dict mapping UUID on the fresh entries. """
+        now = self.clock.time()
+        with self._lock:
+            return {
+                UUID(key): dict(entry)
+                for key, entry in self._entries.items()
+                if not self._is_stale(entry, now)
+            }
+
+    @staticmethod
+    def device_status(uuid, entry):
+        """ Returns a DeviceStatus for a cache entry. """
+        return DeviceStatus(
+            friendly_name=entry.get("friendly_name"),
+            model_name=entry.get("model_name"),
+            manufacturer=entry.get("manufacturer"),
+            uuid=uuid,
+            cast_type=entry.get("cast_type"),
+        )
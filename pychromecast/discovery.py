@@ -1,24 +1,350 @@
 """Discovers Chromecasts on the network using mDNS/zeroconf."""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import re
 import socket
-from threading import Event
+from threading import Event, Lock, Thread
 from uuid import UUID
+import weakref
 
 import zeroconf
 
+from .clock import SYSTEM_CLOCK
+from .error import ResourceLimitError
+from .resources import REGISTRY
+from .service_registry import ServiceRegistry
+from .zeroconf_manager import ZEROCONF
+
 DISCOVER_TIMEOUT = 5
+# Worker threads resolving services for the discovery entry points
+RESOLVE_WORKERS = 4
+# Seconds to wait for each attempt to resolve a service
+RESOLVE_TIMEOUT = 3
+# Number of recent resolution latencies kept for statistics
+LATENCY_SAMPLES = 1000
+
+EVENT_ADD = "add"
+EVENT_UPDATE = "update"
+EVENT_REMOVE = "remove"
+
+SOURCE_MDNS = "mdns"
+
+# Fields of a device compared by debounced updates
+CHANGE_FIELDS = ("host", "port", "friendly_name", "model_name", "services")
+
+# Cast service instance names embed the device's UUID as 32 hex digits
+_UUID_IN_NAME = re.compile(r"[0-9a-f]{32}")
+# Guards the flags recording that a browser has released its zeroconf instance
+_STOP_LOCK = Lock()
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def uuid_from_service_name(name):
+    """
+    Returns the device UUID embedded in a cast service name, as a hex string,
+    or None if the name doesn't contain one.
+    """
+    match = _UUID_IN_NAME.search(name.lower())
+    return match.group(0) if match else None
+
+
+def uuid_filter(uuids):
+    """
+    Returns a service filter for CastListener which only lets through the
+    services of devices with one of the given UUIDs.
+    """
+    wanted = {UUID(str(uuid)).hex for uuid in uuids}
+
+    def service_filter(name):
+        """ True if the service name embeds a wanted UUID. """
+        return uuid_from_service_name(name) in wanted
+
+    return service_filter
+
+
+def name_prefix_filter(prefixes):
+    """
+    Returns a service filter for CastListener which only lets through
+    services whose name starts with one of the given prefixes, for example
+    "Google-Home-" or "Chromecast-".
+    """
+    prefixes = tuple(prefixes)
+
+    def service_filter(name):
+        """ True if the service name has a wanted prefix. """
+        return name.startswith(prefixes)
+
+    return service_filter
+
+
+class ServiceResolver:
+    """
+    Handles the service events of a CastListener on a bounded pool of worker
+    threads, so resolving services and running callbacks doesn't block the
+    zeroconf browser thread.
+
+    The events of a service are handled one at a time, in order. An add or
+    update event which is still waiting absorbs later add and update events
+    of the same service, and a remove event drops them.
+
+    :param handler: Function called with (event, zconf, typ, name) on a worker
+                    thread, which returns False if resolving the service
+                    failed.
+    :param workers: Maximum number of worker threads.
+    :param timeout: A floating point number specifying how many seconds to
+                    wait for each attempt to resolve a service.
+    :param clock: The clock used to measure resolution latency.
+    """
+
+    def __init__(
+        self, handler, workers=RESOLVE_WORKERS, timeout=RESOLVE_TIMEOUT, clock=None
+    ):
+        self.timeout = timeout
+        self._handler = handler
+        self._clock = clock or SYSTEM_CLOCK
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="CastResolver"
+        )
+        self._lock = Lock()
+        # dict mapping service name on a deque of waiting
+        # [event, zconf, typ, queued time] lists, present while a worker is
+        # handling the service
+        self._pending = {}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._resolved = 0
+        self._failed = 0
+        self._shutdown = False
+
+    def submit(self, event, zconf, typ, name):
+        """ Queue an EVENT_ADD, EVENT_UPDATE or EVENT_REMOVE for service name. """
+        with self._lock:
+            if self._shutdown:
+                return
+            events = self._pending.get(name)
+            start = events is None
+            if start:
+                events = self._pending[name] = deque()
+
+            if event == EVENT_REMOVE:
+                # Waiting events are moot once the service is gone
+                events.clear()
+            elif events and events[-1][0] != EVENT_REMOVE:
+                waiting = events[-1]
+                if event == EVENT_ADD:
+                    waiting[0] = EVENT_ADD
+                waiting[1] = zconf
+                return
+            events.append([event, zconf, typ, self._clock.time()])
+
+        if start:
+            self._executor.submit(self._work, name)
+
+    def _work(self, name):
+        """ Handle the events of service name until none are left. """
+        while True:
+            with self._lock:
+                events = self._pending[name]
+                if not events:
+                    del self._pending[name]
+                    return
+                event, zconf, typ, queued = events.popleft()
+
+            try:
+                resolved = self._handler(event, zconf, typ, name)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to handle %s of service %s", event, name)
+                resolved = False
+
+            if event == EVENT_REMOVE:
+                continue
+            with self._lock:
+                if resolved is False:
+                    self._failed += 1
+                else:
+                    self._resolved += 1
+                    self._latencies.append(self._clock.time() - queued)
+
+    def stats(self):
+        """
+        Returns a dict with:
+          resolved: Number of services resolved.
+          failed: Number of services which could not be resolved.
+          pending: Number of services with events waiting or being handled.
+          latency_avg, latency_p95, latency_max: Seconds from the zeroconf
+            event to the service being resolved, over recent resolutions.
+            None if no service has been resolved.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "resolved": self._resolved,
+                "failed": self._failed,
+                "pending": len(self._pending),
+                "latency_avg": None,
+                "latency_p95": None,
+                "latency_max": None,
+            }
+        if latencies:
+            stats["latency_avg"] = sum(latencies) / len(latencies)
+            stats["latency_p95"] = latencies[int(len(latencies) * 0.95)]
+            stats["latency_max"] = latencies[-1]
+        return stats
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once the queued events have been handled.
+        Events submitted afterwards are dropped.
+        """
+        with self._lock:
+            self._shutdown = True
+        self._executor.shutdown(wait=wait)
+
+
+class UpdateDebouncer:
+    """
+    Delays calls until no new call for the same key has been submitted for a
+    quiet window, so a burst of calls results in one call with the latest
+    arguments.
+
+    The calls are made from a thread which only runs while calls are waiting.
+
+    :param handler: Function called with the arguments of the last submit of
+                    a key.
+    :param window: Quiet window in seconds.
+    :param clock: The clock used to wait.
+    """
+
+    def __init__(self, handler, window, clock=SYSTEM_CLOCK):
+        self.window = window
+        self._handler = handler
+        self._clock = clock
+        self._lock = Lock()
+        self._wake = Event()
+        # dict mapping key on (deadline, args) tuples
+        self._pending = {}
+        self._thread = None
+
+    @property
+    def pending(self):
+        """ Number of keys with a call waiting. """
+        return len(self._pending)
+
+    def submit(self, key, *args):
+        """ (Re)start the quiet window of key, then call handler with args. """
+        with self._lock:
+            self._pending[key] = (self._clock.time() + self.window, args)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="UpdateDebouncer", daemon=True
+                )
+                self._thread.start()
+        self._wake.set()
+
+    def cancel(self, key):
+        """ Drop the waiting call of key, if any. """
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _run(self):
+        """ Make the calls whose quiet window has passed. """
+        while True:
+            self._wake.clear()
+            now = self._clock.time()
+            with self._lock:
+                due = [
+                    key
+                    for key, (deadline, _) in self._pending.items()
+                    if deadline <= now
+                ]
+                calls = [self._pending.pop(key)[1] for key in due]
+                if not calls and not self._pending:
+                    self._thread = None
+                    return
+                deadlines = [deadline for deadline, _ in self._pending.values()]
+
+            for args in calls:
+                try:
+                    self._handler(*args)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Failed to handle debounced update %s", args)
+
+            if deadlines:
+                self._clock.wait(self._wake, min(deadlines) - now)
+
+
 class CastListener:
-    """Zeroconf Cast Services collection."""
+    """
+    Zeroconf Cast Services collection.
+
+    The discovered devices are kept in registry, a ServiceRegistry which can
+    be queried by service name, friendly name, model and host. services is a
+    read only view of the registry mapping uuid on (services, uuid,
+    model_name, friendly_name, host, port) tuples.
+
+    If a service_filter is passed, it is called with the name of each service
+    before the service is resolved. Services for which it returns False are
+    not resolved, but remembered in skipped until they are needed, see
+    resolve and resolve_uuid. See uuid_filter and name_prefix_filter for
+    built-in filters.
+
+    By default services are resolved and callbacks are called on the zeroconf
+    thread. If resolve_workers is set, this is instead done by a
+    ServiceResolver with that many worker threads, available as resolver.
+
+    Other discovery backends, such as pychromecast.ssdp, may add devices with
+    add_device. Devices are deduplicated by UUID and the first source to find
+    a device wins: add_callback is called once, later sources only trigger
+    update_callback. sources maps the UUID of each device on the name of the
+    source which found it first.
+
+    If debounce is set, update events of a service are only handled once the
+    service has been quiet for that many seconds. update_callback is then
+    called with (uuid, name, changed), where changed is a tuple of the
+    CHANGE_FIELDS which differ from the previous record, and is not called if
+    nothing changed.
+
+    SocketClients registered with register_client are told about address and
+    service changes of their device, so they reconnect to where the device
+    moved without querying mDNS themselves.
+    """
 
-    def __init__(self, add_callback=None, remove_callback=None, update_callback=None):
-        self.services = {}
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        add_callback=None,
+        remove_callback=None,
+        update_callback=None,
+        service_filter=None,
+        resolve_workers=None,
+        resolve_timeout=RESOLVE_TIMEOUT,
+        debounce=None,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.registry = ServiceRegistry()
+        self.services = self.registry.tuples
         self.add_callback = add_callback
         self.remove_callback = remove_callback
         self.update_callback = update_callback
+        self.sources = {}
+        self._sources_lock = Lock()
+        # dict mapping uuid on a WeakSet of SocketClients
+        self._clients = {}
+        self._clients_lock = Lock()
+        self.service_filter = service_filter
+        # dict mapping names of services skipped by service_filter on
+        # (zconf, type) tuples needed to resolve them later
+        self.skipped = {}
+        self.resolver = None
+        if resolve_workers:
+            self.resolver = ServiceResolver(
+                self._handle_event, resolve_workers, resolve_timeout
+            )
+        self.debouncer = None
+        if debounce:
+            self.debouncer = UpdateDebouncer(self._update_service, debounce, clock)
 
     @property
     def count(self):
@@ -34,44 +360,131 @@ class CastListener:
     def remove_service(self, zconf, typ, name):
         """ Remove a service from the collection. """
         _LOGGER.debug("remove_service %s, %s", typ, name)
-        service = None
-        service_removed = False
-        uuid = None
-        for uuid, services_for_uuid in self.services.items():
-            if name in services_for_uuid[0]:
-                service = services_for_uuid
-                services_for_uuid[0].remove(name)
-                if len(services_for_uuid[0]) == 0:
-                    self.services.pop(uuid)
-                    service_removed = True
-                break
+        if self.skipped.pop(name, None) is not None:
+            return
+        if self.debouncer is not None:
+            self.debouncer.cancel(name)
+        if self.resolver is not None:
+            self.resolver.submit(EVENT_REMOVE, zconf, typ, name)
+            return
+        self._remove_service(typ, name)
 
-        if not service:
+    def _remove_service(self, typ, name):
+        """ Remove a service and call the callbacks. """
+        cast, service_removed = self.registry.remove(name)
+
+        if cast is None:
             _LOGGER.debug("remove_service unknown %s, %s", typ, name)
             return
 
+        if service_removed:
+            self.sources.pop(cast.uuid, None)
+        self._push_address(cast, name, removed=True)
         if self.remove_callback and service_removed:
-            self.remove_callback(uuid, name, service)
+            self.remove_callback(cast.uuid, name, cast.as_tuple())
         if self.update_callback and not service_removed:
-            self.update_callback(uuid, name)
+            if self.debouncer is not None:
+                self.update_callback(cast.uuid, name, ("services",))
+            else:
+                self.update_callback(cast.uuid, name)
 
     def update_service(self, zconf, typ, name):
         """ Update a service in the collection. """
         _LOGGER.debug("update_service %s, %s", typ, name)
+        if self._skip(zconf, typ, name):
+            return
+        if self.debouncer is not None:
+            self.debouncer.submit(name, zconf, typ, name)
+            return
+        self._update_service(zconf, typ, name)
+
+    def _update_service(self, zconf, typ, name):
+        """ Update a service once it is no longer debounced. """
+        if self.resolver is not None:
+            self.resolver.submit(EVENT_UPDATE, zconf, typ, name)
+            return
         self._add_update_service(zconf, typ, name, self.update_callback)
 
     def add_service(self, zconf, typ, name):
         """ Add a service to the collection. """
         _LOGGER.debug("add_service %s, %s", typ, name)
+        if self._skip(zconf, typ, name):
+            return
+        if self.resolver is not None:
+            self.resolver.submit(EVENT_ADD, zconf, typ, name)
+            return
         self._add_update_service(zconf, typ, name, self.add_callback)
 
-    def _add_update_service(self, zconf, typ, name, callback):
-        """ Add or update a service. """
+    def _handle_event(self, event, zconf, typ, name):
+        """ Handle a service event queued on the resolver. """
+        if event == EVENT_REMOVE:
+            self._remove_service(typ, name)
+            return True
+        callback = self.add_callback if event == EVENT_ADD else self.update_callback
+        return self._add_update_service(
+            zconf, typ, name, callback, self.resolver.timeout
+        )
+
+    def _skip(self, zconf, typ, name):
+        """
+        Returns True if the service is rejected by service_filter, the service
+        is then remembered so it can be resolved later.
+        """
+        if self.service_filter is None or self.service_filter(name):
+            return False
+        _LOGGER.debug("Not resolving filtered service %s", name)
+        self.skipped[name] = (zconf, typ)
+        return True
+
+    def resolve(self, name):
+        """
+        Resolve a service skipped by service_filter and add it to the
+        collection. Returns the CastService the service belongs to, or None if
+        it could not be resolved.
+        """
+        entry = self.skipped.pop(name, None)
+        if entry is not None:
+            zconf, typ = entry
+            self._add_update_service(zconf, typ, name, self.add_callback)
+        return self.registry.by_service(name)
+
+    def resolve_uuid(self, uuid):
+        """
+        Returns the CastService of the device with UUID uuid, resolving its
+        services on demand if they were skipped by service_filter. Returns None
+        if the device has not been found.
+        """
+        cast = self.registry.get(uuid)
+        if cast is not None:
+            return cast
+        for name in list(self.skipped):
+            if uuid_from_service_name(name) == uuid.hex:
+                self.resolve(name)
+        return self.registry.get(uuid)
+
+    def resolve_skipped(self):
+        """
+        Resolve the skipped services which pass the current service_filter,
+        for example after it has been changed.
+        """
+        for name in list(self.skipped):
+            if self.service_filter is None or self.service_filter(name):
+                self.resolve(name)
+
+    def _add_update_service(self, zconf, typ, name, callback, timeout=None):
+        """
+        Add or update a service. Returns False if the service could not be
+        resolved. timeout is the number of seconds to wait for each attempt to
+        resolve the service, None to use the zeroconf default.
+        """
         service = None
         tries = 0
         while service is None and tries < 4:
             try:
-                service = zconf.get_service_info(typ, name)
+                if timeout is None:
+                    service = zconf.get_service_info(typ, name)
+                else:
+                    service = zconf.get_service_info(typ, name, int(timeout * 1000))
             except IOError:
                 # If the zeroconf fails to receive the necessary data we abort
                 # adding the service
@@ -80,7 +493,7 @@ class CastListener:
 
         if not service:
             _LOGGER.debug("add_service failed to add %s, %s", typ, name)
-            return
+            return False
 
         def get_value(key):
             """Retrieve value and decode to UTF-8."""
@@ -99,27 +512,121 @@ class CastListener:
 
         if not uuid:
             _LOGGER.debug("add_service failed to get uuid for %s, %s", typ, name)
-            return
-        uuid = UUID(uuid)
+            return False
 
-        services_for_uuid = self.services.setdefault(
-            uuid, ({name}, uuid, model_name, friendly_name)
-        )
-        services_for_uuid[0].add(name)
-        self.services[uuid] = (
-            services_for_uuid[0],
-            services_for_uuid[1],
-            model_name,
-            friendly_name,
-            host,
-            service.port,
+        self._add_mdns_service(
+            name, UUID(uuid), model_name, friendly_name, host, service.port, callback
         )
+        return True
 
-        if callback:
-            callback(uuid, name)
+    # pylint: disable=too-many-arguments
+    def _add_mdns_service(
+        self, name, uuid, model_name, friendly_name, host, port, callback
+    ):
+        """ Add a resolved mDNS service to the registry and call callback. """
+        old_fields = _change_fields(self.registry.get(uuid))
+
+        with self._sources_lock:
+            source = self.sources.setdefault(uuid, SOURCE_MDNS)
+            cast = self.registry.add(name, uuid, model_name, friendly_name, host, port)
+
+        if source != SOURCE_MDNS and callback is self.add_callback:
+            # Another source found the device first
+            callback = self.update_callback
+        if _change_fields(cast) != old_fields:
+            self._push_address(cast, name)
+        self._call_callback(callback, cast, name, old_fields)
+
+    def register_client(self, uuid, socket_client):
+        """
+        Push the address and service changes of the device with UUID uuid to
+        socket_client, see SocketClient.update_address. The listener only
+        holds a weak reference to socket_client.
+        """
+        with self._clients_lock:
+            self._clients.setdefault(uuid, weakref.WeakSet()).add(socket_client)
+
+    def unregister_client(self, uuid, socket_client):
+        """ Stop pushing changes to socket_client. """
+        with self._clients_lock:
+            clients = self._clients.get(uuid)
+            if clients is not None:
+                clients.discard(socket_client)
+                if not clients:
+                    del self._clients[uuid]
+
+    def _push_address(self, cast, name, removed=False):
+        """
+        Tell the SocketClients of cast that service name now resolves to the
+        address of cast, or is gone if removed.
+        """
+        with self._clients_lock:
+            clients = list(self._clients.get(cast.uuid, ()))
+        for client in clients:
+            if removed:
+                client.update_address(name, None, None, cast.services)
+            else:
+                client.update_address(name, cast.host, cast.port, cast.services)
+
+    def _call_callback(self, callback, cast, name, old_fields):
+        """
+        Call the add or update callback for service name of cast. A debounced
+        update callback gets the changed fields, and is not called if nothing
+        changed.
+        """
+        if not callback:
+            return
+        if callback is not self.update_callback or self.debouncer is None:
+            callback(cast.uuid, name)
+            return
+        changed = tuple(
+            field
+            for field, old_value, new_value in zip(
+                CHANGE_FIELDS, old_fields, _change_fields(cast)
+            )
+            if old_value != new_value
+        )
+        if changed:
+            callback(cast.uuid, name, changed)
+
+    # pylint: disable=too-many-arguments
+    def add_device(self, source, uuid, model_name, friendly_name, host, port):
+        """
+        Add a device found by another discovery source than mDNS. Returns
+        False if the device was already found, by any source.
+        """
+        with self._sources_lock:
+            if uuid in self.sources:
+                return False
+            cast = self.registry.add_device(uuid, model_name, friendly_name, host, port)
+            if cast is None:
+                return False
+            self.sources[uuid] = source
+
+        _LOGGER.debug("add_device %s found %s at %s:%s", source, uuid, host, port)
+        self._push_address(cast, None)
+        if self.add_callback:
+            self.add_callback(uuid, None)
+        return True
+
+
+def _change_fields(cast):
+    """
+    Returns the values of the CHANGE_FIELDS of a CastService, all None if cast
+    is None.
+    """
+    if cast is None:
+        return (None,) * len(CHANGE_FIELDS)
+    return (
+        cast.host,
+        cast.port,
+        cast.friendly_name,
+        cast.model_name,
+        frozenset(cast.services),
+    )
 
 
-def start_discovery(listener, zeroconf_instance):
+def start_discovery(listener, zeroconf_instance=None):
     """
     Start discovering chromecasts on the network.
 
@@ -134,25 +641,63 @@ def start_discovery(listener, zeroconf_instance):
     discovered chromecasts. To stop discovery, call the stop_discovery method with
     the ServiceBrowser object.
 
-    A shared zeroconf instance can be passed as zeroconf_instance. If no
-    instance is passed, a new instance will be created.
+    A zeroconf instance can be passed as zeroconf_instance. If no instance is
+    passed, the process wide instance managed by
+    pychromecast.zeroconf_manager.ZEROCONF is used. If the shared instance is
+    passed, the caller's reference to it is handed over to the browser.
+
+    Raises ResourceLimitError if the discovery browser limit of
+    pychromecast.resources.REGISTRY has been reached. A reference to the
+    shared zeroconf instance acquired by this method is then released again.
     """
-    return zeroconf.ServiceBrowser(
+    REGISTRY.check_browser_limit()
+    acquired = zeroconf_instance is None
+    if acquired:
+        zeroconf_instance = ZEROCONF.acquire()
+    browser = zeroconf.ServiceBrowser(
         zeroconf_instance, "_googlecast._tcp.local.", listener,
     )
+    try:
+        REGISTRY.track_browser(browser)
+    except ResourceLimitError:
+        browser.cancel()
+        if acquired:
+            ZEROCONF.release(zeroconf_instance)
+        raise
+    REGISTRY.track_zeroconf(zeroconf_instance)
+    # Kept to stop the resolver of the listener in stop_discovery
+    browser._cast_listener = listener  # pylint: disable=protected-access
+    return browser
 
 
 def stop_discovery(browser):
-    """Stop the chromecast discovery thread."""
+    """
+    Stop the chromecast discovery thread and the resolver threads of its
+    listener. The browser's reference to the shared zeroconf instance is
+    released, an instance which is not shared is closed. Stopping a browser
+    which was already stopped does nothing.
+    """
     try:
         browser.cancel()
     except RuntimeError:
         # Throws if called from service callback when joining the zc browser thread
         pass
-    browser.zc.close()
-
-
-def discover_chromecasts(max_devices=None, timeout=DISCOVER_TIMEOUT):
+    with _STOP_LOCK:
+        released = getattr(browser, "_zc_released", False)
+        browser._zc_released = True  # pylint: disable=protected-access
+    if released:
+        # Stopped before, the reference of the browser was already given back
+        return
+    listener = getattr(browser, "_cast_listener", None)
+    if getattr(listener, "resolver", None) is not None:
+        listener.resolver.shutdown(wait=False)
+    if not ZEROCONF.release(browser.zc):
+        browser.zc.close()
+
+
+def discover_chromecasts(
+    max_devices=None, timeout=DISCOVER_TIMEOUT, clock=SYSTEM_CLOCK
+):
     """
     Discover chromecasts on the network.
 
@@ -162,6 +707,11 @@ def discover_chromecasts(max_devices=None, timeout=DISCOVER_TIMEOUT):
       A service browser to keep the Chromecast mDNS data updated. When updates
       are (no longer) needed, pass the broswer object to
       pychromecast.discovery.stop_discover().
+
+    :param max_devices: Stop waiting once this many devices have been found.
+    :param timeout: A floating point number specifying the time to wait for
+                    devices to be found.
+    :param clock: The clock used to wait for timeout.
     """
     # pylint: disable=unused-argument
     def callback(uuid, name):
@@ -170,18 +720,20 @@ def discover_chromecasts(max_devices=None, timeout=DISCOVER_TIMEOUT):
             discover_complete.set()
 
     discover_complete = Event()
-    listener = CastListener(callback)
-    zconf = zeroconf.Zeroconf()
-    browser = start_discovery(listener, zconf)
+    listener = CastListener(callback, resolve_workers=RESOLVE_WORKERS)
+    browser = start_discovery(listener)
 
     # Wait for the timeout or the maximum number of devices
-    discover_complete.wait(timeout)
+    clock.wait(discover_complete, timeout)
 
     return (listener.devices, browser)
 
 
 def discover_listed_chromecasts(
-    friendly_names=None, uuids=None, discovery_timeout=DISCOVER_TIMEOUT,
+    friendly_names=None,
+    uuids=None,
+    discovery_timeout=DISCOVER_TIMEOUT,
+    clock=SYSTEM_CLOCK,
 ):
     """
     Searches the network for chromecast devices matching a list of friendly
@@ -198,33 +750,207 @@ def discover_listed_chromecasts(
     :param uuids: A list of wanted uuids
     :param discovery_timeout: A floating point number specifying the time to wait
                                devices matching the criteria have been found.
+    :param clock: The clock used to wait for discovery_timeout.
     """
 
     cc_list = {}
+    # The devices not found yet, the caller's lists are left untouched
+    wanted_uuids = set(uuids or ())
+    wanted_names = set(friendly_names or ())
 
     def callback(uuid, name):  # pylint: disable=unused-argument
-        service = listener.services[uuid]
-        friendly_name = service[3]
-        if uuids and uuid in uuids:
-            cc_list[uuid] = listener.services[uuid]
-            uuids.remove(uuid)
-        if friendly_names and friendly_name in friendly_names:
-            cc_list[uuid] = listener.services[uuid]
-            friendly_names.remove(friendly_name)
-        if not friendly_names and not uuids:
+        cast = listener.registry.get(uuid)
+        if cast is None:
+            return
+        if uuid in wanted_uuids:
+            cc_list[uuid] = cast.as_tuple()
+            wanted_uuids.discard(uuid)
+        if cast.friendly_name in wanted_names:
+            cc_list[uuid] = cast.as_tuple()
+            wanted_names.discard(cast.friendly_name)
+        if not wanted_names and not wanted_uuids:
             discover_complete.set()
 
     discover_complete = Event()
 
-    listener = CastListener(callback)
-    zconf = zeroconf.Zeroconf()
-    browser = start_discovery(listener, zconf)
+    service_filter = None
+    if wanted_uuids and not wanted_names:
+        # Only resolve the services of the wanted devices
+        service_filter = uuid_filter(wanted_uuids)
+    listener = CastListener(
+        callback, service_filter=service_filter, resolve_workers=RESOLVE_WORKERS
+    )
+    browser = start_discovery(listener)
 
     # Wait for the timeout or found all wanted devices
-    discover_complete.wait(discovery_timeout)
+    clock.wait(discover_complete, discovery_timeout)
     return (cc_list.values(), browser)
 
 
+class CastServiceStream:
+    """
+    Iterator over the chromecast services on the network, which yields each
+    service as soon as it has been discovered. Supports both iteration and
+    asynchronous iteration.
+
+    The iteration ends when max_devices services have been yielded or when
+    the timeout has passed. Discovery keeps running after the iteration has
+    ended, to keep the mDNS data updated. When updates are (no longer) needed,
+    pass the browser attribute to pychromecast.discovery.stop_discovery().
+
+    :param max_devices: Stop after yielding this many services.
+    :param timeout: A floating point number specifying the time in seconds
+                    after which the iteration ends. None to never end.
+    :param predicate: A function which is called with each discovered service
+                      and returns True if the service should be yielded.
+    :param clock: The clock used to wait for services.
+    """
+
+    def __init__(
+        self, max_devices=None, timeout=DISCOVER_TIMEOUT, predicate=None, clock=None
+    ):
+        self.max_devices = max_devices
+        self.predicate = predicate
+        self._clock = clock or SYSTEM_CLOCK
+        self._deadline = None if timeout is None else self._clock.time() + timeout
+        self._count = 0
+        self._services = deque()
+        self._available = Event()
+        self._lock = Lock()
+        self._stopped = False
+        # (loop, asyncio.Event) of the asynchronous iterations waiting
+        self._async_waiters = []
+
+        self.listener = CastListener(
+            self._add_callback, resolve_workers=RESOLVE_WORKERS
+        )
+        self.browser = start_discovery(self.listener)
+
+    def _add_callback(self, uuid, name):  # pylint: disable=unused-argument
+        """ Called when zeroconf has discovered a new chromecast. """
+        service = self.listener.services[uuid]
+        if self.predicate is not None and not self.predicate(service):
+            return
+        with self._lock:
+            self._services.append(service)
+            self._notify()
+
+    def _notify(self):
+        """ Wake up the iterations waiting, must be called with the lock held. """
+        self._available.set()
+        for loop, available in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(available.set)
+            except RuntimeError:
+                # The event loop is closed
+                pass
+
+    def stop(self):
+        """ End the iteration, discovery keeps running. """
+        with self._lock:
+            self._stopped = True
+            self._notify()
+
+    def _ended(self):
+        """ Returns True if the iteration has ended. """
+        return self._stopped or (
+            self.max_devices is not None and self._count >= self.max_devices
+        )
+
+    def _remaining(self):
+        """ Returns the seconds until the timeout, None if there is none. """
+        if self._deadline is None:
+            return None
+        return self._deadline - self._clock.time()
+
+    def _pop_service(self):
+        """ Returns the next service, must be called with the lock held. """
+        self._count += 1
+        return self._services.popleft()
+
+    def _next_service(self):
+        """
+        Blocks until the next service is available. Returns None when the
+        iteration has ended.
+        """
+        while not self._ended():
+            with self._lock:
+                if self._services:
+                    return self._pop_service()
+                self._available.clear()
+
+            remaining = self._remaining()
+            if remaining is not None and remaining <= 0:
+                break
+            self._clock.wait(self._available, remaining)
+        return None
+
+    async def _async_next_service(self):
+        """
+        Waits until the next service is available without blocking the event
+        loop. Returns None when the iteration has ended.
+        """
+        loop = asyncio.get_running_loop()
+        while not self._ended():
+            waiter = (loop, asyncio.Event())
+            with self._lock:
+                if self._services:
+                    return self._pop_service()
+                self._async_waiters.append(waiter)
+
+            try:
+                remaining = self._remaining()
+                if remaining is not None and remaining <= 0:
+                    break
+                await asyncio.wait_for(waiter[1].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._async_waiters.remove(waiter)
+        return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        service = self._next_service()
+        if service is None:
+            raise StopIteration
+        return service
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        service = await self._async_next_service()
+        if service is None:
+            raise StopAsyncIteration
+        return service
+
+    async def aclose(self):
+        """ End the asynchronous iteration, discovery keeps running. """
+        self.stop()
+
+
+def stream_chromecasts(
+    max_devices=None, timeout=DISCOVER_TIMEOUT, predicate=None, clock=None
+):
+    """
+    Discover chromecasts on the network, yielding each chromecast service as
+    soon as it has been discovered instead of waiting for the timeout.
+
+    Returns a CastServiceStream, see its documentation for the parameters.
+
+    Example:
+      stream = stream_chromecasts(predicate=lambda service: service[3] == "Kitchen")
+      for service in stream:
+          ...
+      stop_discovery(stream.browser)
+    """
+    return CastServiceStream(max_devices, timeout, predicate, clock)
+
+
 def get_info_from_service(service, zconf):
     """ Resolve service_info from service. """
     service_info = None
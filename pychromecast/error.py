@@ -52,3 +52,24 @@ class ControllerNotRegistered(PyChromecastError):
     Raised when trying to interact with a controller while it is
     not registered with a ChromeCast object.
     """
+
+
+class ResourceLimitError(PyChromecastError):
+    """
+    Raised when creating a connection or discovery browser would exceed the
+    limits configured on pychromecast.resources.REGISTRY.
+    """
+
+
+class RequestFailed(PyChromecastError):
+    """
+    Raised when a Chromecast answers a request with an error, such as
+    INVALID_REQUEST or LOAD_FAILED.
+    """
+
+
+class DaemonError(PyChromecastError):
+    """
+    Raised by DaemonClient when the daemon can't be reached or answers a
+    request with an error.
+    """
@@ -0,0 +1,587 @@
+"""
+Controls many Chromecasts at once.
+"""
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+import fnmatch
+import logging
+import threading
+
+from . import get_chromecast_from_service
+from .clock import SYSTEM_CLOCK
+from .controllers.media import MEDIA_PLAYER_STATE_PAUSED, MEDIA_PLAYER_STATE_PLAYING
+from .error import (
+    ChromecastConnectionError,
+    LaunchError,
+    PyChromecastError,
+    RequestFailed,
+)
+from .socket_client import CONNECTION_STATUS_CONNECTED, MESSAGE_TYPE
+
+# Seconds to wait for the devices in each phase of a synchronized start
+SYNC_TIMEOUT = 30
+# Maximum number of commands in flight
+MAX_PARALLEL = 64
+# Seconds each device has to answer a command
+COMMAND_TIMEOUT = 10
+# Number of devices prewarmed in parallel
+PREWARM_PARALLEL = 16
+# Seconds each device has to become ready when prewarmed
+PREWARM_TIMEOUT = 30
+# Phases of prewarming a device
+PHASE_DIAL = "dial"
+PHASE_CONNECT = "connect"
+PHASE_STATUS = "status"
+# Message types with which a Chromecast answers a request it failed
+ERROR_TYPES = (
+    "INVALID_PLAYER_STATE",
+    "INVALID_REQUEST",
+    "LAUNCH_ERROR",
+    "LOAD_CANCELLED",
+    "LOAD_FAILED",
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Result of play_media_synchronized:
+#   started: The casts which started playing.
+#   failed: The casts which did not load the media or did not start playing in
+#     time.
+#   start_times: dict mapping uuid on the time the device started playing,
+#     estimated from its MediaStatus.
+#   skew: Seconds between the first and the last device to start, None if no
+#     device started.
+SyncPlayResult = namedtuple(
+    "SyncPlayResult", ["started", "failed", "start_times", "skew"]
+)
+
+# Result of a CastFleet command:
+#   succeeded: dict mapping cast on the response of the device, None for
+#     commands without a response message.
+#   failed: dict mapping cast on the PyChromecastError the command failed with.
+#   timed_out: The casts which did not answer before the timeout.
+FleetResult = namedtuple("FleetResult", ["succeeded", "failed", "timed_out"])
+
+# Result of CastFleet.prewarm:
+#   ready: The casts which connected and received their first status.
+#   failed: dict mapping uuid on the error the device failed with.
+#   timings: dict mapping uuid on a dict mapping each phase the device
+#     completed on its duration in seconds.
+PrewarmResult = namedtuple("PrewarmResult", ["ready", "failed", "timings"])
+
+
+class _SessionWatcher:
+    """ Follows the media status of one cast during a synchronized start. """
+
+    def __init__(self, cast, changed):
+        self.cast = cast
+        self.status = None
+        self.paused_time = None
+        self._changed = changed
+        cast.media_controller.register_status_listener(self)
+
+    def new_media_status(self, status):
+        """ Called when the media status of the cast changes. """
+        self.status = status
+        self._changed.set()
+
+    def is_paused(self):
+        """ True if the media is loaded and paused. """
+        return (
+            self.status is not None
+            and self.status.player_state == MEDIA_PLAYER_STATE_PAUSED
+        )
+
+    def is_playing_since(self, since):
+        """ True if the device reported playing after since. """
+        return (
+            self.status is not None
+            and self.status.player_state == MEDIA_PLAYER_STATE_PLAYING
+            and self.status.last_updated is not None
+            and self.status.last_updated >= since
+        )
+
+    def start_time(self):
+        """
+        The time the device started playing, from the position it reported
+        while playing and the position it was paused at.
+        """
+        played = self.status.current_time - self.paused_time
+        return self.status.last_updated - timedelta(seconds=played)
+
+    def close(self):
+        """ Stop following the cast. """
+        self.cast.media_controller.unregister_status_listener(self)
+
+
+def _wait_for_all(watchers, condition, changed, timeout, clock):
+    """
+    Wait until condition is True for all watchers or timeout seconds have
+    passed. Returns the watchers for which condition is True.
+    """
+    deadline = clock.time() + timeout
+    while True:
+        changed.clear()
+        done = [watcher for watcher in watchers if condition(watcher)]
+        remaining = deadline - clock.time()
+        if len(done) == len(watchers) or remaining <= 0:
+            return done
+        clock.wait(changed, remaining)
+
+
+# pylint: disable=too-many-locals
+def play_media_synchronized(
+    casts, url, content_type, timeout=SYNC_TIMEOUT, clock=SYSTEM_CLOCK, **kwargs
+):
+    """
+    Start the same media on several Chromecasts at the same time.
+
+    The media is loaded paused on all casts in parallel. Once all casts report
+    PAUSED, or after timeout seconds, PLAY is sent to the paused casts in one
+    burst. Returns a SyncPlayResult with the start skew estimated from the
+    MediaStatus the casts report once playing.
+
+    The casts must be connected.
+
+    :param casts: The Chromecasts to play on.
+    :param url: The url of the media.
+    :param content_type: The mime type of the media.
+    :param timeout: Seconds to wait for the casts to load the media, and again
+                    for them to start playing.
+    :param clock: The clock of the casts.
+
+    Other keyword arguments are passed to MediaController.play_media.
+    """
+    kwargs["autoplay"] = False
+    changed = threading.Event()
+    watchers = [_SessionWatcher(cast, changed) for cast in casts]
+    try:
+        loading = []
+        for watcher in watchers:
+            try:
+                watcher.cast.media_controller.play_media(url, content_type, **kwargs)
+            except PyChromecastError as err:
+                _LOGGER.warning("Failed to load media on %s: %s", watcher.cast, err)
+                continue
+            loading.append(watcher)
+
+        paused = _wait_for_all(
+            loading, _SessionWatcher.is_paused, changed, timeout, clock
+        )
+        for watcher in paused:
+            watcher.paused_time = watcher.status.current_time
+
+        # The PLAY burst, nothing else is done between the sends
+        play_sent = clock.utcnow()
+        for watcher in paused:
+            try:
+                watcher.cast.media_controller.play()
+            except PyChromecastError as err:
+                _LOGGER.warning("Failed to play on %s: %s", watcher.cast, err)
+
+        playing = _wait_for_all(
+            paused,
+            lambda watcher: watcher.is_playing_since(play_sent),
+            changed,
+            timeout,
+            clock,
+        )
+    finally:
+        for watcher in watchers:
+            watcher.close()
+
+    start_times = {watcher.cast.uuid: watcher.start_time() for watcher in playing}
+    skew = None
+    if start_times:
+        skew = (max(start_times.values()) - min(start_times.values())).total_seconds()
+    return SyncPlayResult(
+        [watcher.cast for watcher in playing],
+        [watcher.cast for watcher in watchers if watcher not in playing],
+        start_times,
+        skew,
+    )
+
+
+class _ConnectionWatcher:  # pylint: disable=too-few-public-methods
+    """ Waits for a cast to connect. """
+
+    def __init__(self):
+        self.connected = threading.Event()
+
+    def new_connection_status(self, status):
+        """ Called when the connection status changes. """
+        if status.status == CONNECTION_STATUS_CONNECTED:
+            self.connected.set()
+
+
+class _FleetCommand:  # pylint: disable=too-few-public-methods
+    """
+    Sends a command to many casts, with at most max_parallel commands waiting
+    for an answer, and collects the answers in a FleetResult.
+
+    :param send: Function called with a cast, a function to call with the
+                 response of the device and a function to call with a
+                 PyChromecastError if the command failed.
+    """
+
+    def __init__(self, send, max_parallel, timeout, clock):
+        self._send = send
+        self._max_parallel = max_parallel
+        self._timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        # dict mapping the casts waiting for an answer on their deadline
+        self._deadlines = {}
+        self.result = FleetResult({}, {}, [])
+
+    def run(self, casts):
+        """ Send the command to casts and wait for the answers. """
+        pending = list(reversed(casts))
+        while True:
+            self._changed.clear()
+            with self._lock:
+                now = self._clock.time()
+                for cast, deadline in list(self._deadlines.items()):
+                    if deadline <= now:
+                        del self._deadlines[cast]
+                        self.result.timed_out.append(cast)
+                count = min(self._max_parallel - len(self._deadlines), len(pending))
+                starting = [pending.pop() for _ in range(count)]
+                for cast in starting:
+                    self._deadlines[cast] = now + self._timeout
+                if not self._deadlines:
+                    return self.result
+                next_deadline = min(self._deadlines.values())
+
+            for cast in starting:
+                self._start(cast)
+            if not starting:
+                self._clock.wait(self._changed, next_deadline - self._clock.time())
+
+    def _start(self, cast):
+        """ Send the command to cast. """
+
+        def done(response=None):
+            """ Called with the response of the device. """
+            self._finish(cast, response=response)
+
+        def failed(error):
+            """ Called if the command failed. """
+            self._finish(cast, error=error)
+
+        try:
+            self._send(cast, done, failed)
+        except PyChromecastError as err:
+            failed(err)
+
+    def _finish(self, cast, response=None, error=None):
+        """ Record the answer of cast, unless it timed out already. """
+        if isinstance(response, dict) and response.get(MESSAGE_TYPE) in ERROR_TYPES:
+            error = RequestFailed(
+                "{} answered {}".format(cast.name, response[MESSAGE_TYPE])
+            )
+        with self._lock:
+            if self._deadlines.pop(cast, None) is None:
+                return
+            if error is None:
+                self.result.succeeded[cast] = response
+            else:
+                self.result.failed[cast] = error
+        self._changed.set()
+
+
+class CastFleet:
+    """
+    A set of Chromecasts controlled together.
+
+    Commands are sent to all targeted casts without waiting for each device
+    to answer, so commanding many devices takes about one round trip. Each
+    command returns a FleetResult once every device answered or timed out.
+    The targets of a command are a list of casts, for example returned by
+    select, None means all casts of the fleet.
+
+    :param casts: The Chromecasts of the fleet, which should be started.
+    :param topology: A GroupTopology of the casts, needed to select casts by
+                     audio group.
+    :param max_parallel: Maximum number of commands waiting for an answer.
+    :param timeout: Seconds each device has to answer a command.
+    :param clock: The clock used for the timeouts.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        casts=None,
+        topology=None,
+        max_parallel=MAX_PARALLEL,
+        timeout=COMMAND_TIMEOUT,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.topology = topology
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        # dict mapping uuid on Chromecast
+        self._casts = {}
+        for cast in casts or ():
+            self.add(cast)
+
+    @property
+    def casts(self):
+        """ Returns a list of the casts of the fleet. """
+        with self._lock:
+            return list(self._casts.values())
+
+    def add(self, cast):
+        """ Add a cast to the fleet, replacing a cast with the same uuid. """
+        with self._lock:
+            self._casts[cast.uuid] = cast
+
+    def remove(self, uuid):
+        """ Remove the cast with uuid from the fleet and return it, if any. """
+        with self._lock:
+            return self._casts.pop(uuid, None)
+
+    def select(self, names=None, uuids=None, models=None, groups=None):
+        """
+        Returns the casts matching any of the selectors, or all casts if no
+        selector is given.
+
+        :param names: Friendly name patterns, as in fnmatch.
+        :param uuids: UUIDs, as UUID or string.
+        :param models: Model name patterns, as in fnmatch.
+        :param groups: Names or uuids of audio groups whose members to select,
+                       the fleet needs a topology.
+        """
+        casts = self.casts
+        if names is None and uuids is None and models is None and groups is None:
+            return casts
+
+        wanted = {str(uuid) for uuid in uuids or ()}
+        if groups:
+            if self.topology is None:
+                raise ValueError("A topology is needed to select audio groups.")
+            for group_uuid, name in self.topology.groups().items():
+                if group_uuid in groups or name in groups:
+                    wanted.update(self.topology.members(group_uuid))
+
+        def match(value, patterns):
+            """ True if value matches one of patterns. """
+            return value is not None and any(
+                fnmatch.fnmatchcase(value, pattern) for pattern in patterns or ()
+            )
+
+        return [
+            cast
+            for cast in casts
+            if str(cast.uuid) in wanted
+            or match(cast.name, names)
+            or match(cast.model_name, models)
+        ]
+
+    def run(self, send, targets=None, timeout=None):
+        """
+        Run a command on targets and return a FleetResult.
+
+        :param send: Function called with a cast, a function to call with the
+                     response of the device and a function to call with a
+                     PyChromecastError if the command failed.
+        :param targets: The casts to command, None for all casts.
+        :param timeout: Seconds each device has to answer, None for the
+                        timeout of the fleet.
+        """
+        if targets is None:
+            targets = self.casts
+        command = _FleetCommand(
+            send,
+            self.max_parallel,
+            self.timeout if timeout is None else timeout,
+            self.clock,
+        )
+        return command.run(list(dict.fromkeys(targets)))
+
+    def set_volume(self, volume, targets=None, timeout=None):
+        """ Set the volume, between 0 and 1, of targets. """
+
+        def send(cast, done, failed):
+            cast.socket_client.receiver_controller.set_volume(
+                volume,
+                callback_function=done,
+                failure_function=lambda: failed(
+                    ChromecastConnectionError("Failed to send the command")
+                ),
+            )
+
+        return self.run(send, targets, timeout)
+
+    def quit_app(self, targets=None, timeout=None):
+        """ Quit the running app of targets. """
+
+        def send(cast, done, failed):
+            sent = cast.socket_client.receiver_controller.stop_app(
+                callback_function_param=done
+            )
+            if sent is False:
+                failed(ChromecastConnectionError("Failed to send the command"))
+
+        return self.run(send, targets, timeout)
+
+    def start_app(self, app_id, force_launch=False, targets=None, timeout=None):
+        """ Start app app_id on targets. """
+
+        def send(cast, done, failed):
+            cast.socket_client.receiver_controller.launch_app(
+                app_id,
+                force_launch,
+                callback_function=done,
+                failure_function=lambda launch_failure: failed(
+                    LaunchError(launch_failure.reason)
+                ),
+            )
+
+        return self.run(send, targets, timeout)
+
+    def play_media(self, url, content_type, targets=None, timeout=None, **kwargs):
+        """
+        Play media on targets, starting the default media receiver if needed.
+        Other keyword arguments are passed to MediaController.play_media.
+        """
+
+        def send(cast, done, failed):  # pylint: disable=unused-argument
+            cast.media_controller.play_media(
+                url, content_type, callback_function=done, **kwargs
+            )
+
+        return self.run(send, targets, timeout)
+
+    def prewarm(
+        self,
+        devices,
+        max_parallel=PREWARM_PARALLEL,
+        timeout=PREWARM_TIMEOUT,
+        zconf=None,
+        **kwargs
+    ):
+        """
+        Create, connect and get the first status of devices in parallel, so the
+        first command to each device doesn't wait for the connection. Returns a
+        Future of a PrewarmResult, completed when every device is ready or
+        failed. Ready casts are added to the fleet.
+
+        Each device goes through three phases, which are timed:
+        dial: creating the Chromecast, with a DIAL request if the device
+              information is incomplete.
+        connect: resolving the mDNS services if needed, then the TCP and TLS
+                 connection.
+        status: waiting for the first receiver status.
+
+        :param devices: Service tuples, as found by discovery or returned by
+                        scan_chromecasts, or Chromecasts which may be started.
+        :param max_parallel: Number of devices prewarmed at the same time.
+        :param timeout: Seconds each device has to become ready. Casts which
+                        fail are disconnected.
+        :param zconf: The zeroconf instance to resolve mDNS services with,
+                      None to use the shared instance.
+
+        Other keyword arguments, such as tries, retry_wait and scheduler, are
+        passed to get_chromecast_from_service.
+        """
+        devices = list(devices)
+        result = PrewarmResult([], {}, {})
+        future = Future()
+        if not devices:
+            future.set_result(result)
+            return future
+
+        remaining = [len(devices)]
+        lock = threading.Lock()
+
+        def finished(device, device_future):
+            """ Record the outcome of a device. """
+            uuid = device[1] if isinstance(device, tuple) else device.uuid
+            try:
+                cast, timings, error = device_future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.exception("Exception thrown when prewarming %s", uuid)
+                cast, timings, error = None, {}, err
+            with lock:
+                result.timings[uuid] = timings
+                if error is None:
+                    result.ready.append(cast)
+                else:
+                    result.failed[uuid] = error
+                remaining[0] -= 1
+                done = not remaining[0]
+            if error is None:
+                self.add(cast)
+            if done:
+                future.set_result(result)
+
+        executor = ThreadPoolExecutor(
+            min(max_parallel, len(devices)), thread_name_prefix="CastFleetPrewarm"
+        )
+        for device in devices:
+            device_future = executor.submit(
+                self._prewarm_device, device, timeout, zconf, kwargs
+            )
+            device_future.add_done_callback(
+                lambda device_future, device=device: finished(device, device_future)
+            )
+        executor.shutdown(wait=False)
+        return future
+
+    def _prewarm_device(self, device, timeout, zconf, kwargs):
+        """
+        Prewarm a service tuple or a Chromecast. Returns a tuple of the cast,
+        the timings of the completed phases and the error, if any.
+        """
+        timings = {}
+        cast = None
+        start = self.clock.time()
+        deadline = start + timeout
+        try:
+            if isinstance(device, tuple):
+                cast = get_chromecast_from_service(
+                    device, zconf, clock=self.clock, **kwargs
+                )
+            else:
+                cast = device
+            now = self.clock.time()
+            timings[PHASE_DIAL] = now - start
+
+            watcher = _ConnectionWatcher()
+            cast.register_connection_listener(watcher)
+            try:
+                if cast.socket_client.is_connected:
+                    watcher.connected.set()
+                if not cast.socket_client.is_alive():
+                    cast.start()
+                if not self.clock.wait(watcher.connected, deadline - now):
+                    raise ChromecastConnectionError("Timed out connecting")
+            finally:
+                cast.unregister_connection_listener(watcher)
+            connected = self.clock.time()
+            timings[PHASE_CONNECT] = connected - now
+
+            if not self.clock.wait(cast.status_event, deadline - connected):
+                raise ChromecastConnectionError("Timed out waiting for the status")
+            timings[PHASE_STATUS] = self.clock.time() - connected
+        except PyChromecastError as err:
+            _LOGGER.debug("Failed to prewarm %s: %s", cast or device, err)
+            if cast is not None:
+                cast.disconnect(timeout=0)
+            return (cast, timings, err)
+        return (cast, timings, None)
+
+    def play_media_synchronized(
+        self, url, content_type, targets=None, timeout=SYNC_TIMEOUT, **kwargs
+    ):
+        """ Start media on targets at the same time, see play_media_synchronized. """
+        if targets is None:
+            targets = self.casts
+        return play_media_synchronized(
+            targets, url, content_type, timeout=timeout, clock=self.clock, **kwargs
+        )
@@ -0,0 +1,204 @@
+"""
+Audio group topology learnt from the member devices.
+
+Each member device answers GET_CASTING_GROUPS with the audio groups it belongs
+to, so the whole group/member graph can be built over the connections to the
+members, without a connection to each group. A group connection is only
+opened when the group is controlled.
+"""
+import logging
+import threading
+
+from .controllers.multizone import MultizoneController
+from .error import PyChromecastError
+from .socket_client import CONNECTION_STATUS_CONNECTED
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _MemberListener:
+    """ Forwards the casting groups of a member device to a GroupTopology. """
+
+    def __init__(self, topology, member_uuid, controller):
+        self._topology = topology
+        self._member_uuid = member_uuid
+        self._controller = controller
+
+    def new_connection_status(self, conn_status):
+        """ Ask for the casting groups each time the member connects. """
+        if conn_status.status == CONNECTION_STATUS_CONNECTED:
+            self._controller.get_casting_groups()
+
+    def multizone_casting_groups(self, groups):
+        """ Called with the casting groups of the member. """
+        self._topology.update_member(self._member_uuid, groups)
+
+    def multizone_member_added(self, uuid):
+        """ Members of the member device itself are not tracked. """
+
+    def multizone_member_removed(self, uuid):
+        """ Members of the member device itself are not tracked. """
+
+    def multizone_status_received(self):
+        """ Members of the member device itself are not tracked. """
+
+
+class GroupTopology:
+    """
+    The audio groups of a set of member devices, and the members of each
+    group, indexed both ways.
+
+    Members are added with add_member, which asks the member for its casting
+    groups over the member's own connection, again on each reconnect and on
+    refresh. Group uuids are strings, as in MultizoneManager.
+
+    Listeners registered with register_listener are called with
+    listener.new_group_topology(group_uuid, members) when the members of a
+    group change, members is an empty set when the group is gone.
+
+    :param group_factory: Function called with a group uuid returning a
+                          Chromecast for the group, used by get_group to open
+                          group connections on demand, for example with
+                          pychromecast.get_chromecast_from_service.
+    """
+
+    def __init__(self, group_factory=None):
+        self._group_factory = group_factory
+        self._lock = threading.RLock()
+        # dict mapping member uuid on MultizoneController
+        self._controllers = {}
+        # dict mapping member uuid on set of group uuids
+        self._groups_by_member = {}
+        # dict mapping group uuid on set of member uuids
+        self._members_by_group = {}
+        # dict mapping group uuid on group name
+        self._group_names = {}
+        # dict mapping group uuid on the Chromecast opened by get_group
+        self._group_casts = {}
+        self._listeners = []
+
+    def register_listener(self, listener):
+        """ Register a listener for topology changes. """
+        self._listeners.append(listener)
+
+    def add_member(self, cast):
+        """
+        Learn the casting groups of cast. A MultizoneController is registered
+        on the connection of cast, cast must not be a group itself.
+        """
+        member_uuid = str(cast.uuid)
+        controller = MultizoneController(member_uuid)
+        listener = _MemberListener(self, member_uuid, controller)
+        controller.register_listener(listener)
+        with self._lock:
+            self._controllers[member_uuid] = controller
+        cast.register_handler(controller)
+        cast.register_connection_listener(listener)
+        if cast.socket_client.is_connected:
+            controller.get_casting_groups()
+
+    def remove_member(self, member_uuid):
+        """ Forget a member device and its group memberships. """
+        member_uuid = str(member_uuid)
+        with self._lock:
+            self._controllers.pop(member_uuid, None)
+        self._set_member_groups(member_uuid, {})
+
+    def refresh(self):
+        """ Ask all connected members for their casting groups again. """
+        with self._lock:
+            controllers = list(self._controllers.values())
+        for controller in controllers:
+            try:
+                controller.get_casting_groups()
+            except PyChromecastError:
+                # Asked again when the member reconnects
+                pass
+
+    def update_member(self, member_uuid, groups):
+        """
+        Called with a dict mapping group uuid on name, the casting groups of
+        member member_uuid.
+        """
+        member_uuid = str(member_uuid)
+        with self._lock:
+            if member_uuid not in self._controllers:
+                return
+        self._set_member_groups(member_uuid, groups)
+
+    def _set_member_groups(self, member_uuid, groups):
+        """ Update the indexes and call listeners for the changed groups. """
+        with self._lock:
+            old_groups = self._groups_by_member.pop(member_uuid, set())
+            new_groups = set(groups)
+            if new_groups:
+                self._groups_by_member[member_uuid] = new_groups
+            self._group_names.update(groups)
+
+            for group_uuid in old_groups - new_groups:
+                members = self._members_by_group[group_uuid]
+                members.discard(member_uuid)
+                if not members:
+                    del self._members_by_group[group_uuid]
+                    self._group_names.pop(group_uuid, None)
+            for group_uuid in new_groups - old_groups:
+                self._members_by_group.setdefault(group_uuid, set()).add(member_uuid)
+
+            changes = [
+                (group_uuid, set(self._members_by_group.get(group_uuid, ())))
+                for group_uuid in old_groups ^ new_groups
+            ]
+            gone = [group_uuid for group_uuid, members in changes if not members]
+
+        for group_uuid in gone:
+            self.release_group(group_uuid)
+        for group_uuid, members in changes:
+            for listener in list(self._listeners):
+                try:
+                    listener.new_group_topology(group_uuid, members)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Exception thrown when calling listener")
+
+    def groups(self):
+        """ Returns a dict mapping uuid on name of all known groups. """
+        with self._lock:
+            return {
+                group_uuid: self._group_names.get(group_uuid)
+                for group_uuid in self._members_by_group
+            }
+
+    def members(self, group_uuid):
+        """ Returns the set of member uuids of group group_uuid. """
+        with self._lock:
+            return set(self._members_by_group.get(str(group_uuid), ()))
+
+    def groups_of(self, member_uuid):
+        """ Returns the set of group uuids member member_uuid belongs to. """
+        with self._lock:
+            return set(self._groups_by_member.get(str(member_uuid), ()))
+
+    def get_group(self, group_uuid):
+        """
+        Returns a Chromecast for group group_uuid, creating it with the
+        group_factory and starting it on first use.
+        """
+        group_uuid = str(group_uuid)
+        with self._lock:
+            cast = self._group_casts.get(group_uuid)
+            if cast is None:
+                if self._group_factory is None:
+                    raise ValueError("A group_factory is needed to open groups.")
+                cast = self._group_factory(group_uuid)
+                self._group_casts[group_uuid] = cast
+                cast.start()
+        return cast
+
+    def release_group(self, group_uuid):
+        """
+        Stop the Chromecast opened by get_group, if any, without waiting for
+        its worker thread.
+        """
+        with self._lock:
+            cast = self._group_casts.pop(str(group_uuid), None)
+        if cast is not None:
+            cast.disconnect(timeout=0)
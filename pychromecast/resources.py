@@ -0,0 +1,155 @@
+"""
+Tracks the threads, sockets and zeroconf instances created by PyChromecast.
+
+Every SocketClient, discovery browser and zeroconf instance registers itself
+with REGISTRY. Socket clients of Chromecast objects which are no longer
+referenced are stopped by a weakref finalizer, which closes their sockets.
+"""
+import logging
+import os
+import threading
+import weakref
+
+from .error import ResourceLimitError
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _count_open_fds():
+    """ Returns the number of file descriptors open in this process, if known. """
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def _release_socket_client(socket_client):
+    """ Stop a socket client whose Chromecast is no longer referenced. """
+    _LOGGER.debug("Releasing unreferenced socket client %x", id(socket_client))
+    if socket_client.is_alive():
+        # Interrupt the worker thread, it cleans up when it exits
+        socket_client.disconnect()
+    else:
+        socket_client.close()
+
+
+class ResourceRegistry:
+    """
+    Registry of the live resources held by PyChromecast.
+
+    :param max_socket_clients: Maximum number of live socket clients, None for
+                               no limit.
+    :param max_browsers: Maximum number of running discovery browsers, None for
+                         no limit.
+    """
+
+    def __init__(self, max_socket_clients=None, max_browsers=None):
+        self.max_socket_clients = max_socket_clients
+        self.max_browsers = max_browsers
+        self._socket_clients = weakref.WeakSet()
+        self._browsers = weakref.WeakSet()
+        self._zeroconfs = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def track_socket_client(self, socket_client):
+        """ Start tracking a socket client, enforcing max_socket_clients. """
+        with self._lock:
+            if (
+                self.max_socket_clients is not None
+                and len(self._socket_clients) >= self.max_socket_clients
+            ):
+                _LOGGER.warning(
+                    "Refusing to create socket client, limit of %s reached",
+                    self.max_socket_clients,
+                )
+                raise ResourceLimitError(
+                    "Limit of {} socket clients reached".format(
+                        self.max_socket_clients
+                    )
+                )
+            self._socket_clients.add(socket_client)
+
+    def untrack_socket_client(self, socket_client):
+        """ Stop tracking a socket client which has released its sockets. """
+        with self._lock:
+            self._socket_clients.discard(socket_client)
+
+    def track_owner(self, owner, socket_client):
+        """
+        Stop socket_client when owner, typically a Chromecast, is garbage
+        collected. The socket client must not hold a strong reference to owner.
+        """
+        weakref.finalize(owner, _release_socket_client, socket_client)
+
+    def check_browser_limit(self):
+        """
+        Raise ResourceLimitError if starting another discovery browser would
+        exceed max_browsers.
+        """
+        with self._lock:
+            self._check_browser_limit()
+
+    def _check_browser_limit(self):
+        """ Check max_browsers, the lock must be held. """
+        running = [item for item in self._browsers if item.is_alive()]
+        if self.max_browsers is not None and len(running) >= self.max_browsers:
+            _LOGGER.warning(
+                "Refusing to start discovery, limit of %s browsers reached",
+                self.max_browsers,
+            )
+            raise ResourceLimitError(
+                "Limit of {} discovery browsers reached".format(self.max_browsers)
+            )
+
+    def track_browser(self, browser):
+        """ Start tracking a discovery browser, enforcing max_browsers. """
+        with self._lock:
+            self._check_browser_limit()
+            self._browsers.add(browser)
+
+    def track_zeroconf(self, zconf):
+        """ Start tracking a zeroconf instance. """
+        with self._lock:
+            self._zeroconfs.add(zconf)
+
+    def stats(self):
+        """
+        Returns a dict with counts of the tracked resources:
+          socket_clients: Socket clients which have not released their sockets.
+          socket_threads: Running socket client worker threads.
+          sockets: Sockets held by socket clients, including their socketpairs.
+          buffered_bytes: Decrypted bytes waiting in the TLS socket buffers.
+          browsers: Running discovery browsers.
+          zeroconfs: Zeroconf instances which have not been closed.
+          threads: Threads running in this process.
+          open_fds: File descriptors open in this process, None if unknown.
+        """
+        with self._lock:
+            socket_clients = list(self._socket_clients)
+            browsers = list(self._browsers)
+            zeroconfs = list(self._zeroconfs)
+
+        sockets = 0
+        buffered_bytes = 0
+        for socket_client in socket_clients:
+            sockets += socket_client.open_socket_count
+            try:
+                buffered_bytes += socket_client.socket.pending()
+            except (AttributeError, OSError, ValueError):
+                pass
+
+        return {
+            "socket_clients": len(socket_clients),
+            "socket_threads": sum(1 for item in socket_clients if item.is_alive()),
+            "sockets": sockets,
+            "buffered_bytes": buffered_bytes,
+            "browsers": sum(1 for item in browsers if item.is_alive()),
+            "zeroconfs": sum(1 for item in zeroconfs if not item.done),
+            "threads": threading.active_count(),
+            "open_fds": _count_open_fds(),
+        }
+
+
+REGISTRY = ResourceRegistry()
@@ -0,0 +1,195 @@
+"""
+Finds Chromecasts by probing a range of IP addresses, for networks which
+block multicast.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import ipaddress
+import logging
+import selectors
+import socket
+import time
+
+from .dial import get_device_status
+
+CAST_PORT = 8009
+# Seconds to wait for each host to accept a connection
+PROBE_TIMEOUT = 0.5
+# Bounds of the number of connection attempts in flight
+MIN_CONCURRENCY = 8
+INITIAL_CONCURRENCY = 64
+MAX_CONCURRENCY = 256
+# Number of candidates confirmed with eureka_info in parallel
+CONFIRM_WORKERS = 16
+
+# Errors which mean the local host is out of sockets or buffers
+_BACKOFF_ERRORS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EAGAIN}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _hosts(targets):
+    """
+    Returns a list of host addresses for a CIDR range such as
+    "192.168.0.0/22", or for an iterable of addresses.
+    """
+    if isinstance(targets, str):
+        network = ipaddress.ip_network(targets, strict=False)
+        if network.num_addresses == 1:
+            return [str(network.network_address)]
+        return [str(host) for host in network.hosts()]
+    return list(targets)
+
+
+class SubnetScanner:
+    """
+    Probes hosts with non-blocking TCP connects to the cast port, then confirms
+    the hosts which accept a connection with eureka_info.
+
+    The number of connects in flight adapts: it grows by one for each
+    completed probe up to max_concurrency, and halves, down to
+    min_concurrency, when the local host runs out of sockets.
+
+    :param port: The port to probe.
+    :param timeout: Seconds to wait for each host to accept a connection.
+    :param max_concurrency: Maximum number of connects in flight.
+    :param min_concurrency: Minimum number of connects in flight.
+    :param confirm_workers: Number of hosts confirmed in parallel.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        port=CAST_PORT,
+        timeout=PROBE_TIMEOUT,
+        max_concurrency=MAX_CONCURRENCY,
+        min_concurrency=MIN_CONCURRENCY,
+        confirm_workers=CONFIRM_WORKERS,
+    ):
+        self.port = port
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.confirm_workers = confirm_workers
+        self.concurrency = min(INITIAL_CONCURRENCY, max_concurrency)
+
+    def scan(self, targets):
+        """
+        Scan a CIDR range or an iterable of addresses. Returns a list of
+        (services, uuid, model_name, friendly_name, host, port) tuples, like
+        CastListener.services, for each Chromecast found. services is empty
+        as the devices were not found through mDNS.
+        """
+        candidates = self.probe(targets)
+        _LOGGER.debug("%d hosts accept connections on %d", len(candidates), self.port)
+        if not candidates:
+            return []
+        with ThreadPoolExecutor(
+            min(self.confirm_workers, len(candidates)),
+            thread_name_prefix="SubnetScanner",
+        ) as executor:
+            statuses = executor.map(get_device_status, candidates)
+            return [
+                (
+                    set(),
+                    status.uuid,
+                    status.model_name,
+                    status.friendly_name,
+                    host,
+                    self.port,
+                )
+                for host, status in zip(candidates, statuses)
+                if status is not None and status.uuid is not None
+            ]
+
+    def probe(self, targets):
+        """
+        Returns the hosts of a CIDR range or an iterable of addresses which
+        accept a TCP connection on port.
+        """
+        hosts = _hosts(targets)
+        hosts.reverse()
+        found = []
+        with selectors.DefaultSelector() as selector:
+            while hosts or selector.get_map():
+                while hosts and len(selector.get_map()) < self.concurrency:
+                    if not self._start_probe(selector, hosts[-1]):
+                        break
+                    hosts.pop()
+                if not selector.get_map():
+                    # Out of sockets with no probe in flight to free one
+                    time.sleep(self.timeout)
+                    continue
+                self._wait_for_probes(selector, found)
+        return found
+
+    def _start_probe(self, selector, host):
+        """
+        Start a non-blocking connect to host. Returns False if the local host
+        is out of resources, after reducing the concurrency.
+        """
+        try:
+            sock = socket.socket(
+                socket.AF_INET6 if ":" in host else socket.AF_INET,
+                socket.SOCK_STREAM,
+            )
+        except OSError as err:
+            if err.errno not in _BACKOFF_ERRORS:
+                raise
+            self._decrease()
+            return False
+
+        sock.setblocking(False)
+        result = sock.connect_ex((host, self.port))
+        if result in _BACKOFF_ERRORS:
+            sock.close()
+            self._decrease()
+            return False
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            # Refused or unreachable right away
+            sock.close()
+            return True
+
+        selector.register(
+            sock, selectors.EVENT_WRITE, (host, time.monotonic() + self.timeout)
+        )
+        return True
+
+    def _wait_for_probes(self, selector, found):
+        """ Handle the probes which completed or timed out. """
+        probes = selector.get_map().values()
+        if not probes:
+            return
+        deadline = min(key.data[1] for key in probes)
+        for key, _ in selector.select(max(deadline - time.monotonic(), 0)):
+            if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                found.append(key.data[0])
+            self._finish_probe(selector, key.fileobj)
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+
+        now = time.monotonic()
+        for key in list(selector.get_map().values()):
+            if key.data[1] <= now:
+                self._finish_probe(selector, key.fileobj)
+
+    @staticmethod
+    def _finish_probe(selector, sock):
+        """ Stop watching sock and close it. """
+        selector.unregister(sock)
+        sock.close()
+
+    def _decrease(self):
+        """ Halve the concurrency after running out of sockets. """
+        self.concurrency = max(self.concurrency // 2, self.min_concurrency)
+        _LOGGER.debug("Out of sockets, reducing concurrency to %d", self.concurrency)
+
+
+def scan_chromecasts(targets, **kwargs):
+    """
+    Scan a CIDR range, for example "192.168.0.0/22", or an iterable of
+    addresses for Chromecasts. Returns a list of service tuples which may be
+    passed to pychromecast.get_chromecast_from_service.
+
+    Keyword arguments are passed to SubnetScanner.
+    """
+    return SubnetScanner(**kwargs).scan(targets)
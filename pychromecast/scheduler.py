@@ -0,0 +1,147 @@
+"""
+Schedules connection attempts and status polling for a fleet of Chromecasts.
+"""
+import random
+import threading
+
+from .clock import SYSTEM_CLOCK
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+
+class TokenBucket:
+    """
+    Token bucket which hands out reservations instead of blocking the caller.
+
+    :param rate: Number of tokens added to the bucket per second.
+    :param burst: Maximum number of tokens the bucket can hold.
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be greater than zero, not {}".format(rate))
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """ Add the tokens accumulated since the last update. """
+        if self._updated is None:
+            self._updated = now
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self, now):
+        """
+        Reserve a token. Returns the number of seconds the caller has to wait
+        before the reserved token may be used.
+        """
+        with self._lock:
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def delay(self, now):
+        """ Returns the number of seconds until a token will be available. """
+        with self._lock:
+            self._refill(now)
+            return max(0, (1 - self._tokens) / self.rate)
+
+    def try_acquire(self, now):
+        """
+        Take a token if one is available. Returns 0 if a token was taken,
+        otherwise the number of seconds until a token will be available.
+        """
+        with self._lock:
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class ConnectionScheduler:
+    """
+    Spreads the connection attempts and status polls of many Chromecasts
+    over time, to avoid all of them hitting the network at once when for
+    example an access point restarts.
+
+    A scheduler is shared by all Chromecast objects of a fleet, pass it to
+    get_chromecasts or get_listed_chromecasts to use it.
+
+    :param max_connects: Maximum number of connection attempts admitted per
+                         second, across all priorities.
+    :param budgets: A dict mapping a priority on the maximum number of
+                    connection attempts admitted per second for that priority.
+    :param priorities: A dict mapping a cast UUID on its priority. Casts which
+                       are not listed get PRIORITY_NORMAL.
+    :param poll_interval: A floating point number specifying how many seconds
+                          to wait between receiver and media status refreshes.
+                          None disables polling.
+    :param jitter: Fraction of poll_interval by which each poll is randomly
+                   moved earlier or later.
+    :param command_rate: Maximum number of volume, mute, seek and subtitle
+                         commands sent per second to each cast. None disables
+                         rate limiting.
+    :param clock: The clock used to admit connection attempts.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        max_connects=10,
+        budgets=None,
+        priorities=None,
+        poll_interval=None,
+        jitter=0.1,
+        command_rate=None,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.max_connects = max_connects
+        self.poll_interval = poll_interval
+        self.jitter = jitter
+        self.command_rate = command_rate
+        self.clock = clock
+        self.priorities = priorities or {}
+        self._bucket = TokenBucket(max_connects)
+        self._budgets = {
+            priority: TokenBucket(rate) for priority, rate in (budgets or {}).items()
+        }
+
+    def priority_for(self, uuid):
+        """ Returns the priority of the cast with UUID uuid. """
+        return self.priorities.get(uuid, PRIORITY_NORMAL)
+
+    def connect_delay(self, priority=PRIORITY_NORMAL):
+        """
+        Admit a connection attempt. Returns the number of seconds the caller
+        has to wait before attempting to connect.
+        """
+        now = self.clock.time()
+        delay = self._bucket.reserve(now)
+        budget = self._budgets.get(priority)
+        if budget is not None:
+            delay = max(delay, budget.reserve(now))
+        if not delay:
+            return 0
+        # Spread the attempts sharing a slot over the slot
+        return delay + random.uniform(0, 1 / self.max_connects)
+
+    def first_poll_delay(self):
+        """
+        Returns the number of seconds until the first status poll after a
+        connection has been established, spread evenly over poll_interval.
+        """
+        return random.uniform(0, self.poll_interval)
+
+    def next_poll_delay(self):
+        """ Returns the number of seconds until the next status poll. """
+        return self.poll_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
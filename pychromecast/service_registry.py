@@ -0,0 +1,256 @@
+"""
+Indexed registry of the cast services found by discovery.
+"""
+from collections.abc import Mapping
+import ipaddress
+import threading
+
+
+class CastService:
+    """
+    A discovered cast device.
+
+    :param services: The set of mDNS service names announcing the device. The
+                     set is updated in place when services come and go, so
+                     SocketClients holding it notice the changes.
+    :param uuid: The UUID of the device.
+    :param model_name: The model name of the device.
+    :param friendly_name: The friendly name of the device.
+    :param host: The host the device was last resolved to.
+    :param port: The port the device was last resolved to.
+    """
+
+    __slots__ = ("services", "uuid", "model_name", "friendly_name", "host", "port")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, services, uuid, model_name, friendly_name, host, port):
+        self.services = services
+        self.uuid = uuid
+        self.model_name = model_name
+        self.friendly_name = friendly_name
+        self.host = host
+        self.port = port
+
+    def as_tuple(self):
+        """
+        Returns the device as a (services, uuid, model_name, friendly_name,
+        host, port) tuple, as used by CastListener.services.
+        """
+        return (
+            self.services,
+            self.uuid,
+            self.model_name,
+            self.friendly_name,
+            self.host,
+            self.port,
+        )
+
+    def __repr__(self):
+        return "CastService({!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
+            *self.as_tuple()
+        )
+
+
+def _index_add(index, key, uuid):
+    """ Add uuid to the set of uuids stored under key. """
+    if key is not None:
+        index.setdefault(key, set()).add(uuid)
+
+
+def _index_discard(index, key, uuid):
+    """ Remove uuid from the set of uuids stored under key. """
+    uuids = index.get(key)
+    if uuids is None:
+        return
+    uuids.discard(uuid)
+    if not uuids:
+        del index[key]
+
+
+class ServiceRegistry:
+    """
+    The cast devices found by discovery, indexed by UUID, mDNS service name,
+    friendly name, model name and host.
+
+    The registry is updated from the zeroconf thread, all methods may be
+    called from any thread.
+    """
+
+    def __init__(self):
+        # dict mapping uuid on CastService
+        self._casts = {}
+        # dict mapping mDNS service name on uuid
+        self._by_service = {}
+        # dicts mapping friendly name, model name and host on sets of uuids
+        self._by_name = {}
+        self._by_model = {}
+        self._by_host = {}
+        # dict mapping host on its parsed IP address, None if not an address
+        self._addresses = {}
+        self._lock = threading.RLock()
+        self.tuples = ServiceTupleView(self)
+
+    def __len__(self):
+        return len(self._casts)
+
+    def __contains__(self, uuid):
+        return uuid in self._casts
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._casts))
+
+    def __getitem__(self, uuid):
+        return self._casts[uuid]
+
+    def get(self, uuid, default=None):
+        """ Returns the CastService with UUID uuid, or default. """
+        return self._casts.get(uuid, default)
+
+    def values(self):
+        """ Returns a list of all CastServices. """
+        with self._lock:
+            return list(self._casts.values())
+
+    # pylint: disable=too-many-arguments
+    def add(self, name, uuid, model_name, friendly_name, host, port):
+        """
+        Add or update the device announced by mDNS service name. Returns the
+        CastService of the device.
+        """
+        with self._lock:
+            old_uuid = self._by_service.get(name)
+            if old_uuid is not None and old_uuid != uuid:
+                # The service now announces another device
+                self.remove(name)
+
+            cast = self._casts.get(uuid)
+            if cast is None:
+                cast = CastService({name}, uuid, None, None, None, None)
+                self._casts[uuid] = cast
+            else:
+                self._unindex(cast)
+
+            cast.services.add(name)
+            cast.model_name = model_name
+            cast.friendly_name = friendly_name
+            cast.host = host
+            cast.port = port
+            self._by_service[name] = uuid
+            self._index(cast)
+        return cast
+
+    # pylint: disable=too-many-arguments
+    def add_device(self, uuid, model_name, friendly_name, host, port):
+        """
+        Add a device found without mDNS, such as through SSDP. The device has
+        no services until mDNS announces it. Returns the CastService of the
+        device, or None if the device is already known.
+        """
+        with self._lock:
+            if uuid in self._casts:
+                return None
+            cast = CastService(set(), uuid, model_name, friendly_name, host, port)
+            self._casts[uuid] = cast
+            self._index(cast)
+        return cast
+
+    def remove(self, name):
+        """
+        Remove mDNS service name. Returns a tuple of the CastService the
+        service belonged to, or None if the service is unknown, and a boolean
+        which is True if the device has no services left and was removed.
+        """
+        with self._lock:
+            uuid = self._by_service.pop(name, None)
+            cast = self._casts.get(uuid)
+            if cast is None:
+                return None, False
+
+            cast.services.discard(name)
+            if cast.services:
+                return cast, False
+
+            self._unindex(cast)
+            del self._casts[uuid]
+            return cast, True
+
+    def by_service(self, name):
+        """ Returns the CastService announced by mDNS service name, or None. """
+        with self._lock:
+            return self._casts.get(self._by_service.get(name))
+
+    def by_name(self, friendly_name):
+        """ Returns a list of the CastServices with friendly name friendly_name. """
+        return self._lookup(self._by_name, friendly_name)
+
+    def by_model(self, model_name):
+        """ Returns a list of the CastServices with model name model_name. """
+        return self._lookup(self._by_model, model_name)
+
+    def by_host(self, host):
+        """ Returns a list of the CastServices resolved to host. """
+        return self._lookup(self._by_host, host)
+
+    def in_subnet(self, subnet):
+        """
+        Returns a list of the CastServices whose host is an IP address in
+        subnet, for example "192.168.1.0/24".
+        """
+        network = ipaddress.ip_network(subnet, strict=False)
+        with self._lock:
+            return [
+                self._casts[uuid]
+                for host, address in self._addresses.items()
+                if address is not None and address in network
+                for uuid in self._by_host[host]
+            ]
+
+    def _lookup(self, index, key):
+        """ Returns the CastServices stored under key in index. """
+        with self._lock:
+            return [self._casts[uuid] for uuid in index.get(key, ())]
+
+    def _index(self, cast):
+        """ Add cast to the secondary indexes. """
+        _index_add(self._by_name, cast.friendly_name, cast.uuid)
+        _index_add(self._by_model, cast.model_name, cast.uuid)
+        _index_add(self._by_host, cast.host, cast.uuid)
+        if cast.host is not None and cast.host not in self._addresses:
+            try:
+                self._addresses[cast.host] = ipaddress.ip_address(cast.host)
+            except ValueError:
+                self._addresses[cast.host] = None
+
+    def _unindex(self, cast):
+        """ Remove cast from the secondary indexes. """
+        _index_discard(self._by_name, cast.friendly_name, cast.uuid)
+        _index_discard(self._by_model, cast.model_name, cast.uuid)
+        _index_discard(self._by_host, cast.host, cast.uuid)
+        if cast.host not in self._by_host:
+            self._addresses.pop(cast.host, None)
+
+
+class ServiceTupleView(Mapping):
+    """
+    Read only mapping of UUID on (services, uuid, model_name, friendly_name,
+    host, port) tuples, backed by a ServiceRegistry.
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getitem__(self, uuid):
+        return self._registry[uuid].as_tuple()
+
+    def __iter__(self):
+        return iter(self._registry)
+
+    def __len__(self):
+        return len(self._registry)
+
+    def __contains__(self, uuid):
+        return uuid in self._registry
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,649 @@
+"""
+Runs the connections of a large fleet of Chromecasts in several processes.
+
+Each worker process owns the Chromecast objects of a shard of the devices,
+so decoding messages and running controllers is spread over several CPUs
+instead of sharing one interpreter lock. The coordinator, in the calling
+process, forwards commands to the workers over pipes, and keeps a CastProxy
+for each device up to date with the status changes the workers stream back.
+"""
+import copy
+import hashlib
+import itertools
+import logging
+import multiprocessing
+from multiprocessing.connection import wait as wait_for_connections
+import threading
+import time
+from concurrent.futures import Future
+
+from . import get_chromecast_from_service
+from .clock import SYSTEM_CLOCK
+from .const import CAST_TYPES, CAST_TYPE_CHROMECAST
+from .controllers.media import MediaStatus
+from .error import ChromecastConnectionError, PyChromecastError, PyChromecastStopped
+from .socket_client import CastStatus, ConnectionStatus
+
+# Number of worker processes
+WORKERS = 4
+# Seconds to wait for the connections of a worker to close when it stops
+STOP_TIMEOUT = 5
+
+# Messages from the coordinator to a worker
+MSG_ADD = "a"  # (MSG_ADD, service)
+MSG_REMOVE = "r"  # (MSG_REMOVE, uuid)
+MSG_CALL = "c"  # (MSG_CALL, request_id, uuid, path, args, kwargs)
+MSG_STOP = "x"  # (MSG_STOP,)
+# Messages from a worker to the coordinator
+MSG_STATUS = "s"  # (MSG_STATUS, uuid, kind, changed fields)
+MSG_RESULT = "d"  # (MSG_RESULT, request_id, error, value)
+
+# Kinds of status streamed by the workers
+STATUS_CAST = "cast"
+STATUS_MEDIA = "media"
+STATUS_CONNECTION = "connection"
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def shard_for(uuid, shards):
+    """
+    Returns the shard, between 0 and shards - 1, owning the device with uuid.
+
+    Rendezvous hashing is used, so when the number of shards changes only the
+    devices of the added or removed shards move.
+    """
+
+    def weight(shard):
+        """ Returns the weight of uuid on shard. """
+        digest = hashlib.sha1("{}:{}".format(shard, uuid).encode()).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    return max(range(shards), key=weight)
+
+
+def _create_cast(service):
+    """ Creates a started Chromecast for a service tuple. """
+    cast = get_chromecast_from_service(service, None)
+    cast.start()
+    return cast
+
+
+def _fields(kind, status):
+    """ Returns the fields of a status as a dict. """
+    if status is None:
+        return {}
+    if kind == STATUS_MEDIA:
+        return {
+            name: value
+            for name, value in vars(status).items()
+            if not name.startswith("_")
+        }
+    return status._asdict()
+
+
+class _StatusForwarder:
+    """ Sends the status changes of a cast to the coordinator. """
+
+    def __init__(self, worker, uuid):
+        self._worker = worker
+        self._uuid = uuid
+
+    def new_cast_status(self, status):
+        """ Called when the receiver status changes. """
+        self._worker.send_status(self._uuid, STATUS_CAST, status)
+
+    def new_media_status(self, status):
+        """ Called when the media status changes. """
+        self._worker.send_status(self._uuid, STATUS_MEDIA, status)
+
+    def new_connection_status(self, status):
+        """ Called when the connection status changes. """
+        self._worker.send_status(self._uuid, STATUS_CONNECTION, status)
+
+
+class _ShardWorker:
+    """
+    Owns the Chromecasts of one shard, runs in a worker process.
+
+    :param conn: The worker end of the pipe to the coordinator.
+    :param cast_factory: Function called with a service tuple returning a
+                         started Chromecast.
+    """
+
+    def __init__(self, conn, cast_factory):
+        self._conn = conn
+        self._cast_factory = cast_factory
+        self._send_lock = threading.Lock()
+        # dict mapping uuid on Chromecast
+        self._casts = {}
+        # dict mapping (uuid, kind) on the fields last sent
+        self._sent = {}
+
+    def run(self):
+        """ Handle messages from the coordinator until told to stop. """
+        handlers = {
+            MSG_ADD: self._add,
+            MSG_REMOVE: self._remove,
+            MSG_CALL: self._call,
+        }
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == MSG_STOP:
+                break
+            try:
+                handlers[message[0]](*message[1:])
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Exception thrown when handling %s", message[0])
+        self._stop()
+
+    def _send(self, message):
+        """ Send a message to the coordinator. """
+        with self._send_lock:
+            self._conn.send(message)
+
+    def send_status(self, uuid, kind, status):
+        """ Send the fields of status which changed since last sent. """
+        fields = _fields(kind, status)
+        with self._send_lock:
+            previous = self._sent.get((uuid, kind), {})
+            changed = {
+                name: value
+                for name, value in fields.items()
+                if name not in previous or previous[name] != value
+            }
+            if not changed and previous:
+                return
+            self._sent[(uuid, kind)] = copy.deepcopy(fields)
+            self._conn.send((MSG_STATUS, uuid, kind, changed))
+
+    def _add(self, service):
+        """ Start a connection to a device. """
+        uuid = service[1]
+        if uuid in self._casts:
+            return
+        cast = self._cast_factory(service)
+        self._casts[uuid] = cast
+        forwarder = _StatusForwarder(self, uuid)
+        cast.register_status_listener(forwarder)
+        cast.register_connection_listener(forwarder)
+        cast.media_controller.register_status_listener(forwarder)
+        if cast.status is not None:
+            forwarder.new_cast_status(cast.status)
+
+    def _remove(self, uuid):
+        """ Stop the connection to a device. """
+        cast = self._casts.pop(uuid, None)
+        with self._send_lock:
+            for kind in (STATUS_CAST, STATUS_MEDIA, STATUS_CONNECTION):
+                self._sent.pop((uuid, kind), None)
+        if cast is not None:
+            cast.disconnect(timeout=0)
+
+    def _call(self, request_id, uuid, path, args, kwargs):
+        """ Call a method of a cast, such as media_controller.play. """
+        error = None
+        value = None
+        try:
+            target = self._casts.get(uuid)
+            if target is None:
+                raise PyChromecastError("{} is not in this shard".format(uuid))
+            for name in path.split("."):
+                target = getattr(target, name)
+            value = target(*args, **kwargs)
+        except Exception as err:  # pylint: disable=broad-except
+            error = err
+        try:
+            self._send((MSG_RESULT, request_id, error, value))
+        except Exception:  # pylint: disable=broad-except
+            # The error or the value could not be pickled
+            if error is not None:
+                error = PyChromecastError(repr(error))
+            self._send((MSG_RESULT, request_id, error, None))
+
+    def _stop(self):
+        """ Close all connections. """
+        for cast in self._casts.values():
+            cast.disconnect(timeout=0)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for cast in self._casts.values():
+            cast.join(timeout=max(deadline - time.monotonic(), 0))
+
+
+def _run_worker(conn, cast_factory):
+    """ Entry point of a worker process. """
+    _ShardWorker(conn, cast_factory or _create_cast).run()
+
+
+class _MediaControllerProxy:
+    """ MediaController-like view of the media status of a CastProxy. """
+
+    def __init__(self, cast, clock):
+        self._cast = cast
+        self.status = MediaStatus(clock)
+        self._status_listeners = []
+
+    def register_status_listener(self, listener):
+        """ Register a listener called with listener.new_media_status(status). """
+        self._status_listeners.append(listener)
+
+    def _call(self, name, *args, **kwargs):
+        """ Call a method of the MediaController in the worker. """
+        return self._cast.call("media_controller." + name, *args, **kwargs)
+
+    def update_status(self):
+        """ Ask for the media status. """
+        return self._call("update_status")
+
+    def play(self):
+        """ Send the PLAY command. """
+        return self._call("play")
+
+    def pause(self):
+        """ Send the PAUSE command. """
+        return self._call("pause")
+
+    def stop(self):
+        """ Send the STOP command. """
+        return self._call("stop")
+
+    def seek(self, position):
+        """ Seek the media to position. """
+        return self._call("seek", position)
+
+    def play_media(self, url, content_type, **kwargs):
+        """ Play media, see MediaController.play_media. """
+        return self._call("play_media", url, content_type, **kwargs)
+
+    def apply(self, changed):
+        """ Apply status changes and call the listeners. """
+        for name, value in changed.items():
+            setattr(self.status, name, value)
+        _call_listeners(self._status_listeners, "new_media_status", self.status)
+
+
+class CastProxy:
+    """
+    Chromecast-like view of a device owned by a worker of a ShardedFleet.
+
+    The status, connection status and media status are kept up to date by
+    the coordinator, and listeners are called on its reader thread. Commands
+    are forwarded to the worker and return a concurrent.futures.Future of the
+    value the method returned in the worker.
+    """
+
+    def __init__(self, fleet, service, clock):
+        _, self.uuid, self.model_name, self.name, self.host, self.port = service
+        self.service = service
+        self.cast_type = CAST_TYPES.get(self.model_name.lower(), CAST_TYPE_CHROMECAST)
+        self.clock = clock
+        self.status = None
+        self.connection_status = None
+        self.status_event = threading.Event()
+        self.media_controller = _MediaControllerProxy(self, clock)
+        self._fleet = fleet
+        self._status_listeners = []
+        self._connection_listeners = []
+
+    def register_status_listener(self, listener):
+        """ Register a listener called with listener.new_cast_status(status). """
+        self._status_listeners.append(listener)
+
+    def register_connection_listener(self, listener):
+        """
+        Register a listener called with listener.new_connection_status(status).
+        """
+        self._connection_listeners.append(listener)
+
+    def call(self, path, *args, **kwargs):
+        """
+        Call a method of the Chromecast in the worker, path is the name of the
+        method, optionally prefixed by attribute names such as
+        "media_controller.play". Returns a Future.
+        """
+        return self._fleet.call(self.uuid, path, args, kwargs)
+
+    def set_volume(self, volume):
+        """ Set the volume, between 0 and 1. """
+        return self.call("set_volume", volume)
+
+    def set_volume_muted(self, muted):
+        """ Mute or unmute. """
+        return self.call("set_volume_muted", muted)
+
+    def volume_up(self, delta=0.1):
+        """ Increment the volume by delta. """
+        return self.call("volume_up", delta)
+
+    def volume_down(self, delta=0.1):
+        """ Decrement the volume by delta. """
+        return self.call("volume_down", delta)
+
+    def start_app(self, app_id, force_launch=False):
+        """ Start an app. """
+        return self.call("start_app", app_id, force_launch)
+
+    def quit_app(self):
+        """ Quit the running app. """
+        return self.call("quit_app")
+
+    def play_media(self, url, content_type, **kwargs):
+        """ Play media, see MediaController.play_media. """
+        return self.media_controller.play_media(url, content_type, **kwargs)
+
+    def wait(self, timeout=None):
+        """ Wait until a status has been received. """
+        return self.clock.wait(self.status_event, timeout)
+
+    def apply(self, kind, changed):
+        """ Apply the status changes sent by the worker. """
+        if kind == STATUS_MEDIA:
+            self.media_controller.apply(changed)
+        elif kind == STATUS_CONNECTION:
+            self.connection_status = _replace(
+                ConnectionStatus, self.connection_status, changed
+            )
+            _call_listeners(
+                self._connection_listeners,
+                "new_connection_status",
+                self.connection_status,
+            )
+        else:
+            self.status = _replace(CastStatus, self.status, changed)
+            self.status_event.set()
+            _call_listeners(self._status_listeners, "new_cast_status", self.status)
+
+    def __repr__(self):
+        return "CastProxy({!r}, uuid={!r})".format(self.name, self.uuid)
+
+
+def _replace(status_type, status, changed):
+    """
+    Returns status, a status_type namedtuple, updated with the changed fields.
+    The first message of a status from a worker has all fields.
+    """
+    if status is None:
+        return status_type(**changed)
+    return status._replace(**changed)
+
+
+def _call_listeners(listeners, method, status):
+    """ Call method of each listener with status. """
+    for listener in list(listeners):
+        try:
+            getattr(listener, method)(status)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Exception thrown when calling %s", method)
+
+
+class _WorkerHandle:
+    """ A worker process and the coordinator end of its pipe. """
+
+    def __init__(self, context, cast_factory, index):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_run_worker,
+            args=(child_conn, cast_factory),
+            name="ShardWorker-{}".format(index),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        """ Send a message to the worker, returns False if it is gone. """
+        try:
+            with self._lock:
+                self.conn.send(message)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """ Stop the worker process. """
+        self.send((MSG_STOP,))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardedFleet:
+    """
+    Spreads the connections to many Chromecasts over worker processes.
+
+    Devices are assigned to workers by a rendezvous hash of their UUID. When
+    devices are added or removed only their own worker is involved, and when
+    the number of workers changes with resize only the devices whose worker
+    changed are moved. A worker which dies is restarted with its devices.
+
+    :param workers: The number of worker processes.
+    :param cast_factory: Function called in the workers with a service tuple,
+                         returning a started Chromecast. It must be picklable,
+                         None means to use get_chromecast_from_service.
+    :param start_method: The multiprocessing start method, spawn avoids
+                         forking the threads of the calling process.
+    :param clock: The clock of the CastProxy objects.
+    """
+
+    def __init__(
+        self,
+        workers=WORKERS,
+        cast_factory=None,
+        start_method="spawn",
+        clock=SYSTEM_CLOCK,
+    ):
+        self.cast_factory = cast_factory
+        self.clock = clock
+        self._context = multiprocessing.get_context(start_method)
+        self._worker_count = workers
+        self._lock = threading.RLock()
+        self._workers = []
+        # dict mapping uuid on CastProxy
+        self._proxies = {}
+        # dict mapping uuid on the index of its worker
+        self._owners = {}
+        # dict mapping request id on (Future, worker index)
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+        self._stopped = threading.Event()
+        self._reader = None
+
+    @property
+    def casts(self):
+        """ Returns a list of the CastProxy objects of all devices. """
+        with self._lock:
+            return list(self._proxies.values())
+
+    def get(self, uuid):
+        """ Returns the CastProxy of the device with uuid, or None. """
+        with self._lock:
+            return self._proxies.get(uuid)
+
+    def shard_sizes(self):
+        """ Returns a list of the number of devices of each worker. """
+        with self._lock:
+            sizes = [0] * len(self._workers)
+            for index in self._owners.values():
+                sizes[index] += 1
+            return sizes
+
+    def start(self):
+        """ Start the worker processes. """
+        with self._lock:
+            self._stopped.clear()
+            self._workers = [
+                self._start_worker(index) for index in range(self._worker_count)
+            ]
+        self._reader = threading.Thread(
+            target=self._read, name="ShardedFleet", daemon=True
+        )
+        self._reader.start()
+
+    def stop(self):
+        """ Stop the worker processes and their connections. """
+        self._stopped.set()
+        self._wake()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._fail_requests(None)
+        for worker in workers:
+            worker.stop()
+
+    def add_device(self, service):
+        """
+        Connect to a device from a service tuple, as found by discovery or
+        returned by scan_chromecasts. Returns its CastProxy.
+        """
+        uuid = service[1]
+        with self._lock:
+            if not self._workers:
+                raise PyChromecastStopped("The ShardedFleet is not started.")
+            proxy = self._proxies.get(uuid)
+            if proxy is not None:
+                return proxy
+            proxy = CastProxy(self, service, self.clock)
+            self._proxies[uuid] = proxy
+            index = shard_for(uuid, len(self._workers))
+            self._owners[uuid] = index
+            self._workers[index].send((MSG_ADD, service))
+        return proxy
+
+    def remove_device(self, uuid):
+        """ Disconnect from a device. Returns its CastProxy, or None. """
+        with self._lock:
+            proxy = self._proxies.pop(uuid, None)
+            index = self._owners.pop(uuid, None)
+            if index is not None:
+                self._workers[index].send((MSG_REMOVE, uuid))
+        return proxy
+
+    def resize(self, workers):
+        """
+        Change the number of worker processes, moving the devices whose
+        worker changed. Returns the number of devices moved.
+        """
+        if workers < 1:
+            raise ValueError("At least one worker is needed, not {}".format(workers))
+        with self._lock:
+            self._worker_count = workers
+            while len(self._workers) < workers:
+                self._workers.append(self._start_worker(len(self._workers)))
+            moves = []
+            for uuid, old in self._owners.items():
+                new = shard_for(uuid, workers)
+                if new != old:
+                    moves.append((uuid, old, new))
+            for uuid, old, new in moves:
+                self._owners[uuid] = new
+                self._workers[old].send((MSG_REMOVE, uuid))
+                self._workers[new].send((MSG_ADD, self._proxies[uuid].service))
+            removed = self._workers[workers:]
+            del self._workers[workers:]
+            for index in range(workers, workers + len(removed)):
+                self._fail_requests(index)
+        self._wake()
+        for worker in removed:
+            worker.stop()
+        _LOGGER.debug("Resized to %d workers, moved %d devices", workers, len(moves))
+        return len(moves)
+
+    def call(self, uuid, path, args=(), kwargs=None):
+        """
+        Call a method of the Chromecast with uuid in its worker. Returns a
+        Future of the value returned by the method.
+        """
+        future = Future()
+        with self._lock:
+            index = self._owners.get(uuid)
+            if index is None:
+                future.set_exception(
+                    PyChromecastError("Unknown device {}".format(uuid))
+                )
+                return future
+            request_id = next(self._request_ids)
+            self._requests[request_id] = (future, index)
+            message = (MSG_CALL, request_id, uuid, path, tuple(args), kwargs or {})
+            sent = self._workers[index].send(message)
+        if not sent:
+            error = ChromecastConnectionError("The worker is gone")
+            self._resolve(request_id, error, None)
+        return future
+
+    def _start_worker(self, index):
+        """ Start worker process index. """
+        return _WorkerHandle(self._context, self.cast_factory, index)
+
+    def _wake(self):
+        """ Wake the reader thread to pick up changed workers. """
+        self._wake_writer.send_bytes(b"")
+
+    def _read(self):
+        """ Handle the messages of the workers until stopped. """
+        while not self._stopped.is_set():
+            with self._lock:
+                connections = {
+                    worker.conn: index for index, worker in enumerate(self._workers)
+                }
+            for conn in wait_for_connections(list(connections) + [self._wake_reader]):
+                if conn is self._wake_reader:
+                    conn.recv_bytes()
+                    continue
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    if not self._stopped.is_set():
+                        self._restart(connections[conn], conn)
+                    continue
+                self._handle(message)
+
+    def _handle(self, message):
+        """ Handle a message from a worker. """
+        if message[0] == MSG_STATUS:
+            _, uuid, kind, changed = message
+            proxy = self.get(uuid)
+            if proxy is not None:
+                proxy.apply(kind, changed)
+        elif message[0] == MSG_RESULT:
+            _, request_id, error, value = message
+            self._resolve(request_id, error, value)
+
+    def _resolve(self, request_id, error, value):
+        """ Complete the Future of a request. """
+        with self._lock:
+            request = self._requests.pop(request_id, None)
+        if request is None:
+            return
+        if error is not None:
+            request[0].set_exception(error)
+        else:
+            request[0].set_result(value)
+
+    def _fail_requests(self, index):
+        """ Fail the requests waiting for worker index, or all if None. """
+        for request_id, (future, owner) in list(self._requests.items()):
+            if index is None or owner == index:
+                del self._requests[request_id]
+                future.set_exception(ChromecastConnectionError("Worker stopped"))
+
+    def _restart(self, index, conn):
+        """ Restart a worker which died, with its devices. """
+        with self._lock:
+            if index >= len(self._workers) or self._workers[index].conn is not conn:
+                # Stopped by resize
+                return
+            _LOGGER.warning("Worker %d died, restarting it", index)
+            self._fail_requests(index)
+            self._workers[index].conn.close()
+            self._workers[index] = self._start_worker(index)
+            for uuid, owner in self._owners.items():
+                if owner == index:
+                    self._workers[index].send((MSG_ADD, self._proxies[uuid].service))
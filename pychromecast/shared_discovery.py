@@ -0,0 +1,457 @@
+"""
+Shares the devices found by one discovery process with other processes on the
+same host, through a Unix socket.
+
+One process runs a DiscoveryPublisher, which owns the zeroconf browser. Other
+processes run a DiscoverySubscriber, which mirrors the registry of the
+publisher without joining multicast.
+
+The protocol is newline delimited JSON. A subscriber first receives a
+snapshot of all devices, then a delta for each change. Each message carries
+the version of the registry after it was applied; versions of deltas are
+consecutive, a subscriber which misses one reconnects to get a new snapshot.
+"""
+from collections import deque
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+from uuid import UUID
+
+from .clock import SYSTEM_CLOCK
+from .discovery import RESOLVE_WORKERS, CastListener, start_discovery, stop_discovery
+
+MSG_SNAPSHOT = "snapshot"
+MSG_ADD = "add"
+MSG_UPDATE = "update"
+MSG_REMOVE = "remove"
+
+# Seconds a subscriber waits before reconnecting to the publisher
+RETRY_WAIT = 1
+# Seconds the publisher waits for a subscriber to accept a message
+SEND_TIMEOUT = 5
+# Messages waiting for a subscriber after which it is dropped as stalled
+MAX_QUEUED_MESSAGES = 1000
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def bind_unix_socket(path, mode=None):
+    """
+    Returns a listening Unix socket bound to path.
+
+    A socket file left behind by a process which didn't stop cleanly is
+    replaced. If another process still listens on path, OSError is raised
+    with errno EADDRINUSE.
+
+    :param mode: The permissions of the socket file, such as 0o600. The file
+                 is created with these permissions, there is no moment it is
+                 accessible to others. None to use the umask of the process.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except FileNotFoundError:
+        pass
+    except ConnectionRefusedError:
+        # Left behind by a process which didn't stop cleanly
+        os.unlink(path)
+    else:
+        raise OSError(
+            errno.EADDRINUSE, "Another process is listening on {}".format(path)
+        )
+    finally:
+        probe.close()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = None if mode is None else os.umask(0o777 & ~mode)
+    try:
+        server.bind(path)
+        server.listen()
+    except OSError:
+        server.close()
+        raise
+    finally:
+        if umask is not None:
+            os.umask(umask)
+    return server
+
+
+def _encode_service(service):
+    """ Returns a CastListener.services tuple as a JSON compatible dict. """
+    services, uuid, model_name, friendly_name, host, port = service
+    return {
+        "services": sorted(services),
+        "uuid": str(uuid),
+        "model_name": model_name,
+        "friendly_name": friendly_name,
+        "host": host,
+        "port": port,
+    }
+
+
+def _decode_service(data):
+    """ Returns a CastListener.services tuple from a decoded dict. """
+    return (
+        set(data["services"]),
+        UUID(data["uuid"]),
+        data["model_name"],
+        data["friendly_name"],
+        data["host"],
+        data["port"],
+    )
+
+
+def _encode_message(message):
+    """ Returns message as a line of JSON. """
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+class _Subscription:
+    """
+    Sends the messages of a DiscoveryPublisher to one subscriber from its own
+    thread, so a slow subscriber doesn't hold up discovery or the others.
+
+    :param client: The socket of the subscriber.
+    :param on_close: Called with the subscription once it is closed.
+    """
+
+    def __init__(self, client, on_close):
+        self._client = client
+        self._on_close = on_close
+        self._messages = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def start(self):
+        """ Start the thread sending to the subscriber. """
+        threading.Thread(
+            target=self._run, name="DiscoveryPublisherClient", daemon=True
+        ).start()
+
+    def send(self, data):
+        """
+        Queue data for the subscriber. Returns False if the subscriber is
+        closed or doesn't keep up with the messages.
+        """
+        with self._condition:
+            if self._closed or len(self._messages) >= MAX_QUEUED_MESSAGES:
+                return False
+            self._messages.append(data)
+            self._condition.notify()
+        return True
+
+    def close(self):
+        """ Stop sending and disconnect the subscriber. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        try:
+            # Interrupts a send which is in progress
+            self._client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        """ Send the queued messages until closed. """
+        while True:
+            with self._condition:
+                while not self._messages and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    break
+                data = b"".join(self._messages)
+                self._messages.clear()
+            try:
+                self._client.sendall(data)
+            except OSError:
+                _LOGGER.debug("Dropping discovery subscriber")
+                break
+        self._client.close()
+        self._on_close(self)
+
+
+class DiscoveryPublisher:
+    """
+    Runs discovery and publishes the discovered devices on a Unix socket.
+
+    :param path: The path of the Unix socket.
+    :param zeroconf_instance: The zeroconf instance to browse with. None means
+                              to use the shared instance.
+    :param resolve_workers: Number of threads resolving discovered services.
+    """
+
+    def __init__(self, path, zeroconf_instance=None, resolve_workers=RESOLVE_WORKERS):
+        self.path = path
+        self.version = 0
+        self.listener = CastListener(
+            self._on_add,
+            self._on_remove,
+            self._on_update,
+            resolve_workers=resolve_workers,
+        )
+        self.browser = None
+        self._zconf = zeroconf_instance
+        self._server = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def subscriber_count(self):
+        """ Number of connected subscribers. """
+        return len(self._clients)
+
+    def start(self):
+        """
+        Listen on the Unix socket and start discovery. Raises OSError with
+        errno EADDRINUSE if another publisher is running on the socket, use
+        a DiscoverySubscriber instead.
+        """
+        self._server = bind_unix_socket(self.path)
+        self._thread = threading.Thread(
+            target=self._accept_loop, name="DiscoveryPublisher", daemon=True
+        )
+        self._thread.start()
+        self.browser = start_discovery(self.listener, self._zconf)
+
+    def stop(self):
+        """ Stop discovery and disconnect all subscribers. """
+        if self.browser is not None:
+            stop_discovery(self.browser)
+            self.browser = None
+        if self.listener.resolver is not None:
+            self.listener.resolver.shutdown()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            clients = self._clients
+            self._clients = []
+        for client in clients:
+            client.close()
+
+    def _accept_loop(self):
+        """ Accept subscribers and send them a snapshot. """
+        server = self._server
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                # The server socket was closed
+                return
+            client.settimeout(SEND_TIMEOUT)
+            subscription = _Subscription(client, self._remove_subscription)
+            with self._lock:
+                snapshot = {
+                    "type": MSG_SNAPSHOT,
+                    "version": self.version,
+                    "devices": [
+                        _encode_service(service)
+                        for service in self.listener.services.values()
+                    ],
+                }
+                # Queued under the lock so no delta comes before the snapshot
+                subscription.send(_encode_message(snapshot))
+                self._clients.append(subscription)
+            subscription.start()
+
+    def _remove_subscription(self, subscription):
+        """ Called when a subscription is closed. """
+        with self._lock:
+            if subscription in self._clients:
+                self._clients.remove(subscription)
+
+    def _publish(self, msg_type, uuid, name, service=None):
+        """ Queue a delta for all subscribers. """
+        with self._lock:
+            self.version += 1
+            message = {
+                "type": msg_type,
+                "version": self.version,
+                "uuid": str(uuid),
+                "name": name,
+            }
+            if service is not None:
+                message["device"] = _encode_service(service)
+            data = _encode_message(message)
+
+            stalled = [client for client in self._clients if not client.send(data)]
+            for client in stalled:
+                self._clients.remove(client)
+        for client in stalled:
+            _LOGGER.debug("Dropping stalled discovery subscriber")
+            client.close()
+
+    def _on_add(self, uuid, name):
+        """ Called when discovery has found a new device. """
+        service = self.listener.services.get(uuid)
+        if service is not None:
+            self._publish(MSG_ADD, uuid, name, service)
+
+    def _on_update(self, uuid, name):
+        """ Called when a device has changed. """
+        service = self.listener.services.get(uuid)
+        if service is not None:
+            self._publish(MSG_UPDATE, uuid, name, service)
+
+    def _on_remove(self, uuid, name, service):  # pylint: disable=unused-argument
+        """ Called when a device is gone. """
+        self._publish(MSG_REMOVE, uuid, name)
+
+
+class DiscoverySubscriber:
+    """
+    Mirrors the devices of a DiscoveryPublisher running in another process.
+
+    services and the callbacks have the same form as those of CastListener.
+    Callbacks are called from the thread of the subscriber.
+
+    :param path: The path of the Unix socket of the publisher.
+    :param add_callback: Called with (uuid, name) when a device is found.
+    :param remove_callback: Called with (uuid, name, service) when a device is
+                            gone.
+    :param update_callback: Called with (uuid, name) when a device changes.
+    :param retry_wait: Seconds to wait before reconnecting to the publisher.
+    :param clock: The clock used to wait.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        path,
+        add_callback=None,
+        remove_callback=None,
+        update_callback=None,
+        retry_wait=RETRY_WAIT,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.path = path
+        self.add_callback = add_callback
+        self.remove_callback = remove_callback
+        self.update_callback = update_callback
+        self.retry_wait = retry_wait
+        self.clock = clock
+        self.version = None
+        # dict mapping uuid on (services, uuid, model_name, friendly_name,
+        # host, port) tuples
+        self.services = {}
+        self.synced = threading.Event()
+        self._stop = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    @property
+    def count(self):
+        """ Number of discovered cast services. """
+        return len(self.services)
+
+    @property
+    def devices(self):
+        """ List of tuples (ip, host) for each discovered device. """
+        return list(self.services.values())
+
+    def start(self):
+        """ Start mirroring the publisher. """
+        self._thread = threading.Thread(
+            target=self._run, name="DiscoverySubscriber", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """ Stop mirroring the publisher. """
+        self._stop.set()
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait_for_snapshot(self, timeout=None):
+        """
+        Block until the first snapshot is received. Returns False on timeout.
+        """
+        return self.clock.wait(self.synced, timeout)
+
+    def _run(self):
+        """ Read from the publisher, reconnecting when the connection is lost. """
+        while not self._stop.is_set():
+            try:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self.path)
+                with self._socket.makefile("r", encoding="utf-8") as lines:
+                    for line in lines:
+                        if not self._handle_message(json.loads(line)):
+                            break
+            except (OSError, ValueError) as err:
+                _LOGGER.debug("Discovery publisher connection failed: %s", err)
+            finally:
+                self._socket.close()
+                self._socket = None
+            self.clock.wait(self._stop, self.retry_wait)
+
+    def _handle_message(self, message):
+        """
+        Apply a message from the publisher. Returns False if a delta was
+        missed and a new snapshot is needed.
+        """
+        if message["type"] == MSG_SNAPSHOT:
+            self._apply_snapshot(
+                message["version"],
+                {
+                    service[1]: service
+                    for service in map(_decode_service, message["devices"])
+                },
+            )
+            return True
+
+        if self.version is None or message["version"] <= self.version:
+            return True
+        if message["version"] != self.version + 1:
+            _LOGGER.debug("Missed discovery delta, resyncing")
+            return False
+        self.version = message["version"]
+
+        uuid = UUID(message["uuid"])
+        name = message["name"]
+        if message["type"] == MSG_REMOVE:
+            service = self.services.pop(uuid, None)
+            if service is not None and self.remove_callback:
+                self.remove_callback(uuid, name, service)
+            return True
+
+        known = uuid in self.services
+        self.services[uuid] = _decode_service(message["device"])
+        callback = self.update_callback if known else self.add_callback
+        if callback:
+            callback(uuid, name)
+        return True
+
+    def _apply_snapshot(self, version, services):
+        """ Replace the mirrored devices, calling callbacks for differences. """
+        old_services = self.services
+        self.services = services
+        self.version = version
+        self.synced.set()
+
+        for uuid, service in old_services.items():
+            if uuid not in services and self.remove_callback:
+                self.remove_callback(uuid, next(iter(service[0]), None), service)
+        for uuid, service in services.items():
+            old_service = old_services.get(uuid)
+            if old_service == service:
+                continue
+            callback = (
+                self.add_callback if old_service is None else self.update_callback
+            )
+            if callback:
+                callback(uuid, next(iter(service[0]), None))
@@ -0,0 +1,349 @@
+"""
+Simulated Chromecasts, to run SocketClient and Chromecast without devices or
+a network, for example together with a SimulatedClock to run a fleet through
+hours of heartbeats and reconnects in seconds.
+
+A SimulatedNetwork serves any number of SimulatedDevices from a single
+thread. Chromecasts created with the socket_factory of the network connect to
+the simulated devices through socket pairs instead of TLS over TCP.
+
+Example:
+  clock = SimulatedClock()
+  network = SimulatedNetwork()
+  network.start()
+  device = network.add_device(SimulatedDevice("10.0.0.1"))
+  cast = Chromecast(
+      device.host,
+      device.port,
+      device=device.device_status(),
+      clock=clock,
+      socket_factory=network.socket_factory,
+  )
+  cast.start()
+  network.settle(clock, waiters=1)
+  clock.advance(60)
+"""
+import errno
+import json
+import logging
+import selectors
+import socket
+import threading
+import time
+from struct import pack, unpack
+from uuid import uuid4
+
+from . import cast_channel_pb2
+from .const import CAST_TYPE_CHROMECAST
+from .dial import DeviceStatus
+from .socket_client import (
+    NS_HEARTBEAT,
+    NS_RECEIVER,
+    PLATFORM_DESTINATION_ID,
+    REQUEST_ID,
+    TYPE_GET_STATUS,
+    TYPE_PING,
+    TYPE_PONG,
+    TYPE_RECEIVER_STATUS,
+)
+
+# Seconds of real time the network and the clients must stay idle to settle
+SETTLE_QUIET = 0.005
+# Seconds of real time to wait for the network and the clients to settle
+SETTLE_TIMEOUT = 10
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SimulatedDevice:
+    """
+    A Chromecast which answers the platform messages of a SocketClient:
+    PING with PONG, GET_STATUS with its receiver status and SET_VOLUME by
+    changing its volume.
+
+    :param host: The address the device is reached at.
+    :param port: The port the device is reached at.
+    :param friendly_name: The name of the device.
+    :param model_name: The model of the device.
+    :param uuid: The UUID of the device, None for a random one.
+    :param cast_type: The type of the device, see const.CAST_TYPE_*.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        host,
+        port=8009,
+        friendly_name=None,
+        model_name="Chromecast",
+        uuid=None,
+        cast_type=CAST_TYPE_CHROMECAST,
+    ):
+        self.host = host
+        self.port = port
+        self.friendly_name = friendly_name or "Simulated {}".format(host)
+        self.model_name = model_name
+        self.uuid = uuid or uuid4()
+        self.cast_type = cast_type
+        self.volume_level = 1.0
+        self.volume_muted = False
+        # If False, connections are refused
+        self.reachable = True
+        # If False, pings and requests are not answered
+        self.responsive = True
+        # Number of connections accepted, pings and requests received
+        self.connections = 0
+        self.pings = 0
+        self.requests = 0
+
+    def device_status(self):
+        """ Returns the DeviceStatus to create a Chromecast for the device. """
+        return DeviceStatus(
+            self.friendly_name,
+            self.model_name,
+            "Simulated",
+            self.uuid,
+            self.cast_type,
+        )
+
+    def receiver_status(self):
+        """ Returns the receiver status of the device. """
+        return {
+            "volume": {"level": self.volume_level, "muted": self.volume_muted},
+            "applications": [],
+        }
+
+    def handle(self, namespace, data):
+        """
+        Handle a message from a client. Returns a list of (namespace, data)
+        tuples to answer with.
+        """
+        if namespace == NS_HEARTBEAT and data.get("type") == TYPE_PING:
+            self.pings += 1
+            if self.responsive:
+                return [(NS_HEARTBEAT, {"type": TYPE_PONG})]
+            return []
+
+        if namespace != NS_RECEIVER or REQUEST_ID not in data:
+            return []
+        self.requests += 1
+        if not self.responsive:
+            return []
+        if data.get("type") == "SET_VOLUME":
+            volume = data.get("volume", {})
+            self.volume_level = volume.get("level", self.volume_level)
+            self.volume_muted = volume.get("muted", self.volume_muted)
+        elif data.get("type") != TYPE_GET_STATUS:
+            return []
+        return [
+            (
+                NS_RECEIVER,
+                {
+                    "type": TYPE_RECEIVER_STATUS,
+                    REQUEST_ID: data[REQUEST_ID],
+                    "status": self.receiver_status(),
+                },
+            )
+        ]
+
+
+class _Connection:  # pylint: disable=too-few-public-methods
+    """ The device end of a connection of a client. """
+
+    def __init__(self, device, sock):
+        self.device = device
+        self.socket = sock
+        self.buffer = b""
+
+
+def _encode(source_id, destination_id, namespace, data):
+    """ Returns a framed CastMessage. """
+    # pylint: disable=no-member
+    msg = cast_channel_pb2.CastMessage()
+    msg.protocol_version = msg.CASTV2_1_0
+    msg.source_id = source_id
+    msg.destination_id = destination_id
+    msg.payload_type = cast_channel_pb2.CastMessage.STRING
+    msg.namespace = namespace
+    msg.payload_utf8 = json.dumps(data)
+    return pack(">I", msg.ByteSize()) + msg.SerializeToString()
+
+
+class SimulatedNetwork:
+    """
+    Serves SimulatedDevices from a single thread. Clients connect to the
+    devices through socket_factory.
+    """
+
+    def __init__(self):
+        # dict mapping (host, port) on SimulatedDevice
+        self._devices = {}
+        # list of the open _Connections
+        self._connections = []
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._new_connections = []
+        self._waker = socket.socketpair()
+        self._selector.register(self._waker[0], selectors.EVENT_READ)
+        self._idle = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_device(self, device):
+        """ Add a device to the network. Returns the device. """
+        with self._lock:
+            self._devices[(device.host, device.port)] = device
+        return device
+
+    @property
+    def devices(self):
+        """ Returns a list of the devices of the network. """
+        with self._lock:
+            return list(self._devices.values())
+
+    def start(self):
+        """ Start the thread serving the devices. """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SimulatedNetwork", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the thread serving the devices and close all connections. """
+        self._stop.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for connection in self._connections:
+            connection.socket.close()
+        self._connections = []
+
+    def socket_factory(self, host, port, timeout):
+        """
+        Returns a socket connected to the device at host and port, for the
+        socket_factory of Chromecast and SocketClient. Raises
+        ConnectionRefusedError if there is no reachable device there.
+        """
+        with self._lock:
+            device = self._devices.get((host, port))
+            if device is None or not device.reachable:
+                raise ConnectionRefusedError(
+                    errno.ECONNREFUSED, "No device at {}:{}".format(host, port)
+                )
+            device.connections += 1
+            client, server = socket.socketpair()
+            self._new_connections.append(_Connection(device, server))
+        self._wake()
+        client.settimeout(timeout)
+        return client
+
+    def disconnect(self, device):
+        """ Drop the connections of device, as if it rebooted. """
+        with self._lock:
+            self._new_connections.append(_Connection(device, None))
+        self._wake()
+
+    def settle(self, clock, waiters, timeout=SETTLE_TIMEOUT):
+        """
+        Wait until the network has no messages left to deliver and waiters
+        threads, such as the worker threads of the clients, are blocked on
+        clock. Call it after starting the clients and after each advance of
+        the clock to make the simulation deterministic. Returns False on
+        timeout.
+        """
+        deadline = time.monotonic() + timeout
+        quiet_since = None
+        while time.monotonic() < deadline:
+            if self._idle.is_set() and clock.waiting >= waiters:
+                if quiet_since is None:
+                    quiet_since = time.monotonic()
+                elif time.monotonic() - quiet_since >= SETTLE_QUIET:
+                    return True
+            else:
+                quiet_since = None
+            time.sleep(SETTLE_QUIET / 5)
+        return False
+
+    def _wake(self):
+        """ Wake the serving thread. """
+        try:
+            self._waker[1].send(b"x")
+        except OSError:
+            pass
+
+    def _run(self):
+        """ Serve the devices until stopped. """
+        while not self._stop.is_set():
+            self._idle.set()
+            events = self._selector.select()
+            self._idle.clear()
+            for key, _ in events:
+                if key.fileobj is self._waker[0]:
+                    self._waker[0].recv(4096)
+                    self._accept()
+                else:
+                    self._read(key.data)
+
+    def _accept(self):
+        """ Register the new connections, close those of disconnected devices. """
+        with self._lock:
+            new_connections = self._new_connections
+            self._new_connections = []
+        for connection in new_connections:
+            if connection.socket is None:
+                for existing in list(self._connections):
+                    if existing.device is connection.device:
+                        self._close(existing)
+                continue
+            self._connections.append(connection)
+            self._selector.register(
+                connection.socket, selectors.EVENT_READ, connection
+            )
+
+    def _close(self, connection):
+        """ Close a connection. """
+        self._selector.unregister(connection.socket)
+        connection.socket.close()
+        self._connections.remove(connection)
+
+    def _read(self, connection):
+        """ Handle the messages a client sent on connection. """
+        try:
+            chunk = connection.socket.recv(65536)
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._close(connection)
+            return
+
+        connection.buffer += chunk
+        while len(connection.buffer) >= 4:
+            length = unpack(">I", connection.buffer[:4])[0]
+            if len(connection.buffer) < 4 + length:
+                break
+            payload = connection.buffer[4 : 4 + length]
+            connection.buffer = connection.buffer[4 + length :]
+
+            # pylint: disable=no-member
+            message = cast_channel_pb2.CastMessage()
+            message.ParseFromString(payload)
+            try:
+                data = json.loads(message.payload_utf8)
+            except ValueError:
+                continue
+            for namespace, answer in connection.device.handle(
+                message.namespace, data
+            ):
+                try:
+                    connection.socket.sendall(
+                        _encode(
+                            PLATFORM_DESTINATION_ID,
+                            message.source_id,
+                            namespace,
+                            answer,
+                        )
+                    )
+                except OSError:
+                    _LOGGER.debug("Failed to answer %s", connection.device.host)
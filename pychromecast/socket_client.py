@@ -11,21 +11,25 @@ Without him this would not have been possible.
 import errno
 import json
 import logging
-import select
 import socket
 import ssl
 import sys
 import threading
-import time
 from collections import namedtuple
 from struct import pack, unpack
 
 from . import cast_channel_pb2
-from .controllers import BaseController
+from .clock import SYSTEM_CLOCK
+from .controllers import BaseController, OptimisticOverlay, OPTIMISTIC_TIMEOUT
 from .controllers.media import MediaController
 from .const import CAST_TYPE_AUDIO, CAST_TYPE_CHROMECAST, CAST_TYPE_GROUP
 from .discovery import get_info_from_service, get_host_from_service_info
+from .resources import REGISTRY
+from .scheduler import PRIORITY_NORMAL
+from .throttle import CommandThrottle
+from .zeroconf_manager import ZEROCONF
 from .error import (
+    PyChromecastError,
     ChromecastConnectionError,
     UnsupportedNamespace,
     NotConnected,
@@ -176,7 +180,26 @@ class SocketClient(threading.Thread):
                      attempting reconnect.
     :param zconf: A zeroconf instance, needed if a list of services is passed.
                   The zeroconf instance may be obtained from the browser returned by
-                  pychromecast.start_discovery().
+                  pychromecast.start_discovery(). If None, the shared instance
+                  of pychromecast.zeroconf_manager.ZEROCONF is used. The shared
+                  instance is kept open until the socket client is cleaned up.
+    :param scheduler: A ConnectionScheduler shared by a fleet of casts, which
+                      admits connection attempts and spreads status polling.
+    :param priority: The priority of this client's connection attempts, used
+                     to apply the per-priority budgets of the scheduler.
+    :param command_rate: Maximum number of volume, mute, seek and subtitle
+                         commands sent per second. Bursts of such commands are
+                         coalesced so only the latest value is sent. None means
+                         to use the command_rate of the scheduler, if any.
+    :param optimistic: If True, the receiver and media status are updated with
+                       the expected effect of a command as soon as it is sent,
+                       and reconciled when the Chromecast answers.
+    :param clock: The clock used for heartbeats, retries and polling. None
+                  means to use the clock of the scheduler, or the system clock.
+    :param socket_factory: Function called with (host, port, timeout) which
+                           returns a connected socket to the Chromecast. None
+                           means to connect with TLS over TCP. Used to connect
+                           to simulated devices, see pychromecast.simulation.
     """
 
     def __init__(self, host, port=None, cast_type=CAST_TYPE_CHROMECAST, **kwargs):
@@ -185,6 +208,7 @@ class SocketClient(threading.Thread):
         retry_wait = kwargs.pop("retry_wait", None)
         services = kwargs.pop("services", None)
         zconf = kwargs.pop("zconf", None)
+        self.socket_factory = kwargs.pop("socket_factory", None)
 
         super(SocketClient, self).__init__()
 
@@ -192,6 +216,7 @@ class SocketClient(threading.Thread):
 
         self.logger = logging.getLogger(__name__)
         self.retry_log_fun = self.logger.error
+        self._init_fleet_options(kwargs)
 
         self._force_recon = False
 
@@ -207,6 +232,8 @@ class SocketClient(threading.Thread):
 
         self.source_id = "sender-0"
         self.stop = threading.Event()
+        REGISTRY.track_socket_client(self)
+        self._retain_zeroconf()
         # socketpair used to interrupt the worker thread
         self.socketpair = socket.socketpair()
 
@@ -219,6 +246,7 @@ class SocketClient(threading.Thread):
         self._open_channels = []
 
         self.retries = {}
+        self._init_pushed_addresses()
         self.connecting = True
         self.first_connection = True
         self.socket = None
@@ -229,6 +257,8 @@ class SocketClient(threading.Thread):
 
         self.receiver_controller = ReceiverController(cast_type)
         self.media_controller = MediaController()
+        self.receiver_controller.optimistic = self.optimistic
+        self.media_controller.optimistic = self.optimistic
         self.heartbeat_controller = HeartbeatController()
 
         self.register_handler(self.heartbeat_controller)
@@ -238,6 +268,49 @@ class SocketClient(threading.Thread):
 
         self.receiver_controller.register_status_listener(self)
 
+    def _init_fleet_options(self, kwargs):
+        """ Set up the clock, scheduling and command throttling. """
+        self.scheduler = kwargs.pop("scheduler", None)
+        self.priority = kwargs.pop("priority", PRIORITY_NORMAL)
+        self.optimistic = kwargs.pop("optimistic", False)
+        self.clock = kwargs.pop("clock", None)
+        if self.clock is None:
+            self.clock = getattr(self.scheduler, "clock", SYSTEM_CLOCK)
+        self._next_poll = None
+
+        command_rate = kwargs.pop("command_rate", None)
+        if command_rate is None:
+            command_rate = getattr(self.scheduler, "command_rate", None)
+        self.command_throttle = (
+            CommandThrottle(command_rate, clock=self.clock) if command_rate else None
+        )
+
+    def _init_pushed_addresses(self):
+        """ Set up the state for addresses pushed by discovery. """
+        # dict mapping service name on (host, port) pushed by discovery
+        self._pushed_addresses = {}
+        # The service the current connection was made through
+        self._connected_service = None
+        # Set to cut the wait between connection attempts short
+        self._reconnect_now = threading.Event()
+
+    def _retain_zeroconf(self):
+        """
+        Hold a reference to the shared zeroconf instance while this client may
+        need to resolve services.
+        """
+        if self.zconf is None and self.services != [None]:
+            self.zconf = ZEROCONF.acquire()
+            self._zconf_retained = True
+        else:
+            self._zconf_retained = ZEROCONF.retain(self.zconf)
+
+    def _release_zeroconf(self):
+        """ Release the reference to the shared zeroconf instance, if any. """
+        if self._zconf_retained:
+            self._zconf_retained = False
+            ZEROCONF.release(self.zconf)
+
     def initialize_connection(
         self,
     ):  # noqa: E501 pylint:disable=too-many-statements, too-many-branches
@@ -261,7 +334,7 @@ class SocketClient(threading.Thread):
 
         def mdns_backoff(service, retry):
             """Exponentional backoff for service name mdns lookups."""
-            now = time.time()
+            now = self.clock.time()
             retry["next_retry"] = now + retry["delay"]
             retry["delay"] = min(retry["delay"] * 2, 300)
             self.retries[service] = retry
@@ -274,7 +347,7 @@ class SocketClient(threading.Thread):
         }
 
         for service in self.services.copy():
-            now = time.time()
+            now = self.clock.time()
             retry = self.retries.get(
                 service, {"delay": self.retry_wait, "next_retry": now}
             )
@@ -293,15 +366,8 @@ class SocketClient(threading.Thread):
                 # Resolve the service name. If service is None, we're
                 # connecting directly to a host name or IP-address
                 if service:
-                    host = None
-                    port = None
-                    service_info = get_info_from_service(service, self.zconf)
-                    host, port = get_host_from_service_info(service_info)
+                    host, port = self._resolve_service(service)
                     if host and port:
-                        try:
-                            self.fn = service_info.properties[b"fn"].decode("utf-8")
-                        except (AttributeError, KeyError, UnicodeError):
-                            pass
                         self.logger.debug(
                             "[%s(%s):%s] Resolved service %s to %s:%s",
                             self.fn or "",
@@ -332,6 +398,7 @@ class SocketClient(threading.Thread):
                         # try next service
                         continue
 
+                self._wait_for_admission()
                 self.logger.debug(
                     "[%s(%s):%s] Connecting to %s:%s",
                     self.fn or "",
@@ -340,10 +407,10 @@ class SocketClient(threading.Thread):
                     self.host,
                     self.port,
                 )
-                self.socket.connect((self.host, self.port))
-                self.socket = ssl.wrap_socket(self.socket)
+                self._connect_socket()
                 self.connecting = False
                 self._force_recon = False
+                self._connected_service = service
 
                 # reset retries
                 self.retries = {}
@@ -358,6 +425,10 @@ class SocketClient(threading.Thread):
                 self.receiver_controller.update_status()
                 self.heartbeat_controller.ping()
                 self.heartbeat_controller.reset()
+                if self.scheduler is not None and self.scheduler.poll_interval:
+                    self._next_poll = (
+                        self.clock.time() + self.scheduler.first_poll_delay()
+                    )
 
                 if self.first_connection:
                     self.first_connection = False
@@ -386,6 +457,8 @@ class SocketClient(threading.Thread):
                 )
 
                 if service is not None:
+                    # Ask mDNS next time, the pushed address may be stale
+                    self._pushed_addresses.pop(service, None)
                     self.retry_log_fun(
                         "[%s(%s):%s] Failed to connect to service %s, retrying in %.1fs",
                         self.fn or "",
@@ -405,6 +478,99 @@ class SocketClient(threading.Thread):
                     )
                 raise ChromecastConnectionError("Failed to connect")
 
+    def _connect_socket(self):
+        """ Connect to the Chromecast, with TLS unless a socket_factory is set. """
+        if self.socket_factory is not None:
+            self.socket.close()
+            self.socket = self.socket_factory(self.host, self.port, self.timeout)
+            return
+        self.socket.connect((self.host, self.port))
+        self.socket = ssl.wrap_socket(self.socket)
+
+    def _resolve_service(self, service):
+        """
+        Returns the (host, port) of service, as last pushed by discovery or
+        else resolved through mDNS. (None, None) if it can't be resolved.
+        """
+        address = self._pushed_addresses.get(service)
+        if address is not None:
+            return address
+
+        service_info = get_info_from_service(service, self.zconf)
+        host, port = get_host_from_service_info(service_info)
+        if host and port:
+            try:
+                self.fn = service_info.properties[b"fn"].decode("utf-8")
+            except (AttributeError, KeyError, UnicodeError):
+                pass
+        return host, port
+
+    def update_address(self, service, host, port, services=None):
+        """
+        Called by discovery when the address or the services of the device
+        change, see CastListener.register_client. The next connection attempt
+        uses the pushed address instead of querying mDNS, and is made right
+        away. A connection made through a service which moved to another
+        address is reset.
+
+        :param service: The mDNS service name which resolves to host:port,
+                        None for a device found without mDNS.
+        :param host: The new host, None if service is gone.
+        :param port: The new port.
+        :param services: The current set of services of the device, if known.
+        """
+        if services and self.services != [None]:
+            self.services = services
+
+        if host is None:
+            self._pushed_addresses.pop(service, None)
+            return
+
+        old_address = (self.host, self.port)
+        if self.services == [None]:
+            # Connecting directly to a host, follow the device
+            moved = (host, port) != old_address
+            self.host = host
+            self.port = port
+        else:
+            self._pushed_addresses[service] = (host, port)
+            self.retries.pop(service, None)
+            moved = service == self._connected_service and (host, port) != old_address
+
+        if self.connecting:
+            self._reconnect_now.set()
+        elif moved:
+            self.logger.info(
+                "[%s(%s):%s] Device moved to %s:%s, reconnecting",
+                self.fn or "",
+                old_address[0],
+                old_address[1],
+                host,
+                port,
+            )
+            self._force_recon = True
+            try:
+                self.socketpair[1].send(b"x")
+            except socket.error:
+                pass
+
+    def _wait_for_admission(self):
+        """ Wait until the scheduler, if any, admits a connection attempt. """
+        if self.scheduler is None:
+            return
+        delay = self.scheduler.connect_delay(self.priority)
+        if not delay:
+            return
+        self.logger.debug(
+            "[%s(%s):%s] Connection attempt admitted in %.2fs",
+            self.fn or "",
+            self.host,
+            self.port,
+            delay,
+        )
+        if self.clock.wait(self.stop, delay):
+            raise ChromecastConnectionError("Stopped while waiting to connect")
+
     def connect(self):
         """
         This method is just needed for non-blocking reconnect after disconnect
@@ -505,7 +671,8 @@ class SocketClient(threading.Thread):
                         self.retry_wait,
                         self.services,
                     )
-                    time.sleep(self.retry_wait)
+                    if self.clock.wait(self._reconnect_now, self.retry_wait):
+                        self._reconnect_now.clear()
 
                 if self.curr_tries:
                     self.curr_tries -= 1
@@ -578,9 +745,16 @@ class SocketClient(threading.Thread):
             # wait for socket
             return
 
+        if self._next_poll is not None:
+            timeout = min(timeout, max(0, self._next_poll - self.clock.time()))
+        if self.command_throttle is not None:
+            command_delay = self.command_throttle.next_delay()
+            if command_delay is not None:
+                timeout = min(timeout, command_delay)
+
         # poll the socket, as well as the socketpair to allow us to be interrupted
         rlist = [self.socket, self.socketpair[0]]
-        can_read, _, _ = select.select(rlist, [], [], timeout)
+        can_read = self.clock.select(rlist, timeout, self.socketpair[1])
 
         # read messages from chromecast
         message = data = None
@@ -607,6 +781,9 @@ class SocketClient(threading.Thread):
         if self.stop.is_set():
             return
 
+        self._poll_status()
+        self._flush_commands()
+
         if not message:
             return
 
@@ -625,6 +802,63 @@ class SocketClient(threading.Thread):
 
         return
 
+    def _poll_status(self):
+        """ Refresh receiver and media status if the scheduler says it's time. """
+        if (
+            self._next_poll is None
+            or self.connecting
+            or self.clock.time() < self._next_poll
+        ):
+            return
+
+        self._next_poll = self.clock.time() + self.scheduler.next_poll_delay()
+        try:
+            self.receiver_controller.update_status()
+            if self.media_controller.is_active:
+                self.media_controller.update_status()
+        except NotConnected:
+            pass
+
+    def _flush_commands(self):
+        """ Send the coalesced commands the throttle allows to be sent now. """
+        if self.command_throttle is None or self.connecting:
+            return
+
+        for send in self.command_throttle.flush():
+            try:
+                send()
+            except (NotConnected, UnsupportedNamespace, PyChromecastStopped) as exc:
+                self.logger.debug(
+                    "[%s(%s):%s] Dropping coalesced command: %s",
+                    self.fn or "",
+                    self.host,
+                    self.port,
+                    exc,
+                )
+
+    def send_coalesced(self, key, send, dropped=None):
+        """
+        Send an idempotent command through the command throttle. While the
+        command is waiting to be sent, it will be replaced by later commands
+        with the same key.
+
+        :param key: Identifies the setting the command changes.
+        :param send: Function which sends the command.
+        :param dropped: Function called if the command is replaced or dropped
+                        before it is sent.
+        """
+        if self.command_throttle is None or self.command_throttle.submit(
+            key, send, dropped
+        ):
+            send()
+            return
+
+        try:
+            # Write to the socket to have the worker thread pick up the command
+            self.socketpair[1].send(b"x")
+        except socket.error:
+            pass
+
     def get_socket(self):
         """
         Returns the socket of the connection to use it in you own
@@ -767,6 +1001,32 @@ class SocketClient(threading.Thread):
         self.socketpair[1].close()
 
         self.connecting = True
+        self._next_poll = None
+        if self.command_throttle is not None:
+            self.command_throttle.clear()
+        self._release_zeroconf()
+        REGISTRY.untrack_socket_client(self)
+
+    def close(self):
+        """
+        Release the sockets of a socket client whose worker thread is not
+        running. Use disconnect to stop a running worker thread.
+        """
+        self.stop.set()
+        for sock in (self.socket,) + tuple(self.socketpair):
+            if sock is not None:
+                sock.close()
+        self._release_zeroconf()
+        REGISTRY.untrack_socket_client(self)
+
+    @property
+    def open_socket_count(self):
+        """ Number of sockets currently held, including the socketpair. """
+        return sum(
+            1
+            for sock in (self.socket,) + tuple(self.socketpair)
+            if sock is not None and sock.fileno() != -1
+        )
 
     def _report_connection_status(self, status):
         """ Report a change in the connection status to any listeners """
@@ -851,7 +1111,10 @@ class SocketClient(threading.Thread):
         no_add_request_id=False,
         force=False,
     ):
-        """ Send a message to the Chromecast. """
+        """
+        Send a message to the Chromecast. Returns False if writing to the
+        socket failed, in which case the connection will be reestablished.
+        """
 
         # namespace is a string containing namespace
         # data is a dict that will be converted to json
@@ -911,10 +1174,12 @@ class SocketClient(threading.Thread):
                     self.host,
                     self.port,
                 )
+                return False
         else:
             raise NotConnected(
                 "Chromecast {}:{} is connecting...".format(self.host, self.port)
             )
+        return True
 
     def send_platform_message(
         self, namespace, message, inc_session_id=False, callback_function_param=False
@@ -953,6 +1218,13 @@ class SocketClient(threading.Thread):
             listener.new_connection_status(status) """
         self._connection_listeners.append(listener)
 
+    def unregister_connection_listener(self, listener):
+        """ Unregister a listener registered with register_connection_listener. """
+        # Replace the list, it may be iterated by the worker thread
+        self._connection_listeners = [
+            item for item in self._connection_listeners if item is not listener
+        ]
+
     def _ensure_channel_connected(self, destination_id):
         """ Ensure we opened a channel to destination_id. """
         if destination_id not in self._open_channels:
@@ -1039,7 +1311,7 @@ class HeartbeatController(BaseController):
     def __init__(self):
         super(HeartbeatController, self).__init__(NS_HEARTBEAT, target_platform=True)
         self.last_ping = 0
-        self.last_pong = time.time()
+        self.last_pong = self.clock.time()
 
     def receive_message(self, message, data):
         """ Called when a heartbeat message is received. """
@@ -1070,7 +1342,7 @@ class HeartbeatController(BaseController):
 
     def ping(self):
         """ Send a ping message. """
-        self.last_ping = time.time()
+        self.last_ping = self.clock.time()
         try:
             self.send_message({MESSAGE_TYPE: TYPE_PING})
         except NotConnected:
@@ -1080,14 +1352,14 @@ class HeartbeatController(BaseController):
 
     def reset(self):
         """ Reset expired counter. """
-        self.last_pong = time.time()
+        self.last_pong = self.clock.time()
 
     def is_expired(self):
         """ Indicates if connection has expired. """
-        if time.time() - self.last_ping > HB_PING_TIME:
+        if self.clock.time() - self.last_ping > HB_PING_TIME:
             self.ping()
 
-        return (time.time() - self.last_pong) > HB_PING_TIME + HB_PONG_TIME
+        return (self.clock.time() - self.last_pong) > HB_PING_TIME + HB_PONG_TIME
 
 
 class ReceiverController(BaseController):
@@ -1106,6 +1378,16 @@ class ReceiverController(BaseController):
         self.cast_type = cast_type
         self.app_launch_event = threading.Event()
         self.app_launch_event_function = None
+        self.app_launch_failure_function = None
+        # Volume level requested but not yet acknowledged by the device, and
+        # the time it was requested
+        self._pending_volume = None
+        self._pending_volume_time = None
+        self._volume_requests = 0
+        # Status as reported by the device, without optimistic updates
+        self._device_status = None
+        self.optimistic = False
+        self._overlay = OptimisticOverlay()
 
         self._status_listeners = []
         self._launch_error_listeners = []
@@ -1114,12 +1396,28 @@ class ReceiverController(BaseController):
         """ Called when disconnected. Will erase status. """
         self.logger.info("Receiver:channel_disconnected")
         self.status = None
+        self._pending_volume = None
+        self._device_status = None
+        self._overlay.clear()
 
     @property
     def app_id(self):
         """ Convenience method to retrieve current app id. """
         return self.status.app_id if self.status else None
 
+    @property
+    def volume_level(self):
+        """
+        The volume level most recently requested, or the volume level reported
+        by the Chromecast if there are no unacknowledged volume requests.
+        """
+        if (
+            self._pending_volume is not None
+            and self.clock.time() - self._pending_volume_time < OPTIMISTIC_TIMEOUT
+        ):
+            return self._pending_volume
+        return self.status.volume_level if self.status else None
+
     def receive_message(self, message, data):
         """ Called when a receiver-message has been received. """
         if data[MESSAGE_TYPE] == TYPE_RECEIVER_STATUS:
@@ -1132,6 +1430,11 @@ class ReceiverController(BaseController):
 
             return True
 
+        if self._overlay.reject(data.get(REQUEST_ID)):
+            # The device refused a command, roll back its optimistic update
+            self.status = self._apply_overlay()
+            self._report_status()
+
         return False
 
     def register_status_listener(self, listener):
@@ -1153,28 +1456,38 @@ class ReceiverController(BaseController):
             {MESSAGE_TYPE: TYPE_GET_STATUS}, callback_function=callback_function_param
         )
 
-    def launch_app(self, app_id, force_launch=False, callback_function=False):
+    def launch_app(
+        self, app_id, force_launch=False, callback_function=False, failure_function=None
+    ):
         """ Launches an app on the Chromecast.
 
             Will only launch if it is not currently running unless
-            force_launch=True. """
+            force_launch=True.
+
+            failure_function is called with a LaunchFailure if the app
+            fails to launch. """
 
         if not force_launch and self.status is None:
             self.update_status(
                 lambda response: self._send_launch_message(
-                    app_id, force_launch, callback_function
+                    app_id, force_launch, callback_function, failure_function
                 )
             )
         else:
-            self._send_launch_message(app_id, force_launch, callback_function)
+            self._send_launch_message(
+                app_id, force_launch, callback_function, failure_function
+            )
 
-    def _send_launch_message(self, app_id, force_launch=False, callback_function=False):
+    def _send_launch_message(
+        self, app_id, force_launch=False, callback_function=False, failure_function=None
+    ):
         if force_launch or self.app_id != app_id:
             self.logger.info("Receiver:Launching app %s", app_id)
 
             self.app_to_launch = app_id
             self.app_launch_event.clear()
             self.app_launch_event_function = callback_function
+            self.app_launch_failure_function = failure_function
             self.launch_failure = None
 
             self.send_message({MESSAGE_TYPE: TYPE_LAUNCH, APP_ID: app_id})
@@ -1192,19 +1505,111 @@ class ReceiverController(BaseController):
             callback_function=callback_function_param,
         )
 
-    def set_volume(self, volume):
+    def set_volume(self, volume, callback_function=None, failure_function=None):
         """ Allows to set volume. Should be value between 0..1.
         Returns the new volume.
 
+        callback_function is called with the response of the Chromecast.
+        failure_function is called if the request could not be sent, or was
+        replaced by a later volume request before it was sent.
         """
         volume = min(max(0, volume), 1)
         self.logger.info("Receiver:setting volume to %.1f", volume)
-        self.send_message({MESSAGE_TYPE: "SET_VOLUME", "volume": {"level": volume}})
+        self._volume_requests += 1
+        request = self._volume_requests
+        self._pending_volume = volume
+        self._pending_volume_time = self.clock.time()
+
+        def volume_settled():
+            """ Stop tracking the volume once the latest request is done. """
+            if request == self._volume_requests:
+                self._pending_volume = None
+
+        def volume_done(response):
+            """ Called with the response of the Chromecast. """
+            volume_settled()
+            if callback_function:
+                callback_function(response)
+
+        def volume_failed():
+            """ Called if the request was not sent. """
+            volume_settled()
+            if failure_function:
+                failure_function()
+
+        self._send_volume_message(
+            "volume",
+            {MESSAGE_TYPE: "SET_VOLUME", "volume": {"level": volume}},
+            {"volume_level": volume},
+            callback_function=volume_done,
+            failure_function=volume_failed,
+        )
         return volume
 
-    def set_volume_muted(self, muted):
-        """ Allows to mute volume. """
-        self.send_message({MESSAGE_TYPE: "SET_VOLUME", "volume": {"muted": muted}})
+    def set_volume_muted(self, muted, callback_function=None, failure_function=None):
+        """ Allows to mute volume.
+
+        callback_function is called with the response of the Chromecast.
+        failure_function is called if the request could not be sent, or was
+        replaced by a later mute request before it was sent.
+        """
+        self._send_volume_message(
+            "muted",
+            {MESSAGE_TYPE: "SET_VOLUME", "volume": {"muted": muted}},
+            {"volume_muted": muted},
+            callback_function=callback_function,
+            failure_function=failure_function,
+        )
+
+    def _send_volume_message(
+        self, key, data, expected, callback_function=None, failure_function=None
+    ):
+        """
+        Send a SET_VOLUME message through the command throttle. If optimistic,
+        the expected CastStatus fields are updated right away.
+
+        failure_function is called if the message could not be sent, or was
+        replaced by a later message before it was sent.
+        """
+        self._check_registered()
+
+        entries = []
+        if self.optimistic and self._device_status is not None:
+            entries = self._overlay.add(expected, self.clock.time())
+            self.status = self._apply_overlay()
+            self._report_status()
+
+        def failed():
+            """ Roll back the effects of a message which was not sent. """
+            if failure_function:
+                failure_function()
+            if entries:
+                self._overlay.discard(entries)
+                self.status = self._apply_overlay()
+                self._report_status()
+
+        def send():
+            """ Send the message and tag the optimistic update with its id. """
+            try:
+                sent = self.send_message(data, callback_function=callback_function)
+            except PyChromecastError:
+                failed()
+                raise
+            if sent is False:
+                failed()
+                return
+            self._overlay.tag(entries, data.get(REQUEST_ID))
+
+        self._socket_client.send_coalesced((self.namespace, key), send, failed)
+
+    def _apply_overlay(self):
+        """
+        Returns the status reported by the device, updated with the expected
+        effect of the commands it has not answered yet.
+        """
+        if self._device_status is None or not self._overlay:
+            return self._device_status
+        return self._device_status._replace(**self._overlay.values())
 
     @staticmethod
     def _parse_status(data, cast_type):
@@ -1245,7 +1650,9 @@ class ReceiverController(BaseController):
         """ Processes a received STATUS message and notifies listeners. """
         status = self._parse_status(data, self.cast_type)
         is_new_app = self.app_id != status.app_id and self.app_to_launch
-        self.status = status
+        self._device_status = status
+        self._overlay.settle(data.get(REQUEST_ID), self.clock.time())
+        self.status = self._apply_overlay()
 
         self.logger.debug("Received status: %s", self.status)
         self._report_status()
@@ -1257,6 +1664,7 @@ class ReceiverController(BaseController):
                 self.logger.debug("Start app_launch_event_function...")
                 self.app_launch_event_function()
                 self.app_launch_event_function = None
+            self.app_launch_failure_function = None
 
     def _report_status(self):
         """ Reports the current status to all listeners. """
@@ -1290,6 +1698,9 @@ class ReceiverController(BaseController):
         if self.app_to_launch:
             self.app_to_launch = None
             self.app_launch_event.set()
+            if self.app_launch_failure_function:
+                self.app_launch_failure_function(launch_failure)
+                self.app_launch_failure_function = None
 
         self.logger.debug("Launch status: %s", launch_failure)
 
@@ -1309,6 +1720,10 @@ class ReceiverController(BaseController):
         self.launch_failure = None
         self.app_to_launch = None
         self.app_launch_event.clear()
+        self.app_launch_failure_function = None
+        self._pending_volume = None
+        self._device_status = None
+        self._overlay.clear()
 
         self._status_listeners[:] = []
 
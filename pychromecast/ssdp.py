@@ -0,0 +1,255 @@
+"""
+Discovers Chromecasts on the network using SSDP and DIAL.
+
+SSDP discovery runs next to mDNS discovery and adds the devices it finds to
+the same CastListener, which deduplicates devices by UUID. It helps on
+networks where mDNS answers are rate limited or dropped.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import socket
+import threading
+from urllib.parse import urlparse
+from uuid import UUID
+from xml.etree import ElementTree
+
+import requests
+
+from .clock import SYSTEM_CLOCK
+from .dial import XML_NS_UPNP_DEVICE
+
+SSDP_ADDR = "239.255.255.250"
+SSDP_PORT = 1900
+DIAL_SEARCH_TARGET = "urn:dial-multiscreen-org:service:dial:1"
+SOURCE_SSDP = "ssdp"
+
+# Port on which cast devices serve their DIAL device description
+DIAL_PORT = 8008
+# Port of the cast protocol
+CAST_PORT = 8009
+# Seconds to collect answers to a search
+SEARCH_TIMEOUT = 2
+# Seconds between searches when running in the background
+SEARCH_INTERVAL = 60
+# Number of device descriptions fetched in parallel
+FETCH_WORKERS = 8
+# Seconds to wait for a device description
+FETCH_TIMEOUT = 5
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def build_search_request(search_target=DIAL_SEARCH_TARGET, mx=1):
+    """ Returns an SSDP M-SEARCH request for search_target. """
+    return (
+        "M-SEARCH * HTTP/1.1\r\n"
+        "HOST: {}:{}\r\n"
+        'MAN: "ssdp:discover"\r\n'
+        "MX: {}\r\n"
+        "ST: {}\r\n"
+        "\r\n".format(SSDP_ADDR, SSDP_PORT, mx, search_target).encode("ascii")
+    )
+
+
+def parse_search_response(data):
+    """
+    Returns the headers of an SSDP search response as a dict with lower case
+    keys, or None if data is not a successful response.
+    """
+    try:
+        lines = data.decode("utf-8", "replace").split("\r\n")
+    except AttributeError:
+        return None
+    if not lines or not lines[0].startswith("HTTP/1.1 200"):
+        return None
+
+    headers = {}
+    for line in lines[1:]:
+        key, sep, value = line.partition(":")
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def uuid_from_usn(usn):
+    """ Returns the UUID in an SSDP USN header, or None. """
+    if not usn or not usn.lower().startswith("uuid:"):
+        return None
+    try:
+        return UUID(usn[5:].split("::")[0])
+    except ValueError:
+        return None
+
+
+def parse_device_description(xml):
+    """
+    Returns a (uuid, model_name, friendly_name, manufacturer) tuple parsed from
+    a DIAL device description, or None if it doesn't describe a device.
+    """
+    try:
+        device = ElementTree.fromstring(xml).find(XML_NS_UPNP_DEVICE + "device")
+    except ElementTree.ParseError:
+        return None
+    if device is None:
+        return None
+
+    def get_text(tag, default=None):
+        """ Returns the text of a child of the device element. """
+        text = device.findtext(XML_NS_UPNP_DEVICE + tag)
+        return text.strip() if text else default
+
+    uuid = uuid_from_usn(get_text("UDN"))
+    if uuid is None:
+        return None
+    return (
+        uuid,
+        get_text("modelName", "Unknown model name"),
+        get_text("friendlyName", "Unknown Chromecast"),
+        get_text("manufacturer", "Unknown manufacturer"),
+    )
+
+
+def get_device_description(location, timeout=FETCH_TIMEOUT):
+    """
+    Fetches and parses the DIAL device description at location. Returns the
+    tuple returned by parse_device_description, or None.
+    """
+    try:
+        req = requests.get(location, timeout=timeout)
+        req.raise_for_status()
+    except requests.exceptions.RequestException as err:
+        _LOGGER.debug("Failed to fetch device description %s: %s", location, err)
+        return None
+    return parse_device_description(req.content)
+
+
+class SsdpDiscovery:
+    """
+    Discovers cast devices with SSDP M-SEARCH requests for DIAL, and adds them
+    to a CastListener with CastListener.add_device.
+
+    Answers are collected for search_timeout seconds, the device descriptions
+    are fetched in parallel while answers are still arriving. Devices which
+    are already known to the listener, through any source, are not fetched.
+    Only DIAL servers on the port used by cast devices are considered, which
+    skips most other DIAL devices such as TVs.
+
+    :param listener: The CastListener to add the devices to.
+    :param search_interval: Seconds between searches when started with start.
+    :param search_timeout: Seconds to collect answers to a search.
+    :param fetch_workers: Number of device descriptions fetched in parallel.
+    :param clock: The clock used to wait.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        listener,
+        search_interval=SEARCH_INTERVAL,
+        search_timeout=SEARCH_TIMEOUT,
+        fetch_workers=FETCH_WORKERS,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.listener = listener
+        self.search_interval = search_interval
+        self.search_timeout = search_timeout
+        self.fetch_workers = fetch_workers
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def search(self):
+        """
+        Run one search and wait for the device descriptions to be fetched.
+        Returns the number of devices added to the listener.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.setblocking(False)
+        try:
+            request = build_search_request()
+            # Sent twice as UDP may be dropped
+            for _ in range(2):
+                sock.sendto(request, (SSDP_ADDR, SSDP_PORT))
+
+            with ThreadPoolExecutor(
+                self.fetch_workers, thread_name_prefix="SsdpDiscovery"
+            ) as executor:
+                futures = [
+                    executor.submit(self._add_device, location)
+                    for location in self._receive_locations(sock)
+                ]
+            return sum(future.result() for future in futures)
+        finally:
+            sock.close()
+
+    def _receive_locations(self, sock):
+        """
+        Yields the location of each new cast device answering the search,
+        until search_timeout has passed.
+        """
+        deadline = self.clock.time() + self.search_timeout
+        seen = set()
+        while not self._stop.is_set():
+            remaining = deadline - self.clock.time()
+            if remaining <= 0:
+                return
+            if sock not in self.clock.select([sock], remaining):
+                continue
+            try:
+                data, _ = sock.recvfrom(4096)
+            except OSError:
+                continue
+
+            headers = parse_search_response(data)
+            if headers is None or "location" not in headers:
+                continue
+            location = headers["location"]
+            uuid = uuid_from_usn(headers.get("usn"))
+            if location in seen or uuid in self.listener.sources:
+                continue
+            seen.add(location)
+            if urlparse(location).port == DIAL_PORT:
+                yield location
+
+    def _add_device(self, location):
+        """
+        Fetch a device description and add the device to the listener.
+        Returns True if the device was added.
+        """
+        description = get_device_description(location)
+        if description is None:
+            return False
+        uuid, model_name, friendly_name, _ = description
+        return self.listener.add_device(
+            SOURCE_SSDP,
+            uuid,
+            model_name,
+            friendly_name,
+            urlparse(location).hostname,
+            CAST_PORT,
+        )
+
+    def start(self):
+        """ Search every search_interval seconds in a background thread. """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SsdpDiscovery", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """ Stop searching. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Search until stopped. """
+        while not self._stop.is_set():
+            try:
+                self.search()
+            except OSError as err:
+                _LOGGER.debug("SSDP search failed: %s", err)
+            self.clock.wait(self._stop, self.search_interval)
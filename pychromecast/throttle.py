@@ -0,0 +1,78 @@
+"""
+Rate limits and coalesces commands sent to a Chromecast.
+"""
+from collections import OrderedDict
+import threading
+
+from .clock import SYSTEM_CLOCK
+from .scheduler import TokenBucket
+
+
+class CommandThrottle:
+    """
+    Token bucket for the commands sent to a single device.
+
+    Commands are submitted with a key. While a command is waiting for the
+    bucket, submitting another command with the same key replaces it, so only
+    the latest value is sent. This makes it only suitable for idempotent
+    commands such as setting the volume or seeking.
+
+    :param rate: Maximum number of commands sent per second.
+    :param burst: Number of commands which may be sent back to back.
+    :param clock: The clock used to refill the bucket.
+    """
+
+    def __init__(self, rate, burst=1, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self._bucket = TokenBucket(rate, burst)
+        # dict mapping key on (send, dropped) of the latest command
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, send, dropped=None):
+        """
+        Submit a command. Returns True if the command may be sent right away,
+        in which case the caller is responsible for calling send. Otherwise the
+        command is queued until flush releases it.
+
+        :param dropped: Function called if the command is replaced by a later
+                        command or cleared before it is sent.
+        """
+        replaced = None
+        with self._lock:
+            if key in self._pending:
+                replaced = self._pending[key][1]
+                self._pending[key] = (send, dropped)
+            elif not self._pending and self._bucket.try_acquire(self.clock.time()) == 0:
+                return True
+            else:
+                self._pending[key] = (send, dropped)
+        if replaced is not None:
+            replaced()
+        return False
+
+    def flush(self):
+        """ Returns a list of the queued send functions which may be called now. """
+        ready = []
+        with self._lock:
+            while self._pending and self._bucket.try_acquire(self.clock.time()) == 0:
+                ready.append(self._pending.popitem(last=False)[1][0])
+        return ready
+
+    def next_delay(self):
+        """
+        Returns the number of seconds until the next queued command may be sent,
+        or None if no commands are queued.
+        """
+        with self._lock:
+            if not self._pending:
+                return None
+            return self._bucket.delay(self.clock.time())
+
+    def clear(self):
+        """ Drop all queued commands. """
+        with self._lock:
+            dropped = [entry[1] for entry in self._pending.values() if entry[1]]
+            self._pending.clear()
+        for function in dropped:
+            function()
@@ -0,0 +1,80 @@
+"""
+Process wide, reference counted zeroconf instance.
+
+Discovery browsers and socket clients acquire the shared instance from
+ZEROCONF and release it when they are done with it. The instance is created
+by the first user and closed when the last user releases it, so all users
+share its multicast sockets, thread and mDNS cache.
+"""
+import logging
+import threading
+
+import zeroconf
+
+from .resources import REGISTRY
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ZeroconfManager:
+    """
+    Reference counted zeroconf instance.
+
+    :param factory: Function creating a zeroconf instance.
+    """
+
+    def __init__(self, factory=zeroconf.Zeroconf):
+        self._factory = factory
+        self._zconf = None
+        self._refcount = 0
+        self._lock = threading.Lock()
+
+    @property
+    def refcount(self):
+        """ Number of users of the shared instance. """
+        return self._refcount
+
+    def is_managed(self, zconf):
+        """ Returns True if zconf is the shared instance. """
+        return zconf is not None and zconf is self._zconf
+
+    def acquire(self):
+        """ Returns the shared instance, creating it if needed. """
+        with self._lock:
+            if self._zconf is None:
+                _LOGGER.debug("Creating shared zeroconf instance")
+                self._zconf = self._factory()
+                REGISTRY.track_zeroconf(self._zconf)
+            self._refcount += 1
+            return self._zconf
+
+    def retain(self, zconf):
+        """
+        Add a user to zconf if it is the shared instance. Returns True if it
+        is, in which case the caller must release it when done.
+        """
+        with self._lock:
+            if not self.is_managed(zconf):
+                return False
+            self._refcount += 1
+            return True
+
+    def release(self, zconf):
+        """
+        Remove a user of zconf, closing the shared instance when its last user
+        releases it. Returns False if zconf is not the shared instance.
+        """
+        with self._lock:
+            if not self.is_managed(zconf):
+                return False
+            self._refcount -= 1
+            if self._refcount > 0:
+                return True
+            self._zconf = None
+            self._refcount = 0
+        _LOGGER.debug("Closing shared zeroconf instance")
+        zconf.close()
+        return True
+
+
+ZEROCONF = ZeroconfManager()